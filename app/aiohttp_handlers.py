@@ -1,10 +1,18 @@
 import asyncio
 import json
+import time
 import typing
+from collections import deque
+from typing import Optional
 
-from aiohttp import ClientSession
+from aiohttp import ClientSession, ClientTimeout
 
-from config import PARALLEL_REQUESTS
+from app.config import PARALLEL_REQUESTS, FETCH_DEADLINE, FETCH_TIMEOUT, FETCH_RETRIES, FETCH_HEDGE_PERCENTILE, \
+    FETCH_HEDGE_MIN_DELAY, FETCH_LATENCY_WINDOW
+from app.logger import get_logger
+from app.utils import get_percentile
+
+logger = get_logger('aiohttp_handlers')
 
 
 async def execute_gather(*concurrency_tasks):
@@ -18,19 +26,23 @@ async def execute_gather(*concurrency_tasks):
     await asyncio.gather(*(semaphore_task(task) for task in concurrency_tasks))
 
 
-async def request_async(session: ClientSession, method, url, data, headers, result_handler=None):
-
+async def _request(session: ClientSession, method, url, data, headers,
+                   timeout: float = None) -> tuple[int, Optional[dict]]:
+    """
+    Make request, return status and decoded result
+    """
     try:
         result = None
         status = -1
+        kwargs = {'timeout': ClientTimeout(total=timeout)} if timeout else {}
         if method == 'GET':
-            async with session.get(url, data=data, headers=headers, ssl=False) as response:
+            async with session.get(url, data=data, headers=headers, ssl=False, **kwargs) as response:
                 status = response.status
                 if 200 <= status <= 299:
                     result = await response.read()
 
         elif method == 'POST':
-            async with session.post(url, data=data, headers=headers, ssl=False) as response:
+            async with session.post(url, data=data, headers=headers, ssl=False, **kwargs) as response:
                 status = response.status
                 if 200 <= status <= 299:
                     result = await response.read()
@@ -43,6 +55,13 @@ async def request_async(session: ClientSession, method, url, data, headers, resu
     except Exception as e:
         result = None
 
+    return status, result
+
+
+def handle_result(result_handler, status: int, result: Optional[dict]) -> None:
+    """
+    Pass request result to result handler: callable, object with request_result_handler or request_result
+    """
     if result_handler is not None:
 
         try:
@@ -57,14 +76,105 @@ async def request_async(session: ClientSession, method, url, data, headers, resu
                 result_handler.request_result = {'status': status, 'result': result}
 
             else:
-                print(status)
-                print(result)
+                logger.info('Request result: status = %s, result = %s', status, result)
 
         except Exception as e:
-            print(str(e))
-            print(status)
-            print(result)
+            logger.exception('Request result handler error: status = %s, result = %s', status, result)
 
     else:
-        print(status)
-        print(result)
+        logger.info('Request result: status = %s, result = %s', status, result)
+
+
+async def request_async(session: ClientSession, method, url, data, headers, result_handler=None, timeout: float = None):
+
+    status, result = await _request(session, method, url, data, headers, timeout)
+    handle_result(result_handler, status, result)
+
+
+class LatencyTracker:
+    """
+    Latencies of recent successful requests to calculate hedging delay
+    """
+    def __init__(self, size: int = FETCH_LATENCY_WINDOW):
+        self._latencies: deque = deque(maxlen=size)
+
+    def add(self, latency: float) -> None:
+        self._latencies.append(latency)
+
+    def get_percentile(self, percentile: float) -> Optional[float]:
+        if not self._latencies:
+            return None
+        return get_percentile(sorted(self._latencies), percentile)
+
+    def __len__(self):
+        return len(self._latencies)
+
+
+latency_tracker = LatencyTracker()
+
+
+def _is_success(status: int, result: Optional[dict]) -> bool:
+    return 200 <= status <= 299 and result is not None
+
+
+async def _timed_request(session: ClientSession, method, url, data, headers) -> tuple[int, Optional[dict]]:
+    start = time.perf_counter()
+    status, result = await _request(session, method, url, data, headers, FETCH_TIMEOUT)
+    if _is_success(status, result):
+        latency_tracker.add(time.perf_counter() - start)
+    return status, result
+
+
+async def hedged_request(session: ClientSession, method, url, data, headers,
+                         hedge_delay: float) -> tuple[int, Optional[dict]]:
+    """
+    Make request, send duplicate request if there isn't answer after hedge delay, the first successful answer wins
+    Failed requests are retried FETCH_RETRIES times
+    """
+    status, result = -1, None
+    for attempt in range(FETCH_RETRIES + 1):
+        tasks = {asyncio.ensure_future(_timed_request(session, method, url, data, headers))}
+        done, pending = await asyncio.wait(tasks, timeout=hedge_delay)
+        if not done:
+            tasks.add(asyncio.ensure_future(_timed_request(session, method, url, data, headers)))
+
+        try:
+            while tasks:
+                done, tasks = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    status, result = task.result()
+                    if _is_success(status, result):
+                        return status, result
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    return status, result
+
+
+async def fetch_with_deadline(session: ClientSession, requests: list, result_handler, deadline: float = FETCH_DEADLINE):
+    """
+    Make requests in parallel with hedging and retries and wait them until deadline
+    Results arrived by deadline are passed to result handler, tasks of the rest are returned,
+    so caller can reconcile their results later
+    """
+    semaphore = asyncio.Semaphore(PARALLEL_REQUESTS)
+    hedge_delay = max(FETCH_HEDGE_MIN_DELAY, latency_tracker.get_percentile(FETCH_HEDGE_PERCENTILE) or FETCH_TIMEOUT)
+
+    async def semaphore_task(request):
+        async with semaphore:
+            return await hedged_request(session, *request, hedge_delay=hedge_delay)
+
+    tasks = [asyncio.ensure_future(semaphore_task(request)) for request in requests]
+    if not tasks:
+        return set()
+
+    done, pending = await asyncio.wait(tasks, timeout=deadline)
+    for task in tasks:
+        if task in done:
+            handle_result(result_handler, *task.result())
+
+    if pending:
+        logger.warning('%s of %s requests have not been finished by deadline', len(pending), len(tasks),
+                       extra={'pending_count': len(pending), 'deadline': deadline, 'hedge_delay': hedge_delay})
+    return pending
@@ -0,0 +1,262 @@
+"""
+Alert dispatch pipeline
+Decisions are turned into alerts which are deduplicated, filtered by cooldown, batched per minute and
+put into asynchronous queue. A worker task sends the batches to pluggable sinks, so alert I/O never blocks
+indicator calculation
+"""
+
+import asyncio
+import json
+import logging
+from collections import deque
+from datetime import datetime, timedelta
+from logging.handlers import RotatingFileHandler
+from typing import Optional
+
+import aiohttp
+
+from app.clock import get_clock
+from app.config import TRACKING_PERIOD, ALERT_SINKS, ALERT_COOLDOWN, ALERT_QUEUE_SIZE, ALERT_FILE, \
+    ALERT_FILE_MAX_BYTES, ALERT_FILE_BACKUP_COUNT, ALERT_WEBHOOK_URL, ALERT_WEBHOOK_TIMEOUT, ALERT_HISTORY_SIZE
+from app.logger import get_logger
+from app.models import KlineHistory, KlineWindow
+from app.utils import ftod
+
+logger = get_logger('alerts')
+
+
+class Alert:
+    """
+    Alert about one symbol, it can combine several signals raised in the same minute,
+    one signal per tag and tracking window
+    """
+    def __init__(self, time_kline: datetime, symbol_key: str):
+        self.time_kline: datetime = time_kline
+        self.symbol_key: str = symbol_key
+        self.created: datetime = get_clock().now()
+        self.tags: list = list()
+        self.signals: list = list()
+
+    def _add(self, signal: dict) -> None:
+        if signal['tag'] not in self.tags:
+            self.tags.append(signal['tag'])
+        self.signals.append(signal)
+
+    def add_signal(self, tag: str, tracking_period: int, change_in_percent, minutes: int, btc_impact_rate) -> None:
+        self._add({
+            'tag': tag,
+            'tracking_period': tracking_period,
+            'change_in_percent': str(ftod(change_in_percent, 4)),
+            'minutes': minutes,
+            'btc_impact_rate': str(btc_impact_rate),
+        })
+
+    def add_volume_signal(self, tracking_period: int, volume_z_score, turnover_z_score) -> None:
+        self._add({
+            'tag': 'volume_spike',
+            'tracking_period': tracking_period,
+            'volume_z_score': str(ftod(volume_z_score, 2)),
+            'turnover_z_score': str(ftod(turnover_z_score, 2)) if turnover_z_score is not None else None,
+        })
+
+    def merge(self, alert: 'Alert') -> None:
+        """
+        Add signals of alert about the same symbol, signals of other tracking windows with the same tag are kept
+        """
+        keys = {(signal['tag'], signal['tracking_period']) for signal in self.signals}
+        for signal in alert.signals:
+            if (signal['tag'], signal['tracking_period']) not in keys:
+                self._add(signal)
+
+    def add_rule_signal(self, tag: str, tracking_period: int) -> None:
+        self._add({
+            'tag': tag,
+            'tracking_period': tracking_period,
+        })
+
+    @classmethod
+    def from_kline(cls, kline: KlineHistory | KlineWindow, tags: list = ()) -> 'Alert':
+        """
+        Make alert from kline (or indicators of additional tracking window) with tags of satisfied decision rules
+        Price growth and decline signals carry the change, signals of other rules carry their tag only
+        """
+        alert = cls(kline.time_kline, kline.symbol_key)
+        tracking_period = getattr(kline, 'tracking_period', TRACKING_PERIOD)
+        for tag in tags:
+            if tag == 'growth':
+                alert.add_signal('growth', tracking_period, abs(kline.delta_to_min_in_percent) * 100,
+                                 kline.time_since_min, kline.btc_impact_rate)
+            elif tag == 'decline':
+                alert.add_signal('decline', tracking_period, abs(kline.delta_to_max_in_percent) * 100,
+                                 kline.time_since_max, kline.btc_impact_rate)
+            else:
+                alert.add_rule_signal(tag, tracking_period)
+        if getattr(kline, 'is_volume_spike', False):
+            alert.add_volume_signal(tracking_period, kline.volume_z_score, kline.turnover_z_score)
+        return alert
+
+    def to_dict(self) -> dict:
+        return {
+            'time_kline': self.time_kline.isoformat(),
+            'symbol_key': self.symbol_key,
+            'created': self.created.isoformat(),
+            'tags': self.tags,
+            'signals': self.signals,
+        }
+
+    def __str__(self):
+        lines = []
+        for signal in self.signals:
+            if signal['tag'] == 'growth':
+                lines.append(f"      Цена фьючерса {self.symbol_key} "
+                             f"выросла на {float(signal['change_in_percent']):.2f} % "
+                             f"за {signal['minutes']} мин.")
+            elif signal['tag'] == 'decline':
+                lines.append(f"      Цена фьючерса {self.symbol_key} "
+                             f"упала на {float(signal['change_in_percent']):.2f} % "
+                             f"за {signal['minutes']} мин.")
+            elif signal['tag'] == 'volume_spike':
+                lines.append(f"      Объём фьючерса {self.symbol_key} "
+                             f"аномально вырос: z = {float(signal['volume_z_score']):.2f}")
+            else:
+                lines.append(f"      {self.symbol_key}: {signal['tag']}")
+        return '\n'.join(lines)
+
+
+class StdoutSink:
+    """
+    Write alerts to stdout through application logger, output is made by logging listener thread
+    """
+    def __init__(self):
+        self._logger = get_logger('alerts.stdout')
+
+    async def send(self, alerts: list) -> None:
+        for alert in alerts:
+            self._logger.info('%s УРА!!!\n%s', alert.created, alert, extra={'alert': alert.to_dict()})
+
+
+class RotatingFileSink:
+    """
+    Write alerts as JSON lines to rotating file, writing is made in executor
+    """
+    def __init__(self, filename: str = ALERT_FILE, max_bytes: int = ALERT_FILE_MAX_BYTES,
+                 backup_count: int = ALERT_FILE_BACKUP_COUNT):
+        self._logger = logging.getLogger('app.alerts.file')
+        self._logger.propagate = False
+        self._logger.setLevel(logging.INFO)
+        self._logger.addHandler(RotatingFileHandler(filename, maxBytes=max_bytes, backupCount=backup_count))
+
+    def _write(self, alerts: list) -> None:
+        for alert in alerts:
+            self._logger.info(json.dumps(alert.to_dict(), ensure_ascii=False))
+
+    async def send(self, alerts: list) -> None:
+        await asyncio.get_running_loop().run_in_executor(None, self._write, alerts)
+
+
+class WebhookSink:
+    """
+    Post alerts batch as JSON to HTTP webhook over persistent connection
+    """
+    def __init__(self, url: str = ALERT_WEBHOOK_URL, timeout: float = ALERT_WEBHOOK_TIMEOUT):
+        self._url: str = url
+        self._timeout: float = timeout
+        self._session: Optional[aiohttp.ClientSession] = None
+
+    async def send(self, alerts: list) -> None:
+        if self._session is None:
+            self._session = aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=self._timeout))
+        async with self._session.post(self._url, json={'alerts': [alert.to_dict() for alert in alerts]},
+                                      ssl=False) as response:
+            await response.read()
+
+
+def get_sinks() -> list:
+    """
+    Make sinks listed in ALERT_SINKS
+    """
+    sinks = []
+    if 'stdout' in ALERT_SINKS:
+        sinks.append(StdoutSink())
+    if 'file' in ALERT_SINKS:
+        sinks.append(RotatingFileSink())
+    if 'webhook' in ALERT_SINKS and ALERT_WEBHOOK_URL:
+        sinks.append(WebhookSink())
+    return sinks
+
+
+class AlertDispatcher:
+    """
+    Dispatcher of alerts
+    submit and flush are synchronous and cheap, they are called from decision making,
+    the worker task sends batches to sinks
+    """
+    def __init__(self, sinks: list = None):
+        self._sinks: list = sinks if sinks is not None else get_sinks()
+        self._queue: Optional[asyncio.Queue] = None
+        self._worker: Optional[asyncio.Task] = None
+        self._pending: dict = dict()
+        self._last_sent: dict = dict()
+        self.dropped_count: int = 0
+
+        # Recent alerts for read API, version is changed when new alerts are added
+        self.recent: deque = deque(maxlen=ALERT_HISTORY_SIZE)
+        self.version: int = 0
+
+    def start(self) -> None:
+        """
+        Start worker task in running event loop
+        """
+        if self._worker is None:
+            self._queue = asyncio.Queue(maxsize=ALERT_QUEUE_SIZE)
+            self._worker = asyncio.get_running_loop().create_task(self._run())
+
+    def submit(self, alert: Alert) -> None:
+        """
+        Add alert to the batch of current minute
+        Alerts of symbol in cooldown are dropped, so symbol raises at most one alert per cooldown whatever tags
+        and tracking windows fire. Alerts of the same symbol and minute are merged into one with signals
+        of all tags and tracking windows
+        """
+        if not alert.signals:
+            return
+        last_sent = self._last_sent.get(alert.symbol_key)
+        if last_sent is not None and last_sent != alert.time_kline and \
+                alert.time_kline - last_sent < timedelta(minutes=ALERT_COOLDOWN):
+            return
+        self._last_sent[alert.symbol_key] = alert.time_kline
+
+        pending_alert = self._pending.get(alert.symbol_key)
+        if pending_alert is None:
+            self._pending[alert.symbol_key] = alert
+        else:
+            pending_alert.merge(alert)
+
+    def flush(self) -> None:
+        """
+        Put the batch of current minute into queue
+        If queue is full (sinks can't keep up), the batch is dropped
+        """
+        if not self._pending:
+            return
+        alerts = list(self._pending.values())
+        self._pending = dict()
+
+        self.recent.extend(alerts)
+        self.version += 1
+
+        if self._queue is None:
+            return
+        try:
+            self._queue.put_nowait(alerts)
+        except asyncio.QueueFull:
+            self.dropped_count += len(alerts)
+
+    async def _run(self) -> None:
+        while True:
+            alerts = await self._queue.get()
+            results = await asyncio.gather(*(sink.send(alerts) for sink in self._sinks), return_exceptions=True)
+            for result in results:
+                if isinstance(result, Exception):
+                    logger.error('Alert sink error: %s', str(result))
+            self._queue.task_done()
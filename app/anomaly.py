@@ -0,0 +1,148 @@
+"""
+Volume and turnover anomaly detector
+Per-symbol rolling statistics of volume and turnover: mean/variance over the tracking window (Welford's method
+with removal of values which left the window) and exponentially weighted mean/variance. Each new kline is scored
+by z-score against statistics of the previous klines and then added to them, it costs O(1) per kline
+"""
+
+import math
+from collections import deque
+from datetime import datetime, timedelta
+from typing import Optional
+
+from app.config import TRACKING_PERIOD, ANOMALY_EWMA_ALPHA, ANOMALY_MIN_PERIODS, ANOMALY_Z_THRESHOLD
+from app.models import KlineHistory
+from app.utils import ftod
+
+
+class RollingStats:
+    """
+    Mean/variance of values over the window and their EWMA
+    """
+    def __init__(self, alpha: float):
+        self._alpha: float = alpha
+        self.count: int = 0
+        self.mean: float = 0.0
+        self._m2: float = 0.0
+        self.ewma_mean: Optional[float] = None
+        self.ewma_variance: float = 0.0
+
+    def add(self, value: float) -> None:
+        self.count += 1
+        delta = value - self.mean
+        self.mean += delta / self.count
+        self._m2 += delta * (value - self.mean)
+
+        if self.ewma_mean is None:
+            self.ewma_mean = value
+        else:
+            delta = value - self.ewma_mean
+            self.ewma_mean += self._alpha * delta
+            self.ewma_variance = (1 - self._alpha) * (self.ewma_variance + self._alpha * delta * delta)
+
+    def remove(self, value: float) -> None:
+        """
+        Remove value which left the window, EWMA isn't changed
+        """
+        if self.count <= 1:
+            self.count, self.mean, self._m2 = 0, 0.0, 0.0
+            return
+        self.count -= 1
+        delta = value - self.mean
+        self.mean -= delta / self.count
+        self._m2 -= delta * (value - self.mean)
+
+    @property
+    def variance(self) -> float:
+        return max(self._m2, 0.0) / (self.count - 1) if self.count > 1 else 0.0
+
+    def get_z_scores(self, value: float) -> tuple[Optional[float], Optional[float]]:
+        """
+        Z-scores of value against window statistics and against EWMA statistics
+        """
+        std = math.sqrt(self.variance)
+        ewma_std = math.sqrt(self.ewma_variance)
+        z_score = (value - self.mean) / std if std > 0.0 else None
+        ewma_z_score = (value - self.ewma_mean) / ewma_std if ewma_std > 0.0 else None
+        return z_score, ewma_z_score
+
+
+class SymbolStats:
+    """
+    Rolling statistics of volume and turnover of one symbol
+    """
+    def __init__(self, alpha: float):
+        self.volume: RollingStats = RollingStats(alpha)
+        self.turnover: RollingStats = RollingStats(alpha)
+        self.values: deque = deque()
+        self.last_time: Optional[datetime] = None
+
+
+class AnomalyDetector:
+    """
+    Detector of volume and turnover spikes of all symbols
+    Spike is flagged when z-scores of volume against both window and EWMA statistics reach the threshold
+    """
+    def __init__(self, period: int = TRACKING_PERIOD, alpha: float = ANOMALY_EWMA_ALPHA,
+                 min_periods: int = ANOMALY_MIN_PERIODS, threshold: float = ANOMALY_Z_THRESHOLD):
+        self._period: int = period
+        self._alpha: float = alpha
+        self._min_periods: int = min_periods
+        self._threshold: float = threshold
+        self._stats: dict = dict()
+
+    def __getitem__(self, item) -> Optional[SymbolStats]:
+        return self._stats.get(item)
+
+    def push(self, kline: KlineHistory) -> None:
+        """
+        Add kline to statistics of its symbol, klines must come in chronological order, older ones are ignored
+        """
+        stats = self._stats.get(kline.symbol_key)
+        if stats is None:
+            stats = self._stats[kline.symbol_key] = SymbolStats(self._alpha)
+        if stats.last_time is not None and kline.time_kline <= stats.last_time:
+            return
+        stats.last_time = kline.time_kline
+
+        volume, turnover = float(kline.volume), float(kline.turnover)
+        stats.volume.add(volume)
+        stats.turnover.add(turnover)
+        stats.values.append((kline.time_kline, volume, turnover))
+
+        oldest_allowed_datetime = kline.time_kline - timedelta(minutes=self._period)
+        while stats.values and stats.values[0][0] <= oldest_allowed_datetime:
+            time_kline, old_volume, old_turnover = stats.values.popleft()
+            stats.volume.remove(old_volume)
+            stats.turnover.remove(old_turnover)
+
+    def update(self, kline: KlineHistory) -> None:
+        """
+        Score kline against statistics of the previous klines of its symbol and add it to statistics
+        """
+        stats = self._stats.get(kline.symbol_key)
+        if stats is not None and stats.last_time is not None and kline.time_kline <= stats.last_time:
+            return
+
+        kline.volume_z_score = kline.turnover_z_score = None
+        kline.is_volume_spike = False
+        if stats is not None and stats.volume.count >= self._min_periods:
+            volume_z_score, volume_ewma_z_score = stats.volume.get_z_scores(float(kline.volume))
+            turnover_z_score, turnover_ewma_z_score = stats.turnover.get_z_scores(float(kline.turnover))
+            if volume_z_score is not None:
+                kline.volume_z_score = ftod(volume_z_score, 9)
+            if turnover_z_score is not None:
+                kline.turnover_z_score = ftod(turnover_z_score, 9)
+            kline.is_volume_spike = \
+                volume_z_score is not None and volume_ewma_z_score is not None and \
+                min(volume_z_score, volume_ewma_z_score) >= self._threshold
+
+        self.push(kline)
+
+    def garbage_collector(self, oldest_allowed_datetime: datetime) -> None:
+        """
+        Delete statistics of symbols which haven't klines since the time
+        """
+        for symbol_key in list(self._stats.keys()):
+            if self._stats[symbol_key].last_time < oldest_allowed_datetime:
+                self._stats.pop(symbol_key, None)
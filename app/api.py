@@ -0,0 +1,385 @@
+"""
+Read-only HTTP API over the live window (and switch of profiler)
+Data are served from memory of iteration stack, responses are cached per data version and support
+ETag/If-None-Match, so dashboards polling doesn't load database and calculation
+"""
+
+import asyncio
+import json
+from collections import OrderedDict
+from datetime import datetime, timezone
+from decimal import Decimal
+from typing import Optional
+
+from aiohttp import web
+
+from app.clock import get_clock
+from app.config import API_HOST, API_PORT, API_CACHE_SIZE, API_PROFILER_CONTROL, TRACKING_PERIODS, TRACKING_PERIOD
+from app.handlers import IterationStack
+from app.history import KlineHistoryReader, HISTORY_COLUMNS
+from app.logger import get_logger
+from app.loop import LoopLagMonitor
+from app.models import DatabaseStats
+from app.profiler import Profiler
+from app.utils import split_symbol_key
+
+logger = get_logger('api')
+
+KLINE_FIELDS = (
+    'open_price', 'high_price', 'low_price', 'close_price', 'volume', 'turnover',
+    'max_price', 'delta_to_max', 'delta_to_max_in_percent', 'time_since_max',
+    'min_price', 'delta_to_min', 'delta_to_min_in_percent', 'time_since_min',
+    'btc_impact_rate', 'is_growth_over_1_percent', 'is_decline_over_1_percent',
+    'volume_z_score', 'turnover_z_score', 'is_volume_spike',
+    'vwap', 'buy_volume', 'sell_volume', 'trade_imbalance', 'trades_count', 'flags',
+)
+
+WINDOW_FIELDS = KLINE_FIELDS[6:17] + ('flags',)
+
+
+def _to_json_value(value):
+    if isinstance(value, Decimal):
+        return str(value)
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return value
+
+
+def kline_to_dict(kline, fields: tuple = KLINE_FIELDS) -> dict:
+    data = {'time_kline': kline.time_kline.isoformat(), 'symbol_key': kline.symbol_key}
+    for field in fields:
+        data[field] = _to_json_value(getattr(kline, field, None))
+    return data
+
+
+def parse_since(value: Optional[str]) -> Optional[datetime]:
+    """
+    Parse since parameter: ISO datetime or unix time in minutes
+    """
+    if not value:
+        return None
+    try:
+        return datetime.fromtimestamp(int(value) * 60, tz=timezone.utc)
+    except ValueError:
+        pass
+    try:
+        since = datetime.fromisoformat(value)
+    except ValueError:
+        raise web.HTTPBadRequest(text='since must be ISO datetime or unix time in minutes')
+    return since if since.tzinfo else since.replace(tzinfo=timezone.utc)
+
+
+class ReadApi:
+    """
+    Handlers of read API, each response body is built once per data version
+    """
+    def __init__(self, iteration_stack: IterationStack, cache_size: int = API_CACHE_SIZE):
+        self._iteration_stack: IterationStack = iteration_stack
+        self._cache: OrderedDict = OrderedDict()
+        self._cache_size: int = cache_size
+        self._cache_version = None
+
+    def _get_version(self) -> str:
+        return f'{self._iteration_stack.version}-{self._iteration_stack.alert_dispatcher.version}'
+
+    async def _respond(self, request: web.Request, build, *params) -> web.Response:
+        """
+        Response with cached body for current data version, 304 if client has it already
+        Body is cached by route and parsed parameters of request (least recently used bodies are dropped),
+        so equal requests written differently share the body and unknown parameters don't fill the cache.
+        Data are taken from memory in event loop, they are serialized to JSON in executor, requests which come
+        while body is serialized wait for the same body
+        """
+        version = self._get_version()
+        if version != self._cache_version:
+            self._cache.clear()
+            self._cache_version = version
+
+        headers = {'ETag': f'"{version}"', 'Cache-Control': 'no-cache'}
+        if headers['ETag'] in request.headers.get('If-None-Match', ''):
+            return web.Response(status=304, headers=headers)
+
+        key = (request.path, *params)
+        body = self._cache.get(key)
+        if body is None:
+            body = self._cache[key] = asyncio.get_running_loop().run_in_executor(None, self._serialize, build())
+            if len(self._cache) > self._cache_size:
+                self._cache.popitem(last=False)
+        else:
+            self._cache.move_to_end(key)
+        try:
+            body = await asyncio.shield(body)
+        except Exception:
+            self._cache.pop(key, None)
+            raise
+        return web.Response(body=body, content_type='application/json', headers=headers)
+
+    @staticmethod
+    def _serialize(data: dict) -> bytes:
+        return json.dumps(data, ensure_ascii=False).encode()
+
+    def _get_latest_iteration(self):
+        iterations = self._iteration_stack.iterations
+        return iterations[max(iterations.keys())] if iterations else None
+
+    async def window(self, request: web.Request) -> web.Response:
+        """
+        Klines of the current window, only newer than since if it is set
+        """
+        since = parse_since(request.query.get('since'))
+
+        def build():
+            iterations = self._iteration_stack.iterations
+            return {
+                'klines': [
+                    kline_to_dict(kline)
+                    for time_kline in sorted(iterations.keys()) if since is None or time_kline > since
+                    for kline in iterations[time_kline].symbols_kline.values()
+                ]
+            }
+
+        return await self._respond(request, build, since)
+
+    async def indicators(self, request: web.Request) -> web.Response:
+        """
+        Indicators of the latest iteration for each tracking window and timeframe
+        """
+
+        def build():
+            iteration = self._get_latest_iteration()
+            if iteration is None:
+                return {'time_kline': None, 'klines': []}
+
+            klines = []
+            for symbol_key, kline in iteration.symbols_kline.items():
+                data = kline_to_dict(kline)
+                data['windows'] = {
+                    str(tracking_period): kline_to_dict(iteration.get_window(symbol_key, tracking_period),
+                                                        WINDOW_FIELDS)
+                    for tracking_period in TRACKING_PERIODS
+                    if tracking_period != TRACKING_PERIOD and iteration.get_window(symbol_key, tracking_period)
+                }
+                klines.append(data)
+
+            timeframes = dict()
+            for interval, timeframe in self._iteration_stack.timeframes.items():
+                candles = timeframe[max(timeframe.candles.keys())] if len(timeframe) else dict()
+                timeframes[str(interval)] = [kline_to_dict(candle) for candle in candles.values()]
+
+            return {'time_kline': iteration.time_kline.isoformat(), 'klines': klines, 'timeframes': timeframes}
+
+        return await self._respond(request, build)
+
+    async def peers(self, request: web.Request) -> web.Response:
+        """
+        The most correlated symbols with symbol
+        """
+        symbol_key = request.query.get('symbol')
+        if not symbol_key:
+            raise web.HTTPBadRequest(text='symbol is required')
+
+        def build():
+            return {
+                'symbol_key': symbol_key,
+                'peers': [{'symbol_key': peer, 'correlation': correlation}
+                          for peer, correlation in self._iteration_stack.correlation.get_top_peers(symbol_key)]
+            }
+
+        return await self._respond(request, build, symbol_key)
+
+    def _get_range_query(self, request: web.Request) -> tuple[str, datetime, datetime]:
+        symbol_key = request.query.get('symbol')
+        if not symbol_key:
+            raise web.HTTPBadRequest(text='symbol is required')
+        till = parse_since(request.query.get('till'))
+        if till is None:
+            iteration = self._get_latest_iteration()
+            till = iteration.time_kline if iteration else get_clock().now()
+        since = parse_since(request.query.get('since')) or till.replace(hour=0, minute=0)
+        return symbol_key, since, till
+
+    async def range(self, request: web.Request) -> web.Response:
+        """
+        Max high and min low of symbol in range [since, till] (by default since the start of the day)
+        """
+        symbol_key, since, till = self._get_range_query(request)
+
+        def build():
+            max_time, max_price, min_time, min_price = \
+                self._iteration_stack.get_range_max_min(symbol_key, since, till)
+            return {
+                'symbol_key': symbol_key, 'since': since.isoformat(), 'till': till.isoformat(),
+                'max_time': _to_json_value(max_time), 'max_price': _to_json_value(max_price),
+                'min_time': _to_json_value(min_time), 'min_price': _to_json_value(min_price),
+            }
+
+        return await self._respond(request, build, symbol_key, since, till)
+
+    async def largest_move(self, request: web.Request) -> web.Response:
+        """
+        The largest price move of symbol in any window of window minutes in range [since, till]
+        """
+        symbol_key, since, till = self._get_range_query(request)
+        try:
+            window = int(request.query.get('window', TRACKING_PERIOD))
+        except ValueError:
+            raise web.HTTPBadRequest(text='window must be integer')
+        if window < 1:
+            raise web.HTTPBadRequest(text='window must be positive')
+
+        # Range must be within range index, default since is moved to its oldest minute
+        oldest_time, newest_time = self._iteration_stack.get_range_bounds(symbol_key)
+        if oldest_time is not None:
+            if request.query.get('since') and since < oldest_time or \
+                    request.query.get('till') and till > newest_time:
+                raise web.HTTPBadRequest(text=f'since and till must be within indexed range '
+                                              f'[{oldest_time.isoformat()}, {newest_time.isoformat()}]')
+            since = max(since, oldest_time)
+
+        def build():
+            move = self._iteration_stack.get_largest_move(symbol_key, window, since, till)
+            return {
+                'symbol_key': symbol_key, 'window': window,
+                'move': {key: _to_json_value(value) for key, value in move.items()} if move else None,
+            }
+
+        return await self._respond(request, build, symbol_key, window, since, till)
+
+    async def divergence(self, request: web.Request) -> web.Response:
+        """
+        Divergence of close price of symbols tracked in several categories from spot price in the latest iteration
+        """
+
+        def build():
+            iteration = self._get_latest_iteration()
+            if iteration is None:
+                return {'time_kline': None, 'symbols': []}
+
+            spot_klines = dict()
+            for symbol_key, kline in iteration.symbols_kline.items():
+                category, symbol = split_symbol_key(symbol_key)
+                if category == 'spot':
+                    spot_klines[symbol] = kline
+
+            symbols = []
+            for symbol_key, kline in iteration.symbols_kline.items():
+                category, symbol = split_symbol_key(symbol_key)
+                spot_kline = spot_klines.get(symbol)
+                if category != 'spot' and spot_kline and spot_kline.close_price:
+                    symbols.append({
+                        'symbol_key': symbol_key,
+                        'spot_symbol_key': spot_kline.symbol_key,
+                        'close_price': str(kline.close_price),
+                        'spot_close_price': str(spot_kline.close_price),
+                        'divergence_in_percent': float((kline.close_price - spot_kline.close_price) /
+                                                       spot_kline.close_price * 100),
+                    })
+            return {'time_kline': iteration.time_kline.isoformat(), 'symbols': symbols}
+
+        return await self._respond(request, build)
+
+    async def alerts(self, request: web.Request) -> web.Response:
+        """
+        Recent alerts, only newer than since if it is set
+        """
+        since = parse_since(request.query.get('since'))
+
+        def build():
+            return {
+                'alerts': [alert.to_dict() for alert in self._iteration_stack.alert_dispatcher.recent
+                           if since is None or alert.time_kline > since]
+            }
+
+        return await self._respond(request, build, since)
+
+    async def history(self, request: web.Request) -> web.Response:
+        """
+        Stored klines of symbols (comma separated) in range [since, till) from kline history reader
+        """
+        symbol_keys = [symbol_key for symbol_key in request.query.get('symbols', '').split(',') if symbol_key]
+        since = parse_since(request.query.get('since'))
+        till = parse_since(request.query.get('till')) or get_clock().now()
+        if not symbol_keys or since is None:
+            raise web.HTTPBadRequest(text='symbols and since are required')
+
+        chunks = await KlineHistoryReader().get_range(symbol_keys, since, till)
+        return web.json_response({
+            symbol_key: {
+                'time_kline': [datetime.fromtimestamp(int(t), tz=timezone.utc).isoformat() for t in chunk.times],
+                **{column: [None if value != value else value for value in chunk[column].tolist()]
+                   for column in HISTORY_COLUMNS},
+            }
+            for symbol_key, chunk in chunks.items()
+        })
+
+    async def profiler(self, request: web.Request) -> web.Response:
+        """
+        State of profiler and the slowest iterations, POST with enabled=0/1 switches stack sampling
+        (it is routed only if API_PROFILER_CONTROL is set, otherwise sampling is switched by SIGUSR1)
+        """
+        profiler = Profiler()
+        if request.method == 'POST':
+            enabled = request.query.get('enabled')
+            if enabled not in ('0', '1'):
+                raise web.HTTPBadRequest(text='enabled must be 0 or 1')
+            profiler.set_enabled(enabled == '1')
+
+        return web.json_response({
+            'enabled': profiler.enabled,
+            'slowest': [profile.to_dict() for profile in profiler.slowest],
+        })
+
+    async def loop_lag(self, request: web.Request) -> web.Response:
+        """
+        Statistics of event loop lag
+        """
+        return web.json_response(LoopLagMonitor().get_stats())
+
+    async def database(self, request: web.Request) -> web.Response:
+        """
+        Statistics of connection pool waits and query latencies
+        """
+        return web.json_response(DatabaseStats().get_stats())
+
+    async def orders(self, request: web.Request) -> web.Response:
+        """
+        Recent orders placed by decisions and statistics of latency from decision to acknowledgement
+        """
+        order_dispatcher = self._iteration_stack.order_dispatcher
+        return web.json_response({
+            'enabled': order_dispatcher.enabled,
+            'latency': order_dispatcher.get_stats(),
+            'orders': [order.to_dict() for order in order_dispatcher.recent],
+        })
+
+    def get_application(self) -> web.Application:
+        application = web.Application()
+        application.router.add_get('/window', self.window)
+        application.router.add_get('/indicators', self.indicators)
+        application.router.add_get('/peers', self.peers)
+        application.router.add_get('/alerts', self.alerts)
+        application.router.add_get('/divergence', self.divergence)
+        application.router.add_get('/range', self.range)
+        application.router.add_get('/largest_move', self.largest_move)
+        application.router.add_get('/history', self.history)
+        application.router.add_get('/profiler', self.profiler)
+        if API_PROFILER_CONTROL:
+            application.router.add_post('/profiler', self.profiler)
+        application.router.add_get('/loop_lag', self.loop_lag)
+        application.router.add_get('/database', self.database)
+        application.router.add_get('/orders', self.orders)
+        return application
+
+
+async def start_api(iteration_stack: IterationStack) -> Optional[web.AppRunner]:
+    """
+    Start read API in running event loop if API_PORT is set
+    """
+    if not API_PORT:
+        return None
+
+    runner = web.AppRunner(ReadApi(iteration_stack).get_application(), access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, API_HOST, API_PORT).start()
+    logger.info('Read API is listening on %s:%s', API_HOST, API_PORT)
+    return runner
@@ -9,7 +9,7 @@ import hmac
 import json
 import time
 
-from app.config import BYBIT_API_KEY, BYBIT_API_SECRET
+from app.config import BYBIT_API_KEY, BYBIT_API_SECRET, BYBIT_ENDPOINT
 
 HTTP_URL = "https://{SUBDOMAIN}.{DOMAIN}.com"
 SUBDOMAIN_TESTNET = "api-testnet"
@@ -42,12 +42,19 @@ class Bybit:
         subdomain = SUBDOMAIN_TESTNET if self.testnet else SUBDOMAIN_MAINNET
         self.endpoint = HTTP_URL.format(SUBDOMAIN=subdomain, DOMAIN=DOMAIN)
 
+        # Endpoint can be overridden, e.g. by local fake exchange for soak test
+        if BYBIT_ENDPOINT:
+            self.endpoint = BYBIT_ENDPOINT.rstrip('/')
+
         if not self.api_key:
             self.api_key = BYBIT_API_KEY
 
         if not self.api_secret:
             self.api_secret = BYBIT_API_SECRET
 
+        # HMAC object keyed by secret is made once, each signature is made by its copy
+        self._hmac = hmac.new(bytes(self.api_secret, "utf-8"), digestmod=hashlib.sha256) if self.api_secret else None
+
     @staticmethod
     def prepare_payload(method, parameters):
         """
@@ -99,11 +106,8 @@ class Bybit:
             raise PermissionError("Authenticated endpoints require keys.")
 
         param_str = str(timestamp) + api_key + str(recv_window) + payload
-        auth_hash = hmac.new(
-            bytes(api_secret, "utf-8"),
-            param_str.encode("utf-8"),
-            hashlib.sha256,
-        )
+        auth_hash = self._hmac.copy()
+        auth_hash.update(param_str.encode("utf-8"))
         return auth_hash.hexdigest()
 
     def _prepare_request(self, method=None, path=None, query=None, auth=False):
@@ -178,6 +182,28 @@ class Bybit:
             auth=False,
         )
 
+    def get_tickers(self, **kwargs):
+        """
+        Query the latest price snapshot, best bid/ask price, and trading volume in the last 24 hours
+        Required args:
+            category (string): Product type: spot, linear, inverse, option
+        Optional args:
+            symbol (string): Symbol name, all symbols of category if omitted
+        Returns parameters for request:
+            method (string): request method: GET, POST
+            url (string): endpoint
+            data (dict): parameters
+            headers (dict): request headers
+        Additional information:
+            https://bybit-exchange.github.io/docs/v5/market/tickers
+        """
+        return self._prepare_request(
+            method='GET',
+            path=f'{self.endpoint}/v5/market/tickers',
+            query=kwargs,
+            auth=False,
+        )
+
     def get_instruments_info(self, **kwargs):
         """
         Query a list of instruments of online trading pair
@@ -218,3 +244,70 @@ class Bybit:
             query=kwargs,
             auth=False,
         )
+
+    def get_server_time(self, **kwargs):
+        """
+        Get the server time, it is used to keep connection to exchange warm
+        Returns parameters for request:
+            method (string): request method: GET, POST
+            url (string): endpoint
+            data (dict): parameters
+            headers (dict): request headers
+        Additional information:
+            https://bybit-exchange.github.io/docs/v5/market/time
+        """
+        return self._prepare_request(
+            method='GET',
+            path=f'{self.endpoint}/v5/market/time',
+            query=kwargs,
+            auth=False,
+        )
+
+    def create_order(self, **kwargs):
+        """
+        Place an order (signed request)
+        Required args:
+            category (string): Product type: spot, linear, inverse
+            symbol (string): Symbol name
+            side (string): Buy, Sell
+            orderType (string): Market, Limit
+            qty (string): Order quantity
+        Optional args:
+            price (string): Order price, required for limit order
+            orderLinkId (string): User customised order ID, it makes placing idempotent
+        Returns parameters for request:
+            method (string): request method: GET, POST
+            url (string): endpoint
+            data (dict): parameters
+            headers (dict): request headers
+        Additional information:
+            https://bybit-exchange.github.io/docs/v5/order/create-order
+        """
+        return self._prepare_request(
+            method='POST',
+            path=f'{self.endpoint}/v5/order/create',
+            query=kwargs,
+            auth=True,
+        )
+
+    def cancel_order(self, **kwargs):
+        """
+        Cancel an active order (signed request)
+        Required args:
+            category (string): Product type: spot, linear, inverse
+            symbol (string): Symbol name
+            orderId (string) or orderLinkId (string): Order ID or user customised order ID
+        Returns parameters for request:
+            method (string): request method: GET, POST
+            url (string): endpoint
+            data (dict): parameters
+            headers (dict): request headers
+        Additional information:
+            https://bybit-exchange.github.io/docs/v5/order/cancel-order
+        """
+        return self._prepare_request(
+            method='POST',
+            path=f'{self.endpoint}/v5/order/cancel',
+            query=kwargs,
+            auth=True,
+        )
@@ -0,0 +1,76 @@
+"""
+Clock of the program
+All scheduling and "now" of the program are taken from one injectable clock. System clock is used by default,
+accelerated clock (CLOCK_SPEED > 1) runs simulated time faster than real one, e.g. for soak test with fake exchange:
+a day of work at speed 100 takes less than 15 minutes. Processes with the same CLOCK_START and CLOCK_ANCHOR
+have the same simulated time
+"""
+
+import asyncio
+import time
+from datetime import datetime, timezone
+from typing import Optional
+
+from app.config import CLOCK_SPEED, CLOCK_START, CLOCK_ANCHOR
+
+
+class Clock:
+    """
+    System clock, time runs at real speed
+    """
+    speed: float = 1.0
+
+    def timestamp(self) -> float:
+        return time.time()
+
+    def now(self) -> datetime:
+        return datetime.fromtimestamp(self.timestamp(), tz=timezone.utc)
+
+    def to_real(self, seconds: float) -> float:
+        """
+        Real duration of interval of clock time
+        """
+        return seconds / self.speed
+
+    async def sleep(self, seconds: float) -> None:
+        """
+        Sleep for interval of clock time
+        """
+        await asyncio.sleep(self.to_real(seconds))
+
+
+class AcceleratedClock(Clock):
+    """
+    Clock runs speed times faster than real one, it shows start time at real time anchor
+    """
+    def __init__(self, speed: float, start: Optional[datetime] = None, anchor: Optional[float] = None):
+        self.speed = speed
+        self._anchor: float = time.time() if anchor is None else anchor
+        self._start: float = self._anchor if start is None else start.timestamp()
+
+    def timestamp(self) -> float:
+        return self._start + (time.time() - self._anchor) * self.speed
+
+
+_clock: Optional[Clock] = None
+
+
+def get_clock() -> Clock:
+    """
+    The clock of the program, it is made from CLOCK_* settings at first call unless it has been set
+    """
+    global _clock
+    if _clock is None:
+        if CLOCK_SPEED != 1.0 or CLOCK_START:
+            start = datetime.fromisoformat(CLOCK_START) if CLOCK_START else None
+            if start is not None and start.tzinfo is None:
+                start = start.replace(tzinfo=timezone.utc)
+            _clock = AcceleratedClock(CLOCK_SPEED, start, CLOCK_ANCHOR)
+        else:
+            _clock = Clock()
+    return _clock
+
+
+def set_clock(clock: Clock) -> None:
+    global _clock
+    _clock = clock
@@ -2,7 +2,7 @@ import os
 from pathlib import Path
 from dotenv import load_dotenv
 
-from app.utils import ftod
+from app.utils import ftod, get_symbol_key, DEFAULT_CATEGORY
 
 BASE_DIR = Path(__file__).resolve().parent.parent
 
@@ -24,6 +24,41 @@ DATABASE_NAME = os.environ.get('DATABASE_NAME')
 DATABASE_USER = os.environ.get('DATABASE_USER')
 DATABASE_PASSWORD = os.environ.get('DATABASE_PASSWORD')
 
+# Database connection pool shared by the whole process: number of kept connections and extra ones,
+# seconds to wait free connection, seconds after which connection is replaced, check of connection by
+# extra round trip at checkout, prepared statements cached per connection, number of recent timings in statistics
+try:
+    DATABASE_POOL_SIZE = int(os.environ.get('DATABASE_POOL_SIZE'))
+except:
+    DATABASE_POOL_SIZE = 5
+
+try:
+    DATABASE_MAX_OVERFLOW = int(os.environ.get('DATABASE_MAX_OVERFLOW'))
+except:
+    DATABASE_MAX_OVERFLOW = 5
+
+try:
+    DATABASE_POOL_TIMEOUT = float(os.environ.get('DATABASE_POOL_TIMEOUT'))
+except:
+    DATABASE_POOL_TIMEOUT = 30.00
+
+try:
+    DATABASE_POOL_RECYCLE = int(os.environ.get('DATABASE_POOL_RECYCLE'))
+except:
+    DATABASE_POOL_RECYCLE = 1800
+
+DATABASE_POOL_PRE_PING = bool(os.environ.get('DATABASE_POOL_PRE_PING'))
+
+try:
+    DATABASE_STATEMENT_CACHE_SIZE = int(os.environ.get('DATABASE_STATEMENT_CACHE_SIZE'))
+except:
+    DATABASE_STATEMENT_CACHE_SIZE = 100
+
+try:
+    DATABASE_STATS_WINDOW = int(os.environ.get('DATABASE_STATS_WINDOW'))
+except:
+    DATABASE_STATS_WINDOW = 1000
+
 BYBIT_API_KEY = os.environ.get('BYBIT_API_KEY')
 BYBIT_API_SECRET = os.environ.get('BYBIT_API_SECRET')
 
@@ -33,6 +68,30 @@ for s in BASE_SYMBOLS:
     if s not in SYMBOLS:
         SYMBOLS.append(s)
 
+# Categories of exchange instruments to fetch in one shared cycle: linear, spot, inverse
+# Entries of SYMBOLS/BASE_SYMBOLS may be qualified by category ('spot:ETHUSDT'), bare entries apply to all categories
+CATEGORIES = (os.environ.get('CATEGORIES') or DEFAULT_CATEGORY).split(',')
+
+# BTC reference symbol of each category, BTC impact of symbol is calculated against reference of its category
+BTC_SYMBOL_KEYS = {
+    'linear': get_symbol_key('linear', 'BTCUSDT'),
+    'spot': get_symbol_key('spot', 'BTCUSDT'),
+    'inverse': get_symbol_key('inverse', 'BTCUSD'),
+}
+
+BTC_SYMBOL_KEY = BTC_SYMBOL_KEYS[DEFAULT_CATEGORY]
+
+# Schedule of symbols refresh from exchange instruments info (SYMBOLS=* tracks all trading symbols)
+SYMBOLS_REFRESH_SCHEDULE = os.environ.get('SYMBOLS_REFRESH_SCHEDULE') or '0 * * * *'
+
+# Ingestion mode: 'kline' - one kline request per symbol, 'tickers' - klines are built from tickers snapshots
+INGESTION_MODE = os.environ.get('INGESTION_MODE') or 'kline'
+
+try:
+    TICKERS_SAMPLES_PER_MINUTE = int(os.environ.get('TICKERS_SAMPLES_PER_MINUTE'))
+except:
+    TICKERS_SAMPLES_PER_MINUTE = 4
+
 try:
     PARALLEL_REQUESTS = int(os.environ.get('PARALLEL_REQUESTS'))
 except:
@@ -58,6 +117,16 @@ try:
 except:
     TRACKING_PERIOD = 60
 
+# Additional tracking windows calculated together with the main one, the longest defines history length
+try:
+    TRACKING_PERIODS = [int(i) for i in os.environ.get('TRACKING_PERIODS').split(',')]
+except:
+    TRACKING_PERIODS = []
+if TRACKING_PERIOD not in TRACKING_PERIODS:
+    TRACKING_PERIODS.append(TRACKING_PERIOD)
+TRACKING_PERIODS.sort()
+MAX_TRACKING_PERIOD = max(TRACKING_PERIODS)
+
 try:
     ALARM_THRESHOLD = ftod(os.environ.get('ALARM_THRESHOLD'), 9)
 except:
@@ -68,3 +137,286 @@ try:
 except:
     BTC_IMPACT_THRESHOLD = ftod(0.8, 9)
 
+
+try:
+    ROLLUP_INTERVALS = [int(i) for i in os.environ.get('ROLLUP_INTERVALS').split(',')]
+except:
+    ROLLUP_INTERVALS = [5, 15, 60, 1440]
+
+try:
+    TIMEFRAMES = [int(i) for i in os.environ.get('TIMEFRAMES').split(',')]
+except:
+    TIMEFRAMES = [5, 15, 60]
+
+try:
+    TIMEFRAME_TRACKING_PERIOD = int(os.environ.get('TIMEFRAME_TRACKING_PERIOD'))
+except:
+    TIMEFRAME_TRACKING_PERIOD = 12
+
+ALERT_SINKS = (os.environ.get('ALERT_SINKS') or 'stdout').split(',')
+
+try:
+    ALERT_COOLDOWN = int(os.environ.get('ALERT_COOLDOWN'))
+except:
+    ALERT_COOLDOWN = 15
+
+try:
+    ALERT_QUEUE_SIZE = int(os.environ.get('ALERT_QUEUE_SIZE'))
+except:
+    ALERT_QUEUE_SIZE = 100
+
+ALERT_FILE = os.environ.get('ALERT_FILE') or os.path.join(BASE_DIR, 'alerts.log')
+
+try:
+    ALERT_FILE_MAX_BYTES = int(os.environ.get('ALERT_FILE_MAX_BYTES'))
+except:
+    ALERT_FILE_MAX_BYTES = 10485760
+
+try:
+    ALERT_FILE_BACKUP_COUNT = int(os.environ.get('ALERT_FILE_BACKUP_COUNT'))
+except:
+    ALERT_FILE_BACKUP_COUNT = 5
+
+ALERT_WEBHOOK_URL = os.environ.get('ALERT_WEBHOOK_URL')
+
+try:
+    ALERT_WEBHOOK_TIMEOUT = float(os.environ.get('ALERT_WEBHOOK_TIMEOUT'))
+except:
+    ALERT_WEBHOOK_TIMEOUT = 5.00
+
+try:
+    ALERT_HISTORY_SIZE = int(os.environ.get('ALERT_HISTORY_SIZE'))
+except:
+    ALERT_HISTORY_SIZE = 1000
+
+LOG_LEVEL = (os.environ.get('LOG_LEVEL') or ('DEBUG' if DEBUG else 'INFO')).upper()
+
+# Log format: 'text' or 'json'
+LOG_FORMAT = os.environ.get('LOG_FORMAT') or 'text'
+
+LOG_FILE = os.environ.get('LOG_FILE')
+
+try:
+    LOG_ROW_SAMPLE_RATE = float(os.environ.get('LOG_ROW_SAMPLE_RATE'))
+except:
+    LOG_ROW_SAMPLE_RATE = 1.00
+
+try:
+    CORRELATION_MIN_PERIODS = int(os.environ.get('CORRELATION_MIN_PERIODS'))
+except:
+    CORRELATION_MIN_PERIODS = 10
+
+try:
+    CORRELATION_TOP_PEERS = int(os.environ.get('CORRELATION_TOP_PEERS'))
+except:
+    CORRELATION_TOP_PEERS = 5
+
+API_HOST = os.environ.get('API_HOST') or '127.0.0.1'
+
+try:
+    API_PORT = int(os.environ.get('API_PORT'))
+except:
+    API_PORT = None
+
+# Read API: max number of cached response bodies of current data version
+try:
+    API_CACHE_SIZE = int(os.environ.get('API_CACHE_SIZE'))
+except:
+    API_CACHE_SIZE = 256
+
+# Switching of profiler stack sampling by POST /profiler of read API (off by default, the API is read-only)
+API_PROFILER_CONTROL = bool(os.environ.get('API_PROFILER_CONTROL'))
+
+# Kline history reader: size of cached time block in minutes and max number of cached blocks
+try:
+    HISTORY_BLOCK_MINUTES = int(os.environ.get('HISTORY_BLOCK_MINUTES'))
+except:
+    HISTORY_BLOCK_MINUTES = 1440
+
+try:
+    HISTORY_CACHE_BLOCKS = int(os.environ.get('HISTORY_CACHE_BLOCKS'))
+except:
+    HISTORY_CACHE_BLOCKS = 2048
+
+# Profiler: stack sampling at start (it can be switched by SIGUSR1 or API), dumps directory,
+# number of the slowest iterations to keep and stack sampling interval in seconds
+PROFILER_ENABLED = bool(os.environ.get('PROFILER_ENABLED'))
+
+PROFILER_DIR = os.environ.get('PROFILER_DIR') or os.path.join(BASE_DIR, 'profiles')
+
+try:
+    PROFILER_SLOWEST_COUNT = int(os.environ.get('PROFILER_SLOWEST_COUNT'))
+except:
+    PROFILER_SLOWEST_COUNT = 10
+
+try:
+    PROFILER_SAMPLE_INTERVAL = float(os.environ.get('PROFILER_SAMPLE_INTERVAL'))
+except:
+    PROFILER_SAMPLE_INTERVAL = 0.005
+
+# Fetch of klines: deadline of fetch phase and timeout of one request (seconds), number of retries of failed request,
+# percentile of recent latencies after which duplicate (hedged) request is sent and minimal delay before it,
+# time to wait results which come after deadline and number of recent latencies to calculate percentile
+try:
+    FETCH_DEADLINE = float(os.environ.get('FETCH_DEADLINE'))
+except:
+    FETCH_DEADLINE = 20.00
+
+try:
+    FETCH_TIMEOUT = float(os.environ.get('FETCH_TIMEOUT'))
+except:
+    FETCH_TIMEOUT = 10.00
+
+try:
+    FETCH_RETRIES = int(os.environ.get('FETCH_RETRIES'))
+except:
+    FETCH_RETRIES = 1
+
+try:
+    FETCH_HEDGE_PERCENTILE = float(os.environ.get('FETCH_HEDGE_PERCENTILE'))
+except:
+    FETCH_HEDGE_PERCENTILE = 95.00
+
+try:
+    FETCH_HEDGE_MIN_DELAY = float(os.environ.get('FETCH_HEDGE_MIN_DELAY'))
+except:
+    FETCH_HEDGE_MIN_DELAY = 0.50
+
+try:
+    FETCH_LATE_TIMEOUT = float(os.environ.get('FETCH_LATE_TIMEOUT'))
+except:
+    FETCH_LATE_TIMEOUT = 30.00
+
+try:
+    FETCH_LATENCY_WINDOW = int(os.environ.get('FETCH_LATENCY_WINDOW'))
+except:
+    FETCH_LATENCY_WINDOW = 1000
+
+# Event loop: 'asyncio' or 'uvloop' (standard loop is used if uvloop isn't installed)
+EVENT_LOOP = os.environ.get('EVENT_LOOP') or 'asyncio'
+
+# Loop lag monitor: sampling interval (seconds), number of samples in statistics window,
+# lag to write warning (seconds)
+try:
+    LOOP_LAG_INTERVAL = float(os.environ.get('LOOP_LAG_INTERVAL'))
+except:
+    LOOP_LAG_INTERVAL = 0.25
+
+try:
+    LOOP_LAG_WINDOW = int(os.environ.get('LOOP_LAG_WINDOW'))
+except:
+    LOOP_LAG_WINDOW = 240
+
+try:
+    LOOP_LAG_WARNING = float(os.environ.get('LOOP_LAG_WARNING'))
+except:
+    LOOP_LAG_WARNING = 0.50
+
+# Export of kline history to Parquet files: directory, rows per chunk of server-side cursor,
+# minutes from now which aren't exported yet (late klines may be saved for them)
+EXPORT_DIR = os.environ.get('EXPORT_DIR') or os.path.join(BASE_DIR, 'export')
+
+try:
+    EXPORT_CHUNK_SIZE = int(os.environ.get('EXPORT_CHUNK_SIZE'))
+except:
+    EXPORT_CHUNK_SIZE = 10000
+
+try:
+    EXPORT_DELAY = int(os.environ.get('EXPORT_DELAY'))
+except:
+    EXPORT_DELAY = 5
+
+# Volume anomaly detector: smoothing factor of EWMA, minimal number of klines in window to score,
+# z-score of volume to flag spike
+try:
+    ANOMALY_EWMA_ALPHA = float(os.environ.get('ANOMALY_EWMA_ALPHA'))
+except:
+    ANOMALY_EWMA_ALPHA = 0.10
+
+try:
+    ANOMALY_MIN_PERIODS = int(os.environ.get('ANOMALY_MIN_PERIODS'))
+except:
+    ANOMALY_MIN_PERIODS = 10
+
+try:
+    ANOMALY_Z_THRESHOLD = float(os.environ.get('ANOMALY_Z_THRESHOLD'))
+except:
+    ANOMALY_Z_THRESHOLD = 4.00
+
+# Recent public trades: number of polls per minute (0 - trades aren't polled, the last poll of minute is made
+# by the main handler after the minute has finished), deadline of the last poll in seconds (it runs beside
+# the kline fetch on its own session), number of the latest trade ids of each symbol remembered for deduplication
+try:
+    TRADES_POLLS_PER_MINUTE = int(os.environ.get('TRADES_POLLS_PER_MINUTE'))
+except:
+    TRADES_POLLS_PER_MINUTE = 0
+
+try:
+    TRADES_FINAL_POLL_DEADLINE = float(os.environ.get('TRADES_FINAL_POLL_DEADLINE'))
+except:
+    TRADES_FINAL_POLL_DEADLINE = 5.00
+
+try:
+    TRADES_DEDUP_SIZE = int(os.environ.get('TRADES_DEDUP_SIZE'))
+except:
+    TRADES_DEDUP_SIZE = 2000
+
+# Period of range max/min index of each symbol (minutes), it answers queries of any time range within it
+try:
+    RANGE_INDEX_MINUTES = int(os.environ.get('RANGE_INDEX_MINUTES'))
+except:
+    RANGE_INDEX_MINUTES = 1440
+
+# Clock of the program: speed of simulated time (1 - real time), simulated time at start (ISO format, UTC)
+# and real unix time when simulated time is CLOCK_START (processes with the same values share simulated time)
+try:
+    CLOCK_SPEED = float(os.environ.get('CLOCK_SPEED'))
+except:
+    CLOCK_SPEED = 1.00
+
+CLOCK_START = os.environ.get('CLOCK_START') or None
+
+try:
+    CLOCK_ANCHOR = float(os.environ.get('CLOCK_ANCHOR'))
+except:
+    CLOCK_ANCHOR = None
+
+# Endpoint of exchange API instead of Bybit mainnet, e.g. local fake exchange http://127.0.0.1:8090
+BYBIT_ENDPOINT = os.environ.get('BYBIT_ENDPOINT') or None
+
+# Decision rules: JSON file with list of rules {"tag": ..., "expression": ..., "flag": ...}, flag (is_<tag> by default)
+# is stored in its boolean column of klines and windows if there is one, otherwise in their flags column,
+# default rules of price growth and decline (ALARM_THRESHOLD, BTC_IMPACT_THRESHOLD) are used if it isn't set
+RULES_FILE = os.environ.get('RULES_FILE') or None
+
+# Orders placed by decisions: tags of decision rules with order side (e.g. growth:Buy,decline:Sell, empty - orders
+# aren't placed), order quantity in minimal quantities of symbol, minutes between orders of symbol,
+# timeout of order request, seconds between warming requests of keep-alive connection, number of recent latencies
+ORDER_SIDES = dict(
+    item.split(':') for item in (os.environ.get('ORDER_SIDES') or '').split(',') if ':' in item
+)
+
+try:
+    ORDER_QTY_MULTIPLIER = ftod(os.environ.get('ORDER_QTY_MULTIPLIER'), 9) or ftod(1.0, 9)
+except:
+    ORDER_QTY_MULTIPLIER = ftod(1.0, 9)
+
+try:
+    ORDER_COOLDOWN = int(os.environ.get('ORDER_COOLDOWN'))
+except:
+    ORDER_COOLDOWN = 15
+
+try:
+    ORDER_TIMEOUT = float(os.environ.get('ORDER_TIMEOUT'))
+except:
+    ORDER_TIMEOUT = 5.00
+
+try:
+    ORDER_KEEPALIVE_INTERVAL = float(os.environ.get('ORDER_KEEPALIVE_INTERVAL'))
+except:
+    ORDER_KEEPALIVE_INTERVAL = 30.00
+
+try:
+    ORDER_LATENCY_WINDOW = int(os.environ.get('ORDER_LATENCY_WINDOW'))
+except:
+    ORDER_LATENCY_WINDOW = 1000
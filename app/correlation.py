@@ -0,0 +1,239 @@
+"""
+Cross-symbol correlation engine
+Pairwise correlation of log returns of all symbols over the tracking window. Running sums of the window are
+updated each minute by outer products: returns of the new minute are added, returns of the minute which left
+the window are subtracted, so each update costs O(N^2) vectorized operations instead of O(W * N^2)
+"""
+
+import math
+from collections import deque
+from datetime import datetime, timedelta
+from typing import Optional
+
+import numpy as np
+
+from app.config import TRACKING_PERIOD, CORRELATION_MIN_PERIODS, CORRELATION_TOP_PEERS
+
+
+class CorrelationEngine:
+    """
+    Correlation matrix of all symbols with pairwise-complete observations
+    For pair (i, j) only minutes where both symbols have returns are used
+    """
+    def __init__(self, period: int = TRACKING_PERIOD, min_periods: int = CORRELATION_MIN_PERIODS):
+        self._period: int = period
+        self._min_periods: int = min_periods
+
+        self._index: dict = dict()
+        self._symbols: list = list()
+        self._capacity: int = 0
+        self._last_updated: dict = dict()
+
+        self._returns: deque = deque()
+        self._last_time: Optional[datetime] = None
+        self._last_close = np.zeros(0)
+        self._updates_count: int = 0
+
+        # Running sums over the window: count, sum x_i, sum x_i^2 and sum x_i * x_j of common minutes
+        self._n = np.zeros((0, 0))
+        self._sx = np.zeros((0, 0))
+        self._sxx = np.zeros((0, 0))
+        self._sxy = np.zeros((0, 0))
+
+        self._matrix: Optional[np.ndarray] = None
+
+    @property
+    def symbols(self) -> list:
+        return self._symbols
+
+    def _get_index(self, symbol_key: str) -> int:
+        idx = self._index.get(symbol_key)
+        if idx is None:
+            idx = self._index[symbol_key] = len(self._symbols)
+            self._symbols.append(symbol_key)
+            if idx >= self._capacity:
+                self._grow(max(64, self._capacity * 2))
+        return idx
+
+    def _grow(self, capacity: int) -> None:
+        """
+        Enlarge arrays for new symbols, running sums of new symbols are zero
+        """
+
+        def pad(matrix: np.ndarray) -> np.ndarray:
+            result = np.zeros((capacity, capacity))
+            result[:self._capacity, :self._capacity] = matrix
+            return result
+
+        self._n, self._sx, self._sxx, self._sxy = pad(self._n), pad(self._sx), pad(self._sxx), pad(self._sxy)
+        self._last_close = np.concatenate([self._last_close, np.zeros(capacity - self._capacity)])
+        self._capacity = capacity
+
+    def _accumulate(self, x: np.ndarray, m: np.ndarray, sign: float) -> None:
+        """
+        Add (sign=1) or subtract (sign=-1) returns x with mask m of one minute to running sums
+        """
+        if len(x) < self._capacity:
+            x = np.concatenate([x, np.zeros(self._capacity - len(x))])
+            m = np.concatenate([m, np.zeros(self._capacity - len(m))])
+        self._n += sign * np.outer(m, m)
+        self._sx += sign * np.outer(x, m)
+        self._sxx += sign * np.outer(x * x, m)
+        self._sxy += sign * np.outer(x, x)
+
+    def _recompute(self) -> None:
+        """
+        Recompute running sums from returns of the window to drop accumulated rounding errors
+        """
+        for matrix in (self._n, self._sx, self._sxx, self._sxy):
+            matrix.fill(0.0)
+        for time_kline, x, m in self._returns:
+            self._accumulate(x, m, 1.0)
+
+    def update(self, iteration) -> None:
+        """
+        Add returns of iteration klines and remove returns which left the window
+        Iterations must come in chronological order, older ones are ignored
+        """
+        if self._last_time is not None and iteration.time_kline <= self._last_time:
+            return
+        self._last_time = iteration.time_kline
+
+        for symbol_key in iteration.symbols_kline.keys():
+            self._get_index(symbol_key)
+
+        x = np.zeros(self._capacity)
+        m = np.zeros(self._capacity)
+        for symbol_key, kline in iteration.symbols_kline.items():
+            idx = self._index[symbol_key]
+            close_price = float(kline.close_price)
+            last_close = self._last_close[idx]
+            if last_close > 0.0 and close_price > 0.0:
+                x[idx] = math.log(close_price / last_close)
+                m[idx] = 1.0
+            self._last_close[idx] = close_price
+            self._last_updated[symbol_key] = iteration.time_kline
+
+        self._returns.append((iteration.time_kline, x, m))
+        self._accumulate(x, m, 1.0)
+
+        oldest_allowed_datetime = iteration.time_kline - timedelta(minutes=self._period)
+        while self._returns and self._returns[0][0] <= oldest_allowed_datetime:
+            time_kline, old_x, old_m = self._returns.popleft()
+            self._accumulate(old_x, old_m, -1.0)
+
+        self._updates_count += 1
+        if self._updates_count % self._period == 0:
+            self._recompute()
+
+        self._matrix = None
+
+    def merge_late(self, iteration, klines: list) -> None:
+        """
+        Add returns of klines received late to the newest minute of the window, if iteration is that minute
+        Late klines of older minutes are skipped: returns of the following minutes have been calculated already
+        from the previous close, they stay valid but cover several minutes
+        """
+        if not self._returns or iteration.time_kline != self._last_time:
+            return
+
+        time_kline, x, m = self._returns[-1]
+        self._accumulate(x, m, -1.0)
+        for kline in klines:
+            self._get_index(kline.symbol_key)
+        x = np.concatenate([x, np.zeros(self._capacity - len(x))])
+        m = np.concatenate([m, np.zeros(self._capacity - len(m))])
+
+        for kline in klines:
+            idx = self._index[kline.symbol_key]
+            close_price = float(kline.close_price)
+            last_close = self._last_close[idx]
+            if not m[idx] and last_close > 0.0 and close_price > 0.0:
+                x[idx] = math.log(close_price / last_close)
+                m[idx] = 1.0
+            self._last_close[idx] = close_price
+            self._last_updated[kline.symbol_key] = time_kline
+
+        self._returns[-1] = (time_kline, x, m)
+        self._accumulate(x, m, 1.0)
+        self._matrix = None
+
+    def garbage_collector(self, oldest_allowed_datetime: datetime) -> None:
+        """
+        Delete symbols which haven't been updated since oldest allowed time (e.g. delisted ones)
+        Arrays are compacted, running sums of the rest pairs stay as they are
+        """
+        stale = {symbol_key for symbol_key, time_kline in self._last_updated.items()
+                 if time_kline < oldest_allowed_datetime}
+        if not stale:
+            return
+
+        keep = np.array([idx for idx, symbol_key in enumerate(self._symbols) if symbol_key not in stale], dtype=int)
+        size = len(keep)
+
+        def compact(matrix: np.ndarray) -> np.ndarray:
+            result = np.zeros((self._capacity, self._capacity))
+            result[:size, :size] = matrix[np.ix_(keep, keep)]
+            return result
+
+        def compact_vector(vector: np.ndarray) -> np.ndarray:
+            result = np.zeros(self._capacity)
+            vector = vector[keep[keep < len(vector)]]
+            result[:len(vector)] = vector
+            return result
+
+        self._n, self._sx, self._sxx, self._sxy = \
+            compact(self._n), compact(self._sx), compact(self._sxx), compact(self._sxy)
+        self._last_close = compact_vector(self._last_close)
+        self._returns = deque((time_kline, compact_vector(x), compact_vector(m)) for time_kline, x, m in self._returns)
+
+        self._symbols = [self._symbols[idx] for idx in keep]
+        self._index = {symbol_key: idx for idx, symbol_key in enumerate(self._symbols)}
+        for symbol_key in stale:
+            self._last_updated.pop(symbol_key, None)
+        self._matrix = None
+
+    def get_matrix(self) -> np.ndarray:
+        """
+        Correlation matrix of symbols (in order of symbols property), NaN where there isn't enough data
+        """
+        if self._matrix is None:
+            size = len(self._symbols)
+            n = self._n[:size, :size]
+            sx = self._sx[:size, :size]
+            sxx = self._sxx[:size, :size]
+            sxy = self._sxy[:size, :size]
+
+            covariance = n * sxy - sx * sx.T
+            variance = (n * sxx - sx * sx) * (n * sxx.T - sx.T * sx.T)
+            with np.errstate(divide='ignore', invalid='ignore'):
+                matrix = covariance / np.sqrt(variance)
+            matrix[(n < self._min_periods) | ~(variance > 1e-30)] = np.nan
+            self._matrix = np.clip(matrix, -1.0, 1.0)
+
+        return self._matrix
+
+    def get_correlation(self, symbol_key: str, other_symbol_key: str) -> Optional[float]:
+        idx, other_idx = self._index.get(symbol_key), self._index.get(other_symbol_key)
+        if idx is None or other_idx is None:
+            return None
+        value = self.get_matrix()[idx, other_idx]
+        return None if np.isnan(value) else float(value)
+
+    def get_top_peers(self, symbol_key: str, count: int = CORRELATION_TOP_PEERS) -> list[tuple[str, float]]:
+        """
+        The most correlated symbols with symbol as list of (symbol, correlation)
+        """
+        idx = self._index.get(symbol_key)
+        if idx is None:
+            return []
+
+        row = self.get_matrix()[idx].copy()
+        row[idx] = np.nan
+        candidates = np.flatnonzero(~np.isnan(row))
+        if not len(candidates):
+            return []
+        if len(candidates) > count:
+            candidates = candidates[np.argpartition(-row[candidates], count - 1)[:count]]
+        candidates = candidates[np.argsort(-row[candidates])]
+        return [(self._symbols[peer_idx], float(row[peer_idx])) for peer_idx in candidates]
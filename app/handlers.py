@@ -1,13 +1,40 @@
+import logging
+import time
 from decimal import Decimal
 from datetime import datetime, timezone, timedelta
 from typing import Optional
 
+import numpy as np
 from sqlalchemy import select
 from sqlalchemy.ext.asyncio import async_sessionmaker
 
-from app.config import TRACKING_PERIOD, ALARM_THRESHOLD, BTC_IMPACT_THRESHOLD
-from app.models import KlineHistory
-from app.utils import ftod
+from app.alerts import Alert, AlertDispatcher
+from app.anomaly import AnomalyDetector
+from app.clock import get_clock
+from app.config import TRACKING_PERIOD, BTC_SYMBOL_KEYS, CATEGORIES, \
+    TIMEFRAMES, TIMEFRAME_TRACKING_PERIOD, ROLLUP_INTERVALS, TRACKING_PERIODS, MAX_TRACKING_PERIOD, RANGE_INDEX_MINUTES
+from app.correlation import CorrelationEngine
+from app.history import KlineHistoryReader
+from app.logger import get_rows_logger
+from app.models import KlineHistory, KlineWindow, get_upsert, get_row
+from app.orders import OrderDispatcher
+from app.rollups import save_rollups
+from app.rules import RuleSet, set_flag
+from app.timeframes import Timeframe
+from app.windows import MaxMinHistory, RangeMaxMinIndex
+from app.utils import ftod, get_symbol_key, split_symbol_key
+
+rows_logger = get_rows_logger()
+
+KLINE_UPSERT = get_upsert(KlineHistory.__table__, 'key_time')
+WINDOW_UPSERT = get_upsert(KlineWindow.__table__, 'key_time_period')
+
+
+def get_normal_value(value: Decimal, min_value: Decimal, max_value: Decimal) -> Decimal:
+    """
+    Value normalized to range [min_value, max_value]
+    """
+    return ftod((value - min_value) / (max_value - min_value), 9) if max_value > min_value else ftod(0.5, 9)
 
 
 class Iteration:
@@ -17,6 +44,8 @@ class Iteration:
     def __init__(self, time_kline: datetime):
         self._time_kline: datetime = time_kline
         self._symbols_kline: dict = dict()
+        self._symbols_window: dict = dict()
+        self._saved_symbols: set = set()
 
     def add_kline(self, symbol_key: str, open_price: Decimal = 0.0, high_price: Decimal = 0.0, low_price: Decimal = 0.0,
                   close_price: Decimal = 0.0, volume: Decimal = 0.0, turnover: Decimal = 0.0) -> KlineHistory:
@@ -40,6 +69,28 @@ class Iteration:
         Add existing in database kline to iteration
         """
         self._symbols_kline[kline.symbol_key] = kline
+        self._saved_symbols.add(kline.symbol_key)
+
+    def add_window(self, symbol_key: str, tracking_period: int) -> KlineWindow:
+        """
+        Add indicators of additional tracking window for kline
+        """
+        kline_window = KlineWindow()
+        kline_window.time_kline = self._time_kline
+        kline_window.symbol_key = symbol_key
+        kline_window.tracking_period = tracking_period
+        windows = self._symbols_window.get(symbol_key)
+        if windows is None:
+            windows = self._symbols_window[symbol_key] = dict()
+        windows[tracking_period] = kline_window
+        return kline_window
+
+    def get_window(self, symbol_key: str, tracking_period: int) -> Optional[KlineWindow]:
+        """
+        Indicators of additional tracking window for kline
+        """
+        windows = self._symbols_window.get(symbol_key)
+        return windows.get(tracking_period) if windows else None
 
     def __getitem__(self, item) -> KlineHistory:
         return self._symbols_kline.get(item)
@@ -55,16 +106,39 @@ class Iteration:
     def __len__(self):
         return len(self._symbols_kline)
 
+    @property
+    def unsaved_symbols(self) -> list:
+        return [symbol_key for symbol_key in self._symbols_kline.keys() if symbol_key not in self._saved_symbols]
+
     async def save_to_db(self, async_db_session: async_sessionmaker) -> None:
         """
-        Save kline in iteration to database
+        Save kline in iteration to database and merge them into rollup tables
+        Only klines which haven't been saved yet are saved, so it is called again for klines received late
         """
+        symbol_keys = self.unsaved_symbols
+        if not symbol_keys:
+            return
+        self._saved_symbols.update(symbol_keys)
+
+        klines = [self._symbols_kline[symbol_key] for symbol_key in symbol_keys]
+        windows = [window for symbol_key in symbol_keys
+                   for window in self._symbols_window.get(symbol_key, dict()).values()]
+        if rows_logger.isEnabledFor(logging.DEBUG):
+            for kline in klines:
+                rows_logger.debug('%s', kline)
+
+        # Klines and windows are upserted by one prepared statement each with rows passed as batch,
+        # so the whole iteration takes a few round trips and saving it again is harmless
         async with async_db_session() as session:
-            for symbol, kline in self._symbols_kline.items():
-                session.add(kline)
-                print(f'      {str(kline)}')
+            await session.execute(KLINE_UPSERT, [get_row(kline) for kline in klines])
+            if windows:
+                await session.execute(WINDOW_UPSERT, [get_row(window) for window in windows])
+            await save_rollups(session, klines)
             await session.commit()
 
+        # Cached history blocks of saved klines are out of date now
+        KlineHistoryReader().invalidate(symbol_keys, self._time_kline)
+
 
 class IterationStack:
     """
@@ -80,20 +154,63 @@ class IterationStack:
     def __init__(self):
         if hasattr(self, '_time_start'):
             return
-        self._time_start: datetime = datetime.utcnow()
+        self._time_start: datetime = get_clock().now()
 
         self._iterations: dict = dict()
         self.current_iteration: Optional[Iteration] = None
 
+        # Highs and lows of each symbol over the longest tracking window shared by all windows
+        self._max_min_history: dict = dict()
+
+        # Highs and lows of each symbol over the last RANGE_INDEX_MINUTES for queries of arbitrary time ranges
+        self._range_index: dict = dict()
+
+        # Pairwise correlation of returns of all symbols over the tracking window
+        self.correlation: CorrelationEngine = CorrelationEngine()
+
+        # Rolling statistics of volume and turnover to detect their spikes
+        self.anomaly_detector: AnomalyDetector = AnomalyDetector()
+
+        # Version of calculated data, it is changed when iteration has been calculated (used by read API)
+        self.version: int = 0
+
+        # Decision rules compiled once, they are evaluated for all klines of iteration together
+        self.rules: RuleSet = RuleSet.from_config()
+
+        # Dispatcher of alerts about decisions, its worker is started in event loop by start_alert_dispatcher
+        self.alert_dispatcher: AlertDispatcher = AlertDispatcher()
+
+        # Dispatcher of orders placed by decisions, its session is opened in event loop by start
+        self.order_dispatcher: OrderDispatcher = OrderDispatcher()
+
+        # Candles of longer timeframes built from 1-minute klines of iterations
+        self.timeframes: dict = {interval: Timeframe(interval, TIMEFRAME_TRACKING_PERIOD) for interval in TIMEFRAMES}
+
     async def get_kline_history(self, async_db_session: async_sessionmaker):
         """
         Fills the iteration stack with kline data from database when the program starts
         """
-        oldest_allowed_datetime = datetime.utcnow() - timedelta(minutes=TRACKING_PERIOD + 1)
+        now = get_clock().now()
+        oldest_allowed_datetime = now - timedelta(minutes=MAX_TRACKING_PERIOD + 1)
         oldest_allowed_datetime = datetime(oldest_allowed_datetime.year, oldest_allowed_datetime.month,
                                            oldest_allowed_datetime.day, oldest_allowed_datetime.hour,
                                            oldest_allowed_datetime.minute, 0, 0, tzinfo=timezone.utc)
 
+        # Range index is filled with highs and lows of its whole period (only price columns are loaded)
+        async with async_db_session() as session:
+            prices = await session.execute(
+                select(KlineHistory.symbol_key, KlineHistory.time_kline, KlineHistory.high_price,
+                       KlineHistory.low_price).
+                where(KlineHistory.time_kline > now - timedelta(minutes=RANGE_INDEX_MINUTES))
+            )
+            for symbol_key, time_kline, high_price, low_price in prices:
+                self._get_range_index(symbol_key).set(time_kline, high_price, low_price)
+
+        # Candles of timeframes are restored from rollup tables, if they are maintained for such interval
+        for interval, timeframe in self.timeframes.items():
+            if interval in ROLLUP_INTERVALS:
+                await timeframe.get_rollup_history(async_db_session, now)
+
         async with async_db_session() as session:
             kline_history = await session.execute(
                 select(KlineHistory).
@@ -104,6 +221,15 @@ class IterationStack:
                 if iteration is None:
                     iteration = self.add_iteration(kline.time_kline)
                 iteration.add_existing_kline(kline)
+                for timeframe in self.timeframes.values():
+                    timeframe.add_kline(kline)
+
+        self._rebuild_max_min_history()
+
+        for time_kline in sorted(self._iterations.keys()):
+            self.correlation.update(self._iterations[time_kline])
+            for kline in self._iterations[time_kline].symbols_kline.values():
+                self.anomaly_detector.push(kline)
 
     def add_iteration(self, time_kline: datetime) -> Iteration:
         """
@@ -120,6 +246,10 @@ class IterationStack:
     def __len__(self):
         return len(self._iterations)
 
+    @property
+    def iterations(self) -> dict:
+        return self._iterations
+
     def request_result_handler(self, status: int, result: dict) -> None:
         """
         Handler of request results from exchange
@@ -130,7 +260,7 @@ class IterationStack:
 
         try:
             if result['retCode'] == 0:
-                symbol_key = result['result']['symbol']
+                symbol_key = get_symbol_key(result['result']['category'], result['result']['symbol'])
                 time_kline = datetime.fromtimestamp(int(result['result']['list'][1][0]) / 1000, tz=timezone.utc)
                 open_price = ftod(result['result']['list'][1][1], 9)
                 high_price = ftod(result['result']['list'][1][2], 9)
@@ -150,7 +280,8 @@ class IterationStack:
         """
         Delete old iteration from stack
         """
-        oldest_allowed_datetime = datetime.utcnow() - timedelta(minutes=TRACKING_PERIOD + 5)
+        now = get_clock().now()
+        oldest_allowed_datetime = now - timedelta(minutes=MAX_TRACKING_PERIOD + 5)
         oldest_allowed_datetime = datetime(oldest_allowed_datetime.year, oldest_allowed_datetime.month,
                                            oldest_allowed_datetime.day, oldest_allowed_datetime.hour,
                                            oldest_allowed_datetime.minute, 0, 0, tzinfo=timezone.utc)
@@ -158,13 +289,92 @@ class IterationStack:
             if kline_datetime < oldest_allowed_datetime:
                 self._iterations.pop(kline_datetime, None)
 
+        for symbol_key in list(self._max_min_history.keys()):
+            if self._max_min_history[symbol_key].last_kline.time_kline < oldest_allowed_datetime:
+                self._max_min_history.pop(symbol_key, None)
+
+        self.anomaly_detector.garbage_collector(oldest_allowed_datetime)
+        self.correlation.garbage_collector(oldest_allowed_datetime)
+
+        oldest_indexed_datetime = now - timedelta(minutes=RANGE_INDEX_MINUTES)
+        for symbol_key in list(self._range_index.keys()):
+            if self._range_index[symbol_key].newest_time < oldest_indexed_datetime:
+                self._range_index.pop(symbol_key, None)
+
+        for timeframe in self.timeframes.values():
+            timeframe.garbage_collector(now)
+
+    def _rebuild_max_min_history(self, symbol_key: str = None) -> None:
+        """
+        Refill max/min history of symbol (or all symbols) from iterations in chronological order
+        Used when klines come not in chronological order, e.g. on start or late receiving
+        """
+        if symbol_key is None:
+            self._max_min_history.clear()
+        else:
+            self._max_min_history.pop(symbol_key, None)
+
+        for time_kline in sorted(self._iterations.keys()):
+            iteration = self._iterations[time_kline]
+            klines = iteration.symbols_kline.values() if symbol_key is None else [iteration[symbol_key]]
+            for kline in klines:
+                if kline:
+                    self._update_max_min_history(kline)
+
+    def _update_max_min_history(self, kline: KlineHistory) -> None:
+        """
+        Put new kline into max/min history of its symbol
+        """
+        history = self._max_min_history.get(kline.symbol_key)
+        if history is None:
+            history = self._max_min_history[kline.symbol_key] = MaxMinHistory(MAX_TRACKING_PERIOD)
+
+        if history.can_push(kline):
+            history.push(kline)
+        elif history.last_kline is not kline:
+            self._rebuild_max_min_history(kline.symbol_key)
+
+    def _get_range_index(self, symbol_key: str) -> RangeMaxMinIndex:
+        range_index = self._range_index.get(symbol_key)
+        if range_index is None:
+            range_index = self._range_index[symbol_key] = RangeMaxMinIndex(RANGE_INDEX_MINUTES)
+        return range_index
+
+    def get_range_max_min(self, symbol_key: str, start_time: datetime, end_time: datetime) \
+            -> tuple[Optional[datetime], Optional[Decimal], Optional[datetime], Optional[Decimal]]:
+        """
+        Time and price of max high and min low of symbol in any range [start_time, end_time]
+        within the last RANGE_INDEX_MINUTES
+        """
+        range_index = self._range_index.get(symbol_key)
+        if range_index is None:
+            return None, None, None, None
+        return range_index.get_max_min(start_time, end_time)
+
+    def get_range_bounds(self, symbol_key: str) -> tuple[Optional[datetime], Optional[datetime]]:
+        """
+        The oldest and the newest minute of symbol covered by range index
+        """
+        range_index = self._range_index.get(symbol_key)
+        if range_index is None:
+            return None, None
+        return range_index.oldest_time, range_index.newest_time
+
+    def get_largest_move(self, symbol_key: str, window: int, start_time: datetime, end_time: datetime) \
+            -> Optional[dict]:
+        """
+        The largest price move of symbol in any window of window minutes in range [start_time, end_time]
+        """
+        range_index = self._range_index.get(symbol_key)
+        return range_index.get_largest_move(window, start_time, end_time) if range_index else None
+
     def _get_max_min_in_period(
-            self, symbol_key: str, end_time: datetime
+            self, symbol_key: str, end_time: datetime, tracking_period: int = TRACKING_PERIOD
     ) -> tuple[Optional[Decimal], Optional[Decimal], Optional[Decimal], Optional[int],
                Optional[Decimal], Optional[Decimal], Optional[Decimal], Optional[int]]:
         """
         Calculate indicators for kline
-        Use kline same symbol in previous iterations
+        Use max/min history of symbol shared by all tracking windows
         """
 
         def minutes_diff(finish_time: datetime, start_time: datetime) -> int:
@@ -175,142 +385,186 @@ class IterationStack:
         max_price = delta_to_max = delta_to_max_in_percent = time_since_max = None
         min_price = delta_to_min = delta_to_min_in_percent = time_since_min = None
 
-        # Find current kline
-        kline = None
-        iter_time = end_time
-        while kline is None and iter_time is not None:
-            iteration = self[iter_time]
-            if iteration:
-                kline = iteration[symbol_key]
-            iter_time = iter_time - timedelta(minutes=1)
-            if iter_time < end_time - timedelta(minutes=TRACKING_PERIOD):
-                iter_time = None
-
-        if kline:
+        # Current kline is the newest kline of symbol within tracking period
+        start_time = end_time - timedelta(minutes=tracking_period)
+        history = self._max_min_history.get(symbol_key)
+        kline = history.last_kline if history else None
 
-            # Set initial values indicators from current kline
+        if kline and start_time <= kline.time_kline <= end_time:
             current_price = kline.close_price
-            max_price = kline.high_price
+            # Current kline wins ties, the oldest kline wins ties among previous ones
+            max_time, max_price = history.get_max(start_time)
+            if kline.high_price == max_price:
+                max_time = kline.time_kline
             delta_to_max = current_price - max_price
             delta_to_max_in_percent = delta_to_max / max_price
-            time_since_max = minutes_diff(end_time, kline.time_kline)
-            min_price = kline.low_price
+            time_since_max = minutes_diff(end_time, max_time)
+            min_time, min_price = history.get_min(start_time)
+            if kline.low_price == min_price:
+                min_time = kline.time_kline
             delta_to_min = current_price - min_price
             delta_to_min_in_percent = delta_to_min / min_price
-            time_since_min = minutes_diff(end_time, kline.time_kline)
-
-            # Calculate indicators using previous kline
-            for time_kline, iteration in self._iterations.items():
-                if end_time - timedelta(minutes=TRACKING_PERIOD) <= time_kline <= end_time:
-                    kline = iteration[symbol_key]
-                    if kline:
-                        if kline.high_price > max_price:
-                            max_price = kline.high_price
-                            delta_to_max = current_price - max_price
-                            delta_to_max_in_percent = delta_to_max / max_price
-                            time_since_max = minutes_diff(end_time, time_kline)
-                        if kline.low_price < min_price:
-                            min_price = kline.low_price
-                            delta_to_min = current_price - min_price
-                            delta_to_min_in_percent = delta_to_min / min_price
-                            time_since_min = minutes_diff(end_time, time_kline)
+            time_since_min = minutes_diff(end_time, min_time)
 
         return max_price, delta_to_max, delta_to_max_in_percent, time_since_max, \
             min_price, delta_to_min, delta_to_min_in_percent, time_since_min
 
-    def _get_btc_impact_rate(self, kline: KlineHistory, btc_kline: KlineHistory) -> Optional[Decimal]:
+    def _get_btc_normal_values(self, btc_kline: KlineHistory | KlineWindow,
+                               tracking_period: int = TRACKING_PERIOD) -> list[tuple[Iteration, Decimal]]:
+        """
+        Normalized close prices of BTC reference over tracking window with their iterations
+        They are calculated once per window and shared by BTC impact of all symbols of its category,
+        iterations of the window are taken by their minutes, not by scan of the whole stack
+        """
+        end_time = datetime(year=btc_kline.time_kline.year, month=btc_kline.time_kline.month,
+                            day=btc_kline.time_kline.day, hour=btc_kline.time_kline.hour,
+                            minute=btc_kline.time_kline.minute, second=0, microsecond=0, tzinfo=timezone.utc)
+
+        normal_values = []
+        for minutes in range(tracking_period, -1, -1):
+            iteration = self._iterations.get(end_time - timedelta(minutes=minutes))
+            window_btc_kline = iteration[btc_kline.symbol_key] if iteration else None
+            if window_btc_kline:
+                normal_values.append((iteration, get_normal_value(window_btc_kline.close_price, btc_kline.min_price,
+                                                                  btc_kline.max_price)))
+        return normal_values
+
+    @staticmethod
+    def _get_btc_impact_rate(kline: KlineHistory | KlineWindow,
+                             btc_normal_values: list[tuple[Iteration, Decimal]]) -> Optional[Decimal]:
         """
-        Calculate BTC impact
+        Calculate BTC impact against normalized close prices of BTC reference over tracking window
         Use the linear deviation method
         """
-
-        def get_normal_value(value: Decimal, min_value: Decimal, max_value: Decimal) -> Decimal:
-            return ftod((value - min_value) / (max_value - min_value), 9) if max_value > min_value else ftod(0.5, 9)
-
-        end_time = datetime(year=kline.time_kline.year, month=kline.time_kline.month, day=kline.time_kline.day,
-                            hour=kline.time_kline.hour, minute=kline.time_kline.minute, second=0, microsecond=0,
-                            tzinfo=timezone.utc)
-        symbol_key = kline.symbol_key
-        btc_symbol_key = btc_kline.symbol_key
-
-        btc_impact_rate = None
-
         linear_deviation_sum = ftod(0.0, 9)
         linear_deviation_count = 0
 
-        max_price = kline.max_price
-        min_price = kline.min_price
+        for iteration, btc_normal_value in btc_normal_values:
+            window_kline = iteration[kline.symbol_key]
+            if window_kline:
+                linear_deviation_sum += \
+                    abs(get_normal_value(window_kline.close_price, kline.min_price, kline.max_price) - btc_normal_value)
+                linear_deviation_count += 1
 
-        btc_max_price = btc_kline.max_price
-        btc_min_price = btc_kline.min_price
+        if linear_deviation_count:
+            return ftod(1 - linear_deviation_sum / linear_deviation_count, 9)
+        return None
 
-        for time_kline, iteration in self._iterations.items():
-            if end_time - timedelta(minutes=TRACKING_PERIOD) <= time_kline <= end_time:
-                kline = iteration[symbol_key]
+    def _get_indicators_holder(self, iteration: Iteration, kline: KlineHistory,
+                               tracking_period: int) -> KlineHistory | KlineWindow:
+        """
+        Object to store indicators of tracking window: kline itself for the main window, window row for others
+        """
+        if tracking_period == TRACKING_PERIOD:
+            return kline
+        kline_window = iteration.get_window(kline.symbol_key, tracking_period)
+        if kline_window is None:
+            kline_window = iteration.add_window(kline.symbol_key, tracking_period)
+        return kline_window
+
+    def calculate_indicators(self, iteration: Iteration, symbol_keys: list = None) -> None:
+        """
+        Calculate indicators for each kline in iteration for each tracking window
+        If symbol_keys is set, indicators are calculated only for their klines (e.g. for klines received late),
+        indicators of BTC references calculated before are reused
+        """
+        if symbol_keys is None:
+            klines = list(iteration.symbols_kline.values())
+        else:
+            klines = [iteration[symbol_key] for symbol_key in symbol_keys if iteration[symbol_key]]
+        calculated_symbols = {kline.symbol_key for kline in klines}
+
+        for kline in klines:
+            self._update_max_min_history(kline)
+            self._get_range_index(kline.symbol_key).set(kline.time_kline, kline.high_price, kline.low_price)
+
+        # BTC impact of symbol is calculated against BTC reference of its category
+        btc_symbol_keys = {category: BTC_SYMBOL_KEYS[category] for category in CATEGORIES}
+        for tracking_period in TRACKING_PERIODS:
+            btc_values = dict()
+            for category, btc_symbol_key in btc_symbol_keys.items():
                 btc_kline = iteration[btc_symbol_key]
-                if kline and btc_kline:
-                    linear_deviation_sum += \
-                        abs(get_normal_value(kline.close_price, min_price, max_price) -
-                            get_normal_value(btc_kline.close_price, btc_min_price, btc_max_price))
-                    linear_deviation_count += 1
-
-        if linear_deviation_count:
-            btc_impact_rate = ftod(1 - linear_deviation_sum / linear_deviation_count, 9)
-
-        return btc_impact_rate
-
-    def calculate_indicators(self, iteration: Iteration) -> None:
-        """
-        Calculate indicators for each kline in iteration
-        """
-        btc_symbol_key = 'BTCUSDT'
-        btc_kline = iteration[btc_symbol_key]
-        if btc_kline:
-            btc_kline.max_price, btc_kline.delta_to_max, \
-                btc_kline.delta_to_max_in_percent, btc_kline.time_since_max, \
-                btc_kline.min_price, btc_kline.delta_to_min, \
-                btc_kline.delta_to_min_in_percent, btc_kline.time_since_min = \
-                self._get_max_min_in_period(btc_symbol_key, btc_kline.time_kline)
-            btc_kline.btc_impact_rate = ftod(1.0, 9)
-
-        for symbol_key, kline in iteration.symbols_kline.items():
-            if symbol_key != btc_symbol_key:
-                kline.max_price, kline.delta_to_max, \
-                    kline.delta_to_max_in_percent, kline.time_since_max, \
-                    kline.min_price, kline.delta_to_min, \
-                    kline.delta_to_min_in_percent, kline.time_since_min = \
-                    self._get_max_min_in_period(symbol_key, kline.time_kline)
                 if btc_kline:
-                    kline.btc_impact_rate = self._get_btc_impact_rate(kline, btc_kline)
-                else:
-                    kline.btc_impact_rate = ftod(0.0, 9)
-
-    def _announce_victory(self, kline: KlineHistory) -> None:
-        """
-        Print success massage
-        """
-
-        print('  -----------------------------------------------------------------------------------------------------')
-        print(f'  {datetime.utcnow()} УРА!!!')
-        if kline.is_growth_over_1_percent:
-            print(f"      Цена фьючерса {kline.symbol_key} "
-                  f"выросла на {abs(kline.delta_to_min_in_percent) * 100:.2f} % "
-                  f"за {kline.time_since_min} мин.")
-        if kline.is_decline_over_1_percent:
-            print(f"      Цена фьючерса {kline.symbol_key} "
-                  f"упала на {abs(kline.delta_to_max_in_percent) * 100:.2f} % "
-                  f"за {kline.time_since_max} мин.")
-        print('  -----------------------------------------------------------------------------------------------------')
-
-    def make_decision(self, iteration: Iteration) -> None:
-        """
-        Make decision to achieve the goal for each kline in current iteration
-        In this case, about reaching the price change threshold without BTC impact
-        """
-        for symbol_key, kline in iteration.symbols_kline.items():
-            if abs(kline.delta_to_min_in_percent) >= ALARM_THRESHOLD and kline.btc_impact_rate <= BTC_IMPACT_THRESHOLD:
-                kline.is_growth_over_1_percent = True
-                self._announce_victory(kline)
-            if abs(kline.delta_to_max_in_percent) >= ALARM_THRESHOLD and kline.btc_impact_rate <= BTC_IMPACT_THRESHOLD:
-                kline.is_decline_over_1_percent = True
-                self._announce_victory(kline)
+                    btc_kline = self._get_indicators_holder(iteration, btc_kline, tracking_period)
+                    if btc_symbol_key in calculated_symbols:
+                        btc_kline.max_price, btc_kline.delta_to_max, \
+                            btc_kline.delta_to_max_in_percent, btc_kline.time_since_max, \
+                            btc_kline.min_price, btc_kline.delta_to_min, \
+                            btc_kline.delta_to_min_in_percent, btc_kline.time_since_min = \
+                            self._get_max_min_in_period(btc_symbol_key, btc_kline.time_kline, tracking_period)
+                        btc_kline.btc_impact_rate = ftod(1.0, 9)
+                    btc_values[category] = self._get_btc_normal_values(btc_kline, tracking_period)
+
+            for kline in klines:
+                symbol_key = kline.symbol_key
+                category, symbol = split_symbol_key(symbol_key)
+                if symbol_key != btc_symbol_keys.get(category):
+                    kline = self._get_indicators_holder(iteration, kline, tracking_period)
+                    kline.max_price, kline.delta_to_max, \
+                        kline.delta_to_max_in_percent, kline.time_since_max, \
+                        kline.min_price, kline.delta_to_min, \
+                        kline.delta_to_min_in_percent, kline.time_since_min = \
+                        self._get_max_min_in_period(symbol_key, kline.time_kline, tracking_period)
+                    btc_normal_values = btc_values.get(category)
+                    if btc_normal_values is not None:
+                        kline.btc_impact_rate = self._get_btc_impact_rate(kline, btc_normal_values)
+                    else:
+                        kline.btc_impact_rate = ftod(0.0, 9)
+
+        # Update running sums of correlation matrix with returns of iteration,
+        # returns of late klines are merged into the newest minute only
+        if symbol_keys is None:
+            self.correlation.update(iteration)
+        else:
+            self.correlation.merge_late(iteration, klines)
+
+        # Score volume and turnover of klines against their rolling statistics
+        for kline in klines:
+            self.anomaly_detector.update(kline)
+
+        # Merge klines into candles of longer timeframes and calculate the same indicators for them
+        for timeframe in self.timeframes.values():
+            for kline in klines:
+                timeframe.add_kline(kline)
+            timeframe.calculate_indicators(iteration.time_kline)
+
+    def _announce_victory(self, kline: KlineHistory | KlineWindow, tags: list) -> None:
+        """
+        Submit success alert to alert dispatcher
+        """
+        self.alert_dispatcher.submit(Alert.from_kline(kline, tags))
+
+    def make_decision(self, iteration: Iteration, symbol_keys: list = None, place_orders: bool = True) -> None:
+        """
+        Make decision to achieve the goal for each kline in current iteration and each tracking window
+        Decision rules are evaluated for all klines and windows at once, each satisfied rule sets its flag
+        and adds its tag to alert
+        If symbol_keys is set, decision is made only for them (e.g. for klines received late)
+        Orders aren't placed if place_orders is false, e.g. decisions about late klines are made on stale prices
+        """
+        rows = [
+            (iteration[symbol_key], self._get_indicators_holder(iteration, iteration[symbol_key], tracking_period))
+            for symbol_key in (iteration.symbols_kline.keys() if symbol_keys is None else symbol_keys)
+            for tracking_period in TRACKING_PERIODS
+        ]
+
+        rows_tags = [[] for _ in rows]
+        for rule, mask in self.rules.evaluate(rows):
+            for idx in np.flatnonzero(mask):
+                set_flag(rows[idx][1], rule.flag)
+                rows_tags[idx].append(rule.tag)
+
+        # Orders are sent before alerts are made, latency of order is counted from the moment of decision
+        decided = time.perf_counter()
+        for (kline, holder), tags in zip(rows, rows_tags):
+            if tags and place_orders:
+                self.order_dispatcher.submit(iteration.time_kline, kline.symbol_key, tags, decided)
+
+        for (kline, holder), tags in zip(rows, rows_tags):
+            if tags or getattr(holder, 'is_volume_spike', False):
+                self._announce_victory(holder, tags)
+
+        # Alerts raised in this minute are sent as one batch
+        self.alert_dispatcher.flush()
+
+        self.version += 1
@@ -0,0 +1,177 @@
+"""
+Query layer for historical kline ranges
+(symbol, time range) slices are fetched from kline_history in bulk and cached as decoded columnar chunks
+in bounded LRU cache keyed by symbol and aligned time block. Blocks are invalidated when new iteration is saved
+"""
+
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from typing import Iterable, Optional
+
+import numpy as np
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import async_sessionmaker
+
+from app.config import HISTORY_BLOCK_MINUTES, HISTORY_CACHE_BLOCKS
+from app.models import KlineHistory
+from app.rollups import get_bucket_time
+
+HISTORY_COLUMNS = (
+    'open_price', 'high_price', 'low_price', 'close_price', 'volume', 'turnover',
+    'max_price', 'min_price', 'delta_to_max_in_percent', 'delta_to_min_in_percent', 'btc_impact_rate',
+    'volume_z_score', 'turnover_z_score', 'vwap', 'trade_imbalance',
+)
+
+
+class KlineChunk:
+    """
+    Columnar klines of one symbol: times (unix seconds) and float columns in chronological order
+    """
+    def __init__(self, times: np.ndarray, columns: dict):
+        self.times: np.ndarray = times
+        self.columns: dict = columns
+
+    @classmethod
+    def from_klines(cls, klines: list) -> 'KlineChunk':
+        klines = sorted(klines, key=lambda k: k.time_kline)
+        times = np.array([int(k.time_kline.timestamp()) for k in klines], dtype=np.int64)
+        columns = {
+            column: np.array([np.nan if getattr(k, column) is None else float(getattr(k, column)) for k in klines],
+                             dtype=np.float64)
+            for column in HISTORY_COLUMNS
+        }
+        return cls(times, columns)
+
+    @classmethod
+    def concatenate(cls, chunks: list) -> 'KlineChunk':
+        if not chunks:
+            return cls(np.zeros(0, dtype=np.int64), {column: np.zeros(0) for column in HISTORY_COLUMNS})
+        return cls(np.concatenate([c.times for c in chunks]),
+                   {column: np.concatenate([c.columns[column] for c in chunks]) for column in HISTORY_COLUMNS})
+
+    def slice(self, start: datetime, end: datetime) -> 'KlineChunk':
+        """
+        Klines in range [start, end)
+        """
+        lo, hi = np.searchsorted(self.times, [int(start.timestamp()), int(end.timestamp())])
+        return KlineChunk(self.times[lo:hi], {column: values[lo:hi] for column, values in self.columns.items()})
+
+    def __getitem__(self, item) -> np.ndarray:
+        return self.columns[item]
+
+    def __len__(self):
+        return len(self.times)
+
+
+class KlineHistoryReader:
+    """
+    Reader of kline history with LRU cache of blocks
+    """
+    __object = None
+
+    def __new__(cls, *args, **kwargs):
+        if cls.__object is None:
+            cls.__object = super().__new__(cls)
+        return cls.__object
+
+    def __init__(self, async_db_session: async_sessionmaker = None, block_minutes: int = HISTORY_BLOCK_MINUTES,
+                 max_blocks: int = HISTORY_CACHE_BLOCKS):
+        if hasattr(self, '_blocks'):
+            if async_db_session is not None:
+                self._async_db_session = async_db_session
+            return
+
+        self._async_db_session: Optional[async_sessionmaker] = async_db_session
+        self._block_minutes: int = block_minutes
+        self._max_blocks: int = max_blocks
+        self._blocks: OrderedDict = OrderedDict()
+
+        self.hits_count: int = 0
+        self.misses_count: int = 0
+
+    def _get_block_times(self, start: datetime, end: datetime) -> list:
+        block_time = get_bucket_time(start, self._block_minutes)
+        block_times = []
+        while block_time < end:
+            block_times.append(block_time)
+            block_time += timedelta(minutes=self._block_minutes)
+        return block_times
+
+    def _put_block(self, key: tuple, chunk: KlineChunk) -> None:
+        self._blocks[key] = chunk
+        self._blocks.move_to_end(key)
+        while len(self._blocks) > self._max_blocks:
+            self._blocks.popitem(last=False)
+
+    async def _fetch_blocks(self, symbol_keys: list, block_times: list) -> dict:
+        """
+        Fetch blocks of symbols by one query over the time range of blocks and put them in cache
+        """
+        start = block_times[0]
+        end = block_times[-1] + timedelta(minutes=self._block_minutes)
+
+        klines = {(symbol_key, block_time): [] for symbol_key in symbol_keys for block_time in block_times}
+        async with self._async_db_session() as session:
+            kline_history = await session.execute(
+                select(KlineHistory).
+                where(KlineHistory.symbol_key.in_(symbol_keys)).
+                where(KlineHistory.time_kline >= start).
+                where(KlineHistory.time_kline < end)
+            )
+            for kline in kline_history.scalars():
+                key = (kline.symbol_key, get_bucket_time(kline.time_kline, self._block_minutes))
+                if key in klines:
+                    klines[key].append(kline)
+
+        blocks = {key: KlineChunk.from_klines(block_klines) for key, block_klines in klines.items()}
+        for key, chunk in blocks.items():
+            self._put_block(key, chunk)
+        return blocks
+
+    async def get_range(self, symbol_keys: Iterable[str], start: datetime, end: datetime) -> dict:
+        """
+        Klines of symbols in range [start, end) as {symbol: KlineChunk}
+        Missing blocks of all symbols are fetched by one query
+        """
+        symbol_keys = list(symbol_keys)
+        block_times = self._get_block_times(start, end)
+
+        blocks = dict()
+        missing_symbols, missing_block_times = set(), set()
+        for symbol_key in symbol_keys:
+            for block_time in block_times:
+                key = (symbol_key, block_time)
+                if key in self._blocks:
+                    self._blocks.move_to_end(key)
+                    blocks[key] = self._blocks[key]
+                    self.hits_count += 1
+                else:
+                    missing_symbols.add(symbol_key)
+                    missing_block_times.add(block_time)
+                    self.misses_count += 1
+
+        # Blocks are taken from the fetched ones, as cache may evict them if range is larger than cache
+        if missing_symbols:
+            fetched = await self._fetch_blocks(sorted(missing_symbols), sorted(missing_block_times))
+            for key, chunk in fetched.items():
+                blocks.setdefault(key, chunk)
+
+        result = dict()
+        for symbol_key in symbol_keys:
+            chunks = [blocks[(symbol_key, block_time)] for block_time in block_times]
+            result[symbol_key] = KlineChunk.concatenate(chunks).slice(start, end)
+        return result
+
+    def invalidate(self, symbol_keys: Iterable[str], time_kline: datetime) -> None:
+        """
+        Drop cached blocks which the saved klines belong to
+        """
+        block_time = get_bucket_time(time_kline, self._block_minutes)
+        for symbol_key in symbol_keys:
+            self._blocks.pop((symbol_key, block_time), None)
+
+    def clear(self) -> None:
+        self._blocks.clear()
+
+    def __len__(self):
+        return len(self._blocks)
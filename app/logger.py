@@ -0,0 +1,114 @@
+"""
+Structured logging
+Records are put into queue by handler without formatting, formatting and output are made by listener thread,
+so logging doesn't block event loop. Per-row records are sampled
+"""
+
+import json
+import logging
+import queue
+import random
+import sys
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+from typing import Optional
+
+from app.config import LOG_LEVEL, LOG_FORMAT, LOG_FILE, LOG_ROW_SAMPLE_RATE
+
+# Attributes of LogRecord, the rest of attributes are extra fields of structured record
+_RECORD_ATTRIBUTES = set(logging.LogRecord('', 0, '', 0, '', None, None).__dict__.keys()) | {'message', 'asctime'}
+
+_listener: Optional[QueueListener] = None
+
+
+class JsonFormatter(logging.Formatter):
+    """
+    Format record as one JSON line with extra fields
+    """
+    def format(self, record: logging.LogRecord) -> str:
+        data = {
+            'time': datetime.fromtimestamp(record.created, tz=timezone.utc).isoformat(),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        for key, value in record.__dict__.items():
+            if key not in _RECORD_ATTRIBUTES:
+                data[key] = value
+        if record.exc_info:
+            data['exc_info'] = self.formatException(record.exc_info)
+        return json.dumps(data, ensure_ascii=False, default=str)
+
+
+class DeferredQueueHandler(QueueHandler):
+    """
+    Queue handler which leaves formatting of record to listener thread
+    """
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record
+
+
+class SamplingFilter(logging.Filter):
+    """
+    Pass only the part of records given by rate
+    """
+    def __init__(self, rate: float):
+        super().__init__()
+        self.rate: float = rate
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        return self.rate >= 1.0 or random.random() < self.rate
+
+
+def get_logger(name: str) -> logging.Logger:
+    """
+    Logger of application module
+    """
+    return logging.getLogger(f'app.{name}')
+
+
+def get_rows_logger() -> logging.Logger:
+    """
+    Logger of per-row records (klines), they are sampled by LOG_ROW_SAMPLE_RATE
+    """
+    return logging.getLogger('app.rows')
+
+
+def setup_logging() -> None:
+    """
+    Configure application loggers to write through queue, start listener thread
+    """
+    global _listener
+    if _listener is not None:
+        return
+
+    formatter = JsonFormatter() if LOG_FORMAT == 'json' else \
+        logging.Formatter('%(asctime)s %(levelname)s %(name)s: %(message)s')
+
+    handlers = [logging.StreamHandler(sys.stdout)]
+    if LOG_FILE:
+        handlers.append(logging.FileHandler(LOG_FILE))
+    for handler in handlers:
+        handler.setFormatter(formatter)
+
+    log_queue = queue.SimpleQueue()
+    _listener = QueueListener(log_queue, *handlers, respect_handler_level=True)
+
+    app_logger = logging.getLogger('app')
+    app_logger.setLevel(LOG_LEVEL)
+    app_logger.propagate = False
+    app_logger.addHandler(DeferredQueueHandler(log_queue))
+
+    get_rows_logger().addFilter(SamplingFilter(LOG_ROW_SAMPLE_RATE))
+
+    _listener.start()
+
+
+def shutdown_logging() -> None:
+    """
+    Flush queued records and stop listener thread
+    """
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
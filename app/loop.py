@@ -0,0 +1,89 @@
+"""
+Event loop of the program
+uvloop is used if EVENT_LOOP is 'uvloop' and it is installed, otherwise standard asyncio loop.
+Loop lag monitor measures how late the loop runs scheduled callbacks, CPU-bound work on the loop makes it grow
+"""
+
+import asyncio
+from collections import deque
+from typing import Optional
+
+from app.config import EVENT_LOOP, LOOP_LAG_INTERVAL, LOOP_LAG_WINDOW, LOOP_LAG_WARNING
+from app.logger import get_logger
+from app.utils import get_percentile
+
+logger = get_logger('loop')
+
+
+def new_event_loop() -> asyncio.AbstractEventLoop:
+    """
+    Make event loop of type given by EVENT_LOOP, fall back to asyncio loop if uvloop is unavailable
+    """
+    if EVENT_LOOP == 'uvloop':
+        try:
+            import uvloop
+        except ImportError:
+            logger.warning('uvloop is not installed, standard asyncio event loop is used')
+        else:
+            logger.info('uvloop event loop is used')
+            return uvloop.new_event_loop()
+    return asyncio.new_event_loop()
+
+
+class LoopLagMonitor:
+    """
+    Sampler of loop lag: it sleeps for interval and measures how much later than expected it wakes up
+    """
+    __object = None
+
+    def __new__(cls, *args, **kwargs):
+        if cls.__object is None:
+            cls.__object = super().__new__(cls)
+        return cls.__object
+
+    def __init__(self, interval: float = LOOP_LAG_INTERVAL, window: int = LOOP_LAG_WINDOW):
+        if hasattr(self, '_lags'):
+            return
+        self._interval: float = interval
+        self._lags: deque = deque(maxlen=window)
+        self._task: Optional[asyncio.Task] = None
+        self.max_lag: float = 0.0
+        self.samples_count: int = 0
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def _run(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            expected = loop.time() + self._interval
+            await asyncio.sleep(self._interval)
+            lag = max(0.0, loop.time() - expected)
+            self._lags.append(lag)
+            self.max_lag = max(self.max_lag, lag)
+            self.samples_count += 1
+
+            if lag >= LOOP_LAG_WARNING:
+                logger.warning('Event loop lag = %.3f s', lag, extra={'loop_lag': lag})
+
+            # Report statistics once per window
+            if self.samples_count % self._lags.maxlen == 0:
+                logger.info('Event loop lag statistics', extra={'loop_lag': self.get_stats()})
+
+    def get_stats(self) -> dict:
+        """
+        Statistics of lags in the recent window (seconds)
+        """
+        if not self._lags:
+            return {'samples_count': 0}
+        lags = sorted(self._lags)
+
+        return {
+            'samples_count': self.samples_count,
+            'mean': sum(lags) / len(lags),
+            'p50': get_percentile(lags, 50),
+            'p99': get_percentile(lags, 99),
+            'max': lags[-1],
+            'max_all_time': self.max_lag,
+        }
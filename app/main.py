@@ -1,16 +1,36 @@
 import asyncio
+import signal
 import time
 from datetime import datetime, timezone, timedelta
 
 import aiohttp
-from sqlalchemy import select
 
-from app.aiohttp_handlers import request_async, execute_gather
+from app.aiohttp_handlers import request_async, fetch_with_deadline, handle_result
+from app.api import start_api
 from app.bybit import Bybit
-from app.config import LIMIT_PER_HOST, LIMIT, TTL_DNS_CACHE, DEBUG
+from app.clock import get_clock
+from app.config import LIMIT_PER_HOST, LIMIT, TTL_DNS_CACHE, INGESTION_MODE, TICKERS_SAMPLES_PER_MINUTE, \
+    SYMBOLS_REFRESH_SCHEDULE, FETCH_DEADLINE, FETCH_LATE_TIMEOUT, FETCH_TIMEOUT, CATEGORIES, TRADES_POLLS_PER_MINUTE, \
+    TRADES_FINAL_POLL_DEADLINE
 from app.handlers import IterationStack
-from app.models import Symbol, get_async_session
+from app.history import KlineHistoryReader
+from app.logger import get_logger, setup_logging, shutdown_logging
+from app.loop import new_event_loop, LoopLagMonitor
+from app.models import get_async_session, DatabaseStats
+from app.profiler import Profiler
 from app.scheduler import AsyncScheduler
+from app.symbols import SymbolRegistry
+from app.tickers import TickerSampler
+from app.trades import TradeAggregator, get_trades_limit
+from app.utils import split_symbol_key
+
+logger = get_logger('main')
+
+# Background tasks of late results reconciliation
+reconcile_tasks: set = set()
+
+# Number of iterations of the main handler which are running now, more than one means they overlap
+running_iterations: int = 0
 
 
 async def schedule_event_handler():
@@ -18,86 +38,253 @@ async def schedule_event_handler():
     The main handler
     It gets actually kline history data from Bybit exchange, saves them in iteration stack, calculates indicators,
     makes decision, annotates expected results and saves data to database
+    Iteration which starts before the previous one has been finished is reported as overlapping
     """
 
-    if DEBUG:
-        print(f"{datetime.utcnow()} Start iteration")
+    global running_iterations
 
-    # Create new iteration in iteration stack with time one minute ago
-    now = datetime.utcnow() - timedelta(seconds=30)
-    time_kline = datetime(now.year, now.month, now.day, now.hour, now.minute, 0, 0, tzinfo=timezone.utc)
-    iteration = iteration_stack.add_iteration(time_kline)
+    logger.debug('Start iteration')
+
+    # Previous iteration hasn't been finished yet, e.g. program can't keep up with accelerated clock
+    if running_iterations:
+        logger.warning('Iteration overlaps %s previous ones', running_iterations,
+                       extra={'running_iterations': running_iterations})
+    running_iterations += 1
+    try:
+        await run_iteration()
+    finally:
+        running_iterations -= 1
 
-    # Get list of symbols form databasec for tracking and calculation
-    async with async_db_session() as session:
-        symbols = await session.execute(
-            select(Symbol).
-            where(Symbol.is_active)
-        )
 
-        # Prepare list of requests to Bybit exchange by bybit.py module (API connector for Bybit HTTP API v.5)
-        # Use method Get Kline (https://bybit-exchange.github.io/docs/v5/market/kline)
-        # for get last full minute kline data for each symbol
-        if symbols:
-            requests = [
-                bybit.get_kline(category='linear', symbol=s.symbol, interval=1, limit='2')
-                for s in symbols.scalars()
-            ]
-        else:
-            requests = []
+async def run_iteration():
+    """
+    Single iteration of the main handler for the last full minute
+    """
+
+    # Create new iteration in iteration stack with time one minute ago by the clock of the program
+    now = get_clock().now() - timedelta(seconds=30)
+    time_kline = datetime(now.year, now.month, now.day, now.hour, now.minute, 0, 0, tzinfo=timezone.utc)
+    iteration = iteration_stack.add_iteration(time_kline)
 
-    if DEBUG:
-        print(f"  {datetime.utcnow()} Symbols have been loaded from database, requests have been prepared")
+    # Start profile of iteration, it measures phases and takes sampled stacks if stack sampling is on
+    profile = profiler.start_iteration(time_kline)
+
+    # Get list of symbols for tracking and calculation from symbol registry (it is kept in memory)
+    symbols = symbol_registry.symbols
+
+    # Prepare list of requests to Bybit exchange by bybit.py module (API connector for Bybit HTTP API v.5)
+    # Use method Get Kline (https://bybit-exchange.github.io/docs/v5/market/kline)
+    # for get last full minute kline data for each symbol, symbols of all categories are fetched together
+    # In tickers mode klines have been already built from tickers snapshots, so take them from ticker sampler
+    if INGESTION_MODE == 'tickers':
+        with profile.phase('fetch'):
+            ticker_sampler.flush(iteration, symbols)
+        requests = []
+    else:
+        requests = [
+            bybit.get_kline(category=category, symbol=symbol, interval=1, limit='2')
+            for category, symbol in map(split_symbol_key, symbols)
+        ]
+
+    logger.debug('Symbols have been taken from registry, requests have been prepared',
+                 extra={'time_kline': time_kline, 'symbols_count': len(symbols)})
 
     # Make requests to exchange in asynchronous mode for all symbols together by aiohttp_handlers.py module
     # Declare iteration_stack.request_result_handler as handler received results,
     # it will be calls for result for each symbols
+    # Fetch phase is bounded by deadline: slow requests are duplicated (hedged), failed ones are retried,
+    # requests not finished by deadline are left pending and their results are reconciled after the iteration
+    # The last trades poll of the minute runs beside it on its own session with its own shorter deadline,
+    # so trades of the last seconds of the minute are aggregated before they are flushed to klines
 
-    if DEBUG:
-        s = time.perf_counter()
+    s = time.perf_counter()
 
+    trades_task = asyncio.create_task(trades_event_handler(min(TRADES_FINAL_POLL_DEADLINE, FETCH_DEADLINE))) \
+        if TRADES_POLLS_PER_MINUTE else None
+
+    # Late results are reconciled in background after this iteration has been finished (event is set),
+    # the fetch session is handed off to reconciliation or closed here on every path
+    finished = asyncio.Event()
+    pending = set()
     conn = aiohttp.TCPConnector(limit_per_host=LIMIT_PER_HOST, limit=LIMIT, ttl_dns_cache=TTL_DNS_CACHE)
     aiohttp_session = aiohttp.ClientSession(connector=conn)
-    await execute_gather(
-        *(request_async(aiohttp_session, *request, iteration_stack.request_result_handler) for request in requests)
-    )
-    await conn.close()
+    try:
+        with profile.phase('fetch'):
+            pending = await fetch_with_deadline(aiohttp_session, requests, iteration_stack.request_result_handler,
+                                                deadline=get_clock().to_real(FETCH_DEADLINE))
+        if pending:
+            task = asyncio.create_task(reconcile_late_results(iteration, pending, aiohttp_session, finished))
+            reconcile_tasks.add(task)
+            task.add_done_callback(reconcile_tasks.discard)
+    except BaseException:
+        for task in pending:
+            task.cancel()
+        if trades_task is not None:
+            trades_task.cancel()
+        pending = set()
+        raise
+    finally:
+        if not pending:
+            await aiohttp_session.close()
+
+    try:
+        await process_iteration(iteration, symbols, profile, time.perf_counter() - s, trades_task)
+    finally:
+        finished.set()
+
+
+async def process_iteration(iteration, symbols: list, profile, elapsed: float, trades_task: asyncio.Task = None):
+    """
+    Calculation, decision making and saving of iteration after the fetch phase
+    """
+
+    # Set trade indicators (VWAP, buy/sell volume, trades count) of klines from trades aggregated by polls,
+    # the last poll is bounded by its deadline, it has usually finished before the kline fetch
+    if trades_task is not None:
+        with profile.phase('trades'):
+            await trades_task
+        trade_aggregator.flush(iteration, symbols)
 
-    if DEBUG:
-        elapsed = time.perf_counter() - s
-        print(f"  {datetime.utcnow()} Requests have been processed, processing time = {elapsed}")
+    logger.debug('Requests have been processed, processing time = %s', elapsed,
+                 extra={'time_kline': iteration.time_kline, 'klines_count': len(iteration), 'elapsed': elapsed})
 
     # After receiving data from exchange calculate indicators for each kline in current iteration
-    iteration_stack.calculate_indicators(iteration)
+    with profile.phase('calculate_indicators'):
+        iteration_stack.calculate_indicators(iteration)
 
     # After calculate indicators make decision
     # In this case, about reaching the price change threshold without BTC impact
     # If successful, annotate it
-    iteration_stack.make_decision(iteration)
+    with profile.phase('make_decision'):
+        iteration_stack.make_decision(iteration)
 
-    if DEBUG:
-        print(f"  {datetime.utcnow()} Indicators have been calculated, decisions have been made")
+    logger.debug('Indicators have been calculated, decisions have been made')
 
     # Save all received and calculated data to database for future use
-    if DEBUG:
-        print(f"  {datetime.utcnow()} Data is saving to database:")
+    logger.debug('Data is saving to database')
 
+    with profile.phase('save_to_db'):
+        await iteration.save_to_db(async_db_session)
+
+    logger.debug('Data have been saved to database. Iteration has been finished.',
+                 extra={'database': DatabaseStats().get_stats()})
+
+    profiler.finish_iteration(profile)
+
+
+async def reconcile_late_results(iteration, pending: set, aiohttp_session: aiohttp.ClientSession,
+                                 finished: asyncio.Event):
+    """
+    The late results handler
+    It waits requests not finished by deadline of iteration and then the iteration itself, adds received klines
+    to the iteration, calculates indicators, makes decision for them and saves them to database
+    """
+    try:
+        done, pending = await asyncio.wait(pending, timeout=get_clock().to_real(FETCH_LATE_TIMEOUT))
+        for task in pending:
+            task.cancel()
+    finally:
+        await aiohttp_session.close()
+
+    # Late klines are added only after the iteration has been calculated and saved, so they aren't taken by it
+    await finished.wait()
+    for task in done:
+        if not task.cancelled() and task.exception() is None:
+            handle_result(iteration_stack.request_result_handler, *task.result())
+
+    symbol_keys = iteration.unsaved_symbols
+    logger.info('Late results have been received: %s klines of %s requests', len(symbol_keys), len(done),
+                extra={'time_kline': iteration.time_kline, 'klines_count': len(symbol_keys)})
+    if not symbol_keys:
+        return
+
+    iteration_stack.calculate_indicators(iteration, symbol_keys)
+    iteration_stack.make_decision(iteration, symbol_keys, place_orders=False)
     await iteration.save_to_db(async_db_session)
 
-    if DEBUG:
-        print(f"  {datetime.utcnow()} Data have been saved to database. Iteration has been finished.")
-        print(' ')
+
+async def tickers_event_handler():
+    """
+    The tickers snapshot handler
+    It gets snapshot of all symbols of each category from Bybit exchange by one request per category
+    and accumulates it in ticker sampler
+    """
+
+    # Use method Get Tickers (https://bybit-exchange.github.io/docs/v5/market/tickers)
+    conn = aiohttp.TCPConnector(limit_per_host=LIMIT_PER_HOST, limit=LIMIT, ttl_dns_cache=TTL_DNS_CACHE)
+    aiohttp_session = aiohttp.ClientSession(connector=conn)
+    await asyncio.gather(*(
+        request_async(aiohttp_session, *bybit.get_tickers(category=category), ticker_sampler.request_result_handler,
+                      timeout=FETCH_TIMEOUT)
+        for category in CATEGORIES
+    ))
+    await conn.close()
+
+
+async def trades_event_handler(deadline: float = None):
+    """
+    The recent trades handler
+    It gets recent public trades of each symbol from Bybit exchange and accumulates them in trade aggregator
+    Requests not finished by deadline (by default before the next poll) are dropped, their trades come with
+    the next poll
+    """
+
+    if deadline is None:
+        deadline = 60.00 / TRADES_POLLS_PER_MINUTE - 2.00
+
+    # Use method Get Public Recent Trading History (https://bybit-exchange.github.io/docs/v5/market/recent-trade)
+    requests = [
+        bybit.get_public_trade_history(category=category, symbol=symbol, limit=get_trades_limit(category))
+        for category, symbol in map(split_symbol_key, symbol_registry.symbols)
+    ]
+
+    conn = aiohttp.TCPConnector(limit_per_host=LIMIT_PER_HOST, limit=LIMIT, ttl_dns_cache=TTL_DNS_CACHE)
+    aiohttp_session = aiohttp.ClientSession(connector=conn)
+    try:
+        pending = await fetch_with_deadline(aiohttp_session, requests, trade_aggregator.request_result_handler,
+                                            deadline=get_clock().to_real(deadline))
+        for task in pending:
+            task.cancel()
+    finally:
+        await aiohttp_session.close()
 
 
 async def launch_scheduler_tasks():
 
-    if DEBUG:
-        print(f"{datetime.utcnow()} Start program")
+    logger.info('Start program')
+
+    # Refresh tracked symbols from exchange and load them in memory (in symbol registry)
+    await symbol_registry.refresh(async_db_session)
+    logger.info('Symbols have been refreshed, %s symbols are tracked', len(symbol_registry))
+
+    # Start loop lag monitor, it shows how much the loop is saturated
+    LoopLagMonitor().start()
+
+    # Start profiler, stack sampling is switched on and off by SIGUSR1 where signals are supported (not on Windows)
+    profiler.start()
+    if hasattr(signal, 'SIGUSR1'):
+        try:
+            asyncio.get_running_loop().add_signal_handler(signal.SIGUSR1, profiler.toggle)
+        except (NotImplementedError, RuntimeError):
+            logger.warning('Stack sampling can\'t be switched by SIGUSR1 in this event loop, '
+                           'set API_PROFILER_CONTROL and use read API')
+
+    # Start alert dispatcher worker, it sends alerts to sinks asynchronously
+    iteration_stack.alert_dispatcher.start()
+
+    # Open keep-alive session of order dispatcher if orders are placed by decisions (ORDER_SIDES is set)
+    iteration_stack.order_dispatcher.start()
 
     # Load existing kline history in memory (in iteration stack) form database
     await iteration_stack.get_kline_history(async_db_session)
-    if DEBUG:
-        print(f"{datetime.utcnow()} Existing kline history have been uploaded in iteration stack")
+    logger.info('Existing kline history have been uploaded in iteration stack')
+
+    # Load minute volumes of the last 24 hours in tickers mode, they leave rolling 24-hours volumes of tickers
+    if INGESTION_MODE == 'tickers':
+        await ticker_sampler.get_volume_history(async_db_session, get_clock().now())
+
+    # Start read API over the live window (if API_PORT is set), it serves data from iteration stack memory
+    await start_api(iteration_stack)
 
     # Create asynchronous scheduler
     main_scheduler = AsyncScheduler()
@@ -110,6 +297,36 @@ async def launch_scheduler_tasks():
         delay=1.00
     )
 
+    # Put in scheduler tickers snapshot handlers in tickers mode (run several times every minute,
+    # the last snapshot is taken just before the minute finishes)
+    if INGESTION_MODE == 'tickers':
+        for idx in range(TICKERS_SAMPLES_PER_MINUTE):
+            await main_scheduler.create_and_run_async_job(
+                f'tickers_event_handler_{idx}',
+                '*/1 * * * *',
+                tickers_event_handler,
+                delay=60.00 * (idx + 1) / TICKERS_SAMPLES_PER_MINUTE - 1.50
+            )
+
+    # Put in scheduler recent trades handlers (run several times every minute evenly after the main handler,
+    # the last poll of each minute is made by the main handler itself after the minute has finished)
+    for idx in range(1, TRADES_POLLS_PER_MINUTE):
+        await main_scheduler.create_and_run_async_job(
+            f'trades_event_handler_{idx}',
+            '*/1 * * * *',
+            trades_event_handler,
+            delay=60.00 * idx / TRADES_POLLS_PER_MINUTE + 1.00
+        )
+
+    # Put in scheduler symbols refresh (run every hour with delay 30 second)
+    # It updates symbols parameters and adds new listings to symbol registry
+    await main_scheduler.create_and_run_async_job(
+        'symbol_registry_refresh',
+        SYMBOLS_REFRESH_SCHEDULE,
+        lambda: symbol_registry.refresh(async_db_session),
+        delay=30.00
+    )
+
     # Put in scheduler garbage collector (run every minute with delay 45 second)
     # It frees memory from old kline history
     await main_scheduler.create_and_run_job(
@@ -122,14 +339,32 @@ async def launch_scheduler_tasks():
 
 if __name__ == '__main__':
 
+    # Start logging through queue, output is made by listener thread
+    setup_logging()
+
     async_db_session = get_async_session()
     bybit = Bybit()
 
+    # Create a symbol registry - in-memory list of tracked symbols refreshed by scheduler
+    symbol_registry = SymbolRegistry()
+
+    # Create a kline history reader - query layer over database with LRU cache of history blocks
+    KlineHistoryReader(async_db_session)
+
     # Create an iteration stack - an array (dictionary) for temporary storage and all calculation of kline history
     iteration_stack = IterationStack()
 
-    # Make event loop and launch the first procedure make scheduler tasks
-    loop = asyncio.new_event_loop()
+    # Create a profiler - it measures phases of iterations and keeps the slowest ones
+    profiler = Profiler()
+
+    # Create a trade aggregator - accumulator of recent public trades to calculate trade indicators of klines
+    trade_aggregator = TradeAggregator()
+
+    # Create a ticker sampler - accumulator of tickers snapshots to build klines in tickers mode
+    ticker_sampler = TickerSampler()
+
+    # Make event loop (uvloop if EVENT_LOOP=uvloop) and launch the first procedure make scheduler tasks
+    loop = new_event_loop()
     loop.create_task(launch_scheduler_tasks())
 
     # Run never ended loop
@@ -139,3 +374,4 @@ if __name__ == '__main__':
         pass
     finally:
         loop.close()
+        shutdown_logging()
@@ -1,25 +1,124 @@
+import time
+from collections import deque
 from datetime import datetime
 from decimal import Decimal
-from typing import List
+from typing import List, Optional
 
-from sqlalchemy import String, Numeric, Boolean, DateTime, ForeignKey, PrimaryKeyConstraint, Integer
-from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+from sqlalchemy import String, Numeric, Boolean, DateTime, ForeignKey, PrimaryKeyConstraint, Integer, Table, event
+from sqlalchemy.dialects.postgresql import insert, ARRAY
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncEngine
 from sqlalchemy.orm import DeclarativeBase, Mapped, mapped_column, relationship
+from sqlalchemy.pool import AsyncAdaptedQueuePool
 
-from app.config import DATABASE_HOST, DATABASE_NAME, DATABASE_PORT, DATABASE_USER, DATABASE_PASSWORD
+from app.config import DATABASE_HOST, DATABASE_NAME, DATABASE_PORT, DATABASE_USER, DATABASE_PASSWORD, \
+    DATABASE_POOL_SIZE, DATABASE_MAX_OVERFLOW, DATABASE_POOL_TIMEOUT, DATABASE_POOL_RECYCLE, DATABASE_POOL_PRE_PING, \
+    DATABASE_STATEMENT_CACHE_SIZE, DATABASE_STATS_WINDOW
+from app.utils import get_percentile
 
 
 class Base(DeclarativeBase):
     pass
 
 
-def get_engine():
-    return create_async_engine('postgresql+asyncpg://' +
-                               DATABASE_USER + ':' +
-                               DATABASE_PASSWORD + '@' +
-                               DATABASE_HOST + ':' +
-                               DATABASE_PORT + '/' +
-                               DATABASE_NAME)
+class DatabaseStats:
+    """
+    Timings of recent connection checkouts from pool (waiting included) and queries
+    """
+    __object = None
+
+    def __new__(cls, *args, **kwargs):
+        if cls.__object is None:
+            cls.__object = super().__new__(cls)
+        return cls.__object
+
+    def __init__(self, size: int = DATABASE_STATS_WINDOW):
+        if hasattr(self, '_pool_waits'):
+            return
+        self._pool_waits: deque = deque(maxlen=size)
+        self._query_latencies: deque = deque(maxlen=size)
+        self.checkouts_count: int = 0
+        self.queries_count: int = 0
+
+    def add_pool_wait(self, wait: float) -> None:
+        self._pool_waits.append(wait)
+        self.checkouts_count += 1
+
+    def add_query_latency(self, latency: float) -> None:
+        self._query_latencies.append(latency)
+        self.queries_count += 1
+
+    @staticmethod
+    def _get_timings_stats(timings: deque) -> dict:
+        if not timings:
+            return {'samples_count': 0}
+        timings = sorted(timings)
+
+        return {
+            'samples_count': len(timings),
+            'mean': sum(timings) / len(timings),
+            'p50': get_percentile(timings, 50),
+            'p99': get_percentile(timings, 99),
+            'max': timings[-1],
+        }
+
+    def get_stats(self) -> dict:
+        """
+        Statistics of recent timings (seconds) and counters since start
+        """
+        return {
+            'checkouts_count': self.checkouts_count,
+            'queries_count': self.queries_count,
+            'pool_wait': self._get_timings_stats(self._pool_waits),
+            'query_latency': self._get_timings_stats(self._query_latencies),
+        }
+
+
+class TimedQueuePool(AsyncAdaptedQueuePool):
+    """
+    Connection pool which measures how long checkout takes, including waiting for free connection
+    """
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            DatabaseStats().add_pool_wait(time.perf_counter() - start)
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    context.query_start = time.perf_counter()
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    DatabaseStats().add_query_latency(time.perf_counter() - context.query_start)
+
+
+_engine: Optional[AsyncEngine] = None
+
+
+def get_engine() -> AsyncEngine:
+    """
+    Engine of the process, it is made at first call, so all sessions share one connection pool
+    Prepared statements are cached per connection, so statements of each iteration are prepared once
+    """
+    global _engine
+    if _engine is None:
+        _engine = create_async_engine('postgresql+asyncpg://' +
+                                      DATABASE_USER + ':' +
+                                      DATABASE_PASSWORD + '@' +
+                                      DATABASE_HOST + ':' +
+                                      DATABASE_PORT + '/' +
+                                      DATABASE_NAME +
+                                      f'?prepared_statement_cache_size={DATABASE_STATEMENT_CACHE_SIZE}',
+                                      poolclass=TimedQueuePool,
+                                      pool_size=DATABASE_POOL_SIZE,
+                                      max_overflow=DATABASE_MAX_OVERFLOW,
+                                      pool_timeout=DATABASE_POOL_TIMEOUT,
+                                      pool_recycle=DATABASE_POOL_RECYCLE,
+                                      pool_pre_ping=DATABASE_POOL_PRE_PING)
+        event.listen(_engine.sync_engine, 'before_cursor_execute', _before_cursor_execute)
+        event.listen(_engine.sync_engine, 'after_cursor_execute', _after_cursor_execute)
+    return _engine
 
 
 def get_async_session():
@@ -28,11 +127,38 @@ def get_async_session():
     return session
 
 
+def get_upsert(table: Table, constraint: str):
+    """
+    Statement which inserts rows of table or updates all their columns if rows exist
+    Rows are passed at execution, so the statement text is the same for any number of rows
+    """
+    statement = insert(table)
+    return statement.on_conflict_do_update(
+        constraint=constraint,
+        set_={column.name: statement.excluded[column.name] for column in table.columns if not column.primary_key},
+    )
+
+
+def get_row(instance: Base) -> dict:
+    """
+    Values of all columns of model instance, column defaults are used for values which haven't been set
+    """
+    row = dict()
+    for column in instance.__table__.columns:
+        value = getattr(instance, column.key)
+        if value is None and column.default is not None and column.default.is_scalar:
+            value = column.default.arg
+        row[column.key] = value
+    return row
+
+
 class Symbol(Base):
 
     __tablename__ = 'symbol'
 
-    symbol: Mapped[str] = mapped_column(String(15), primary_key=True, index=True)
+    symbol: Mapped[str] = mapped_column(String(30), primary_key=True, index=True)
+    category: Mapped[str] = mapped_column(String(10), default='linear', nullable=False)
+    name: Mapped[str] = mapped_column(String(25), nullable=False)
     min_leverage: Mapped[Decimal] = mapped_column(Numeric(19, 9), default=1.0, nullable=False)
     max_leverage: Mapped[Decimal] = mapped_column(Numeric(19, 9), default=25.0, nullable=False)
     leverage_step: Mapped[Decimal] = mapped_column(Numeric(19, 9), default=0.01, nullable=False)
@@ -44,6 +170,8 @@ class Symbol(Base):
     qty_step: Mapped[Decimal] = mapped_column(Numeric(19, 9), default=0.1, nullable=False)
     is_active: Mapped[bool] = mapped_column(Boolean(), default=True)
     kline_history: Mapped[List['KlineHistory']] = relationship(back_populates='symbol', cascade='all, delete-orphan')
+    kline_rollup: Mapped[List['KlineRollup']] = relationship(back_populates='symbol', cascade='all, delete-orphan')
+    kline_window: Mapped[List['KlineWindow']] = relationship(back_populates='symbol', cascade='all, delete-orphan')
 
     def __str__(self):
         return f'{self.symbol} ({self.is_active})'
@@ -75,8 +203,21 @@ class KlineHistory(Base):
 
     btc_impact_rate: Mapped[Decimal] = mapped_column(Numeric(19, 9), nullable=True)
 
+    volume_z_score: Mapped[Decimal] = mapped_column(Numeric(19, 9), nullable=True)
+    turnover_z_score: Mapped[Decimal] = mapped_column(Numeric(19, 9), nullable=True)
+
+    vwap: Mapped[Decimal] = mapped_column(Numeric(19, 9), nullable=True)
+    buy_volume: Mapped[Decimal] = mapped_column(Numeric(19, 9), nullable=True)
+    sell_volume: Mapped[Decimal] = mapped_column(Numeric(19, 9), nullable=True)
+    trade_imbalance: Mapped[Decimal] = mapped_column(Numeric(19, 9), nullable=True)
+    trades_count: Mapped[int] = mapped_column(Integer, nullable=True)
+
     is_growth_over_1_percent: Mapped[bool] = mapped_column(Boolean(), default=False)
     is_decline_over_1_percent: Mapped[bool] = mapped_column(Boolean(), default=False)
+    is_volume_spike: Mapped[bool] = mapped_column(Boolean(), default=False)
+
+    # Flags of satisfied decision rules which haven't their own boolean column
+    flags: Mapped[list] = mapped_column(ARRAY(String(30)), nullable=True)
 
     __table_args__ = (
         PrimaryKeyConstraint('symbol_key', 'time_kline', name='key_time'),
@@ -88,3 +229,71 @@ class KlineHistory(Base):
                f'L={self.low_price}, C={self.close_price}, ' \
                f'V={self.volume}, T={self.turnover}, ' \
                f'B={self.btc_impact_rate})'
+
+
+class KlineWindow(Base):
+
+    __tablename__ = 'kline_window'
+
+    time_kline: Mapped[datetime] = mapped_column(DateTime(timezone=True), nullable=False, index=True)
+    symbol_key: Mapped[str] = mapped_column(ForeignKey('symbol.symbol'), nullable=False, index=True)
+    symbol: Mapped['Symbol'] = relationship(back_populates='kline_window')
+    tracking_period: Mapped[int] = mapped_column(Integer, nullable=False)
+
+    max_price: Mapped[Decimal] = mapped_column(Numeric(19, 9), nullable=True)
+    delta_to_max: Mapped[Decimal] = mapped_column(Numeric(19, 9), nullable=True)
+    delta_to_max_in_percent: Mapped[Decimal] = mapped_column(Numeric(19, 9), nullable=True)
+    time_since_max: Mapped[int] = mapped_column(Integer, nullable=True)
+
+    min_price: Mapped[Decimal] = mapped_column(Numeric(19, 9), nullable=True)
+    delta_to_min: Mapped[Decimal] = mapped_column(Numeric(19, 9), nullable=True)
+    delta_to_min_in_percent: Mapped[Decimal] = mapped_column(Numeric(19, 9), nullable=True)
+    time_since_min: Mapped[int] = mapped_column(Integer, nullable=True)
+
+    btc_impact_rate: Mapped[Decimal] = mapped_column(Numeric(19, 9), nullable=True)
+
+    is_growth_over_1_percent: Mapped[bool] = mapped_column(Boolean(), default=False)
+    is_decline_over_1_percent: Mapped[bool] = mapped_column(Boolean(), default=False)
+
+    # Flags of satisfied decision rules which haven't their own boolean column
+    flags: Mapped[list] = mapped_column(ARRAY(String(30)), nullable=True)
+
+    __table_args__ = (
+        PrimaryKeyConstraint('symbol_key', 'time_kline', 'tracking_period', name='key_time_period'),
+    )
+
+    def __str__(self):
+        return f'{self.time_kline} - {self.symbol_key} [{self.tracking_period}m window]: (' \
+               f'MAX={self.max_price}, MIN={self.min_price}, ' \
+               f'B={self.btc_impact_rate})'
+
+
+class KlineRollup(Base):
+
+    __tablename__ = 'kline_rollup'
+
+    interval: Mapped[int] = mapped_column(Integer, nullable=False)
+    time_kline: Mapped[datetime] = mapped_column(DateTime(timezone=True), nullable=False)
+    symbol_key: Mapped[str] = mapped_column(ForeignKey('symbol.symbol'), nullable=False, index=True)
+    symbol: Mapped['Symbol'] = relationship(back_populates='kline_rollup')
+    open_price: Mapped[Decimal] = mapped_column(Numeric(19, 9), default=0.0, nullable=False)
+    high_price: Mapped[Decimal] = mapped_column(Numeric(19, 9), default=0.0, nullable=False)
+    low_price: Mapped[Decimal] = mapped_column(Numeric(19, 9), default=0.0, nullable=False)
+    close_price: Mapped[Decimal] = mapped_column(Numeric(19, 9), default=0.0, nullable=False)
+    volume: Mapped[Decimal] = mapped_column(Numeric(19, 9), default=0.0, nullable=False)
+    turnover: Mapped[Decimal] = mapped_column(Numeric(19, 9), default=0.0, nullable=False)
+
+    open_time: Mapped[datetime] = mapped_column(DateTime(timezone=True), nullable=False)
+    close_time: Mapped[datetime] = mapped_column(DateTime(timezone=True), nullable=False)
+    klines_count: Mapped[int] = mapped_column(Integer, default=0, nullable=False)
+
+    __table_args__ = (
+        PrimaryKeyConstraint('interval', 'time_kline', 'symbol_key', name='key_interval_time'),
+    )
+
+    def __str__(self):
+        return f'{self.time_kline} - {self.symbol_key} [{self.interval}m]: (' \
+               f'O={self.open_price}, H={self.high_price}, ' \
+               f'L={self.low_price}, C={self.close_price}, ' \
+               f'V={self.volume}, T={self.turnover}, ' \
+               f'N={self.klines_count})'
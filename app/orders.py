@@ -0,0 +1,208 @@
+"""
+Order placement by decisions
+Decisions whose rule tags are in ORDER_SIDES become market orders, they are signed and sent at once as separate tasks
+over one persistent keep-alive session, so no connection and TLS handshake is made on the order path.
+The connection is kept warm by light requests between orders. Latency from decision to exchange acknowledgement
+is measured for each order
+"""
+
+import asyncio
+import time
+from collections import deque
+from datetime import datetime, timedelta
+from decimal import Decimal
+from functools import partial
+from typing import Optional
+
+import aiohttp
+
+from app.aiohttp_handlers import request_async
+from app.bybit import Bybit
+from app.config import ORDER_SIDES, ORDER_QTY_MULTIPLIER, ORDER_COOLDOWN, ORDER_TIMEOUT, ORDER_KEEPALIVE_INTERVAL, \
+    ORDER_LATENCY_WINDOW
+from app.logger import get_logger
+from app.symbols import SymbolRegistry
+from app.utils import ftod, get_percentile, split_symbol_key
+
+logger = get_logger('orders')
+
+
+class Order:
+    """
+    Order placed by decision about symbol
+    """
+    def __init__(self, time_kline: datetime, symbol_key: str, tag: str, side: str, qty: Decimal, decided: float):
+        self.time_kline: datetime = time_kline
+        self.symbol_key: str = symbol_key
+        self.tag: str = tag
+        self.side: str = side
+        self.qty: Decimal = qty
+        self.decided: float = decided
+        self.status: str = 'new'
+        self.order_id: Optional[str] = None
+        self.latency: Optional[float] = None
+
+    @property
+    def link_id(self) -> str:
+        """
+        User order id, the same decision gives the same id, so exchange rejects its duplicate
+        """
+        return f'{self.tag[:8]}-{self.time_kline.strftime("%y%m%d%H%M")}-{self.symbol_key.replace(":", "")}'[:36]
+
+    def to_dict(self) -> dict:
+        return {
+            'time_kline': self.time_kline.isoformat(),
+            'symbol_key': self.symbol_key,
+            'tag': self.tag,
+            'side': self.side,
+            'qty': str(self.qty),
+            'order_link_id': self.link_id,
+            'order_id': self.order_id,
+            'status': self.status,
+            'latency': self.latency,
+        }
+
+
+class OrderDispatcher:
+    """
+    Dispatcher of orders
+    submit is synchronous and cheap, it is called from decision making and starts sending task at once
+    """
+    def __init__(self, sides: dict = None):
+        self._sides: dict = ORDER_SIDES if sides is None else sides
+        self._session: Optional[aiohttp.ClientSession] = None
+        self._warmer: Optional[asyncio.Task] = None
+        self._tasks: set = set()
+        self._last_placed: dict = dict()
+        self._latencies: deque = deque(maxlen=ORDER_LATENCY_WINDOW)
+
+        # Recent orders for read API
+        self.recent: deque = deque(maxlen=ORDER_LATENCY_WINDOW)
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self._sides)
+
+    def start(self) -> None:
+        """
+        Open keep-alive session and start task which keeps its connection warm in running event loop
+        """
+        if not self.enabled or self._session is not None:
+            return
+        connector = aiohttp.TCPConnector(limit=0, keepalive_timeout=ORDER_KEEPALIVE_INTERVAL * 2)
+        self._session = aiohttp.ClientSession(connector=connector)
+        self._warmer = asyncio.get_running_loop().create_task(self._keep_warm())
+
+    async def stop(self) -> None:
+        if self._warmer is not None:
+            self._warmer.cancel()
+        if self._session is not None:
+            await self._session.close()
+        self._session = self._warmer = None
+
+    async def _keep_warm(self) -> None:
+        bybit = Bybit()
+        while True:
+            await request_async(self._session, *bybit.get_server_time(), lambda status, result: None,
+                                timeout=ORDER_TIMEOUT)
+            await asyncio.sleep(ORDER_KEEPALIVE_INTERVAL)
+
+    def submit(self, time_kline: datetime, symbol_key: str, tags: list, decided: float) -> Optional[Order]:
+        """
+        Place order for decision about symbol if any of its tags has order side
+        One order per symbol is placed within cooldown, the first tag with side wins
+        """
+        if self._session is None:
+            return None
+        tag = next((tag for tag in tags if tag in self._sides), None)
+        if tag is None:
+            return None
+
+        last_placed = self._last_placed.get(symbol_key)
+        if last_placed is not None and \
+                (time_kline == last_placed or time_kline - last_placed < timedelta(minutes=ORDER_COOLDOWN)):
+            return None
+        symbol = SymbolRegistry()[symbol_key]
+        if symbol is None:
+            return None
+
+        # Exchange accepts only quantities in steps of the symbol, so quantity is rounded down to the step
+        qty = ftod(symbol.min_order_qty * ORDER_QTY_MULTIPLIER, 9)
+        if symbol.qty_step:
+            qty = ftod(qty // symbol.qty_step * symbol.qty_step, 9)
+        if qty <= 0 or qty < symbol.min_order_qty:
+            logger.warning('Order for %s is skipped: quantity %s is less than minimal one %s', symbol_key, qty,
+                           symbol.min_order_qty)
+            return None
+        self._last_placed[symbol_key] = time_kline
+
+        order = Order(time_kline, symbol_key, tag, self._sides[tag], qty, decided)
+        task = asyncio.get_running_loop().create_task(self._place(order))
+        self._tasks.add(task)
+        task.add_done_callback(partial(self._place_done, order))
+        return order
+
+    def _place_done(self, order: Order, task: asyncio.Task) -> None:
+        """
+        Drop finished placing task and log its error, so it isn't lost as never retrieved task exception
+        """
+        self._tasks.discard(task)
+        if task.cancelled():
+            return
+        exception = task.exception()
+        if exception is not None:
+            order.status = 'failed'
+            logger.error('Order %s placing error', order.link_id, exc_info=exception, extra={'order': order.to_dict()})
+            self.recent.append(order)
+
+    async def _place(self, order: Order) -> None:
+        category, symbol = split_symbol_key(order.symbol_key)
+        request = Bybit().create_order(category=category, symbol=symbol, side=order.side, orderType='Market',
+                                       qty=format(order.qty.normalize(), 'f'), orderLinkId=order.link_id)
+        await request_async(self._session, *request, partial(self.order_result_handler, order), timeout=ORDER_TIMEOUT)
+
+    def order_result_handler(self, order: Order, status: int, result: dict) -> None:
+        """
+        Handler of order placing result from exchange
+        Latency is measured here, as soon as acknowledgement has been received
+        """
+        order.latency = time.perf_counter() - order.decided
+
+        if 200 <= status <= 299 and result is not None and result.get('retCode') == 0:
+            order.status = 'acknowledged'
+            order.order_id = result['result'].get('orderId')
+            self._latencies.append(order.latency)
+            logger.info('Order %s has been acknowledged in %.3f s', order.link_id, order.latency,
+                        extra={'order': order.to_dict()})
+        else:
+            order.status = 'rejected'
+            logger.error('Order %s has been rejected: status = %s, result = %s', order.link_id, status, result,
+                         extra={'order': order.to_dict()})
+        self.recent.append(order)
+
+    async def cancel(self, symbol_key: str, order_id: str = None, link_id: str = None, result_handler=None) -> None:
+        """
+        Cancel active order by order id or user order id, result of exchange is passed to result handler
+        """
+        if self._session is None:
+            return
+        category, symbol = split_symbol_key(symbol_key)
+        parameters = {'orderId': order_id} if order_id else {'orderLinkId': link_id}
+        await request_async(self._session, *Bybit().cancel_order(category=category, symbol=symbol, **parameters),
+                            result_handler, timeout=ORDER_TIMEOUT)
+
+    def get_stats(self) -> dict:
+        """
+        Statistics of latencies from decision to acknowledgement of recent orders (seconds)
+        """
+        if not self._latencies:
+            return {'samples_count': 0}
+        latencies = sorted(self._latencies)
+
+        return {
+            'samples_count': len(latencies),
+            'mean': sum(latencies) / len(latencies),
+            'p50': get_percentile(latencies, 50),
+            'p99': get_percentile(latencies, 99),
+            'max': latencies[-1],
+        }
@@ -0,0 +1,210 @@
+"""
+Profiler of iterations
+Phase timings (fetch, calculate_indicators, make_decision, save_to_db) are measured for each iteration always,
+the slowest iterations are kept and dumped to disk by separate thread. Stack sampling is switched on at runtime
+(by SIGUSR1 or API), sampler thread collects stacks of the event loop thread in flamegraph-compatible folded format
+"""
+
+import asyncio
+import heapq
+import json
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Optional
+
+from app.config import PROFILER_ENABLED, PROFILER_DIR, PROFILER_SLOWEST_COUNT, PROFILER_SAMPLE_INTERVAL
+from app.logger import get_logger
+
+logger = get_logger('profiler')
+
+
+class IterationProfile:
+    """
+    Timings of phases and sampled stacks of one iteration
+    """
+    def __init__(self, time_kline: datetime):
+        self.time_kline: datetime = time_kline
+        self.phases: dict = dict()
+        self.stacks: Counter = Counter()
+        self.current_phase: Optional[str] = None
+        self.total: float = 0.0
+        self._start: float = time.perf_counter()
+
+    @contextmanager
+    def phase(self, name: str):
+        """
+        Measure time of phase, sampled stacks are tagged with phase name
+        """
+        self.current_phase = name
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.phases[name] = self.phases.get(name, 0.0) + time.perf_counter() - start
+            self.current_phase = None
+
+    def finish(self) -> None:
+        self.total = time.perf_counter() - self._start
+
+    def to_dict(self) -> dict:
+        return {
+            'time_kline': self.time_kline.isoformat(),
+            'total': self.total,
+            'phases': self.phases,
+            'samples_count': sum(self.stacks.values()),
+        }
+
+    def get_folded_stacks(self) -> str:
+        """
+        Stacks in folded format (one 'frame;frame;frame count' per line) for flamegraph tools
+        """
+        return ''.join(f'{stack} {count}\n' for stack, count in sorted(self.stacks.items()))
+
+
+class StackSampler(threading.Thread):
+    """
+    Thread which samples stack of the event loop thread and adds it to current iteration profile
+    """
+    def __init__(self, profiler: 'Profiler', thread_id: int, interval: float):
+        super().__init__(name='stack-sampler', daemon=True)
+        self._profiler: Profiler = profiler
+        self._thread_id: int = thread_id
+        self._interval: float = interval
+        self._stop_event = threading.Event()
+
+    @staticmethod
+    def _fold(frame) -> str:
+        stack = []
+        while frame is not None:
+            code = frame.f_code
+            stack.append(f'{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})')
+            frame = frame.f_back
+        return ';'.join(reversed(stack))
+
+    def run(self) -> None:
+        while not self._stop_event.wait(self._interval):
+            profile = self._profiler.current
+            frame = sys._current_frames().get(self._thread_id)
+            if profile is None or frame is None:
+                continue
+            stack = self._fold(frame)
+            profile.stacks[f'{profile.current_phase or "other"};{stack}'] += 1
+
+    def stop(self) -> None:
+        self._stop_event.set()
+
+
+class Profiler:
+    """
+    Profiler of iterations, it keeps the slowest iterations and writes their dumps in PROFILER_DIR
+    """
+    __object = None
+
+    def __new__(cls, *args, **kwargs):
+        if cls.__object is None:
+            cls.__object = super().__new__(cls)
+        return cls.__object
+
+    def __init__(self):
+        if hasattr(self, '_slowest'):
+            return
+        self.current: Optional[IterationProfile] = None
+        self._slowest: list = list()
+        self._sequence: int = 0
+        self._sampler: Optional[StackSampler] = None
+        self._thread_id: Optional[int] = None
+
+        # One dump thread keeps dumps in order of iterations
+        self._executor: ThreadPoolExecutor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='profile-dump')
+
+    @property
+    def enabled(self) -> bool:
+        return self._sampler is not None
+
+    @property
+    def slowest(self) -> list:
+        return [profile for total, sequence, profile in sorted(self._slowest, reverse=True)]
+
+    def start(self) -> None:
+        """
+        Remember the event loop thread, switch stack sampling on if PROFILER_ENABLED
+        """
+        self._thread_id = threading.get_ident()
+        if PROFILER_ENABLED:
+            self.set_enabled(True)
+
+    def set_enabled(self, enabled: bool) -> None:
+        if enabled and self._sampler is None:
+            self._sampler = StackSampler(self, self._thread_id or threading.main_thread().ident,
+                                         PROFILER_SAMPLE_INTERVAL)
+            self._sampler.start()
+        elif not enabled and self._sampler is not None:
+            self._sampler.stop()
+            self._sampler = None
+        logger.info('Stack sampling is %s', 'on' if self.enabled else 'off')
+
+    def toggle(self) -> None:
+        self.set_enabled(not self.enabled)
+
+    def start_iteration(self, time_kline: datetime) -> IterationProfile:
+        self.current = IterationProfile(time_kline)
+        return self.current
+
+    def finish_iteration(self, profile: IterationProfile) -> None:
+        """
+        Log phase timings, keep profile if it is one of the slowest and dump it
+        """
+        profile.finish()
+        if self.current is profile:
+            self.current = None
+
+        logger.debug('Iteration profile', extra={'profile': profile.to_dict()})
+
+        self._sequence += 1
+        item = (profile.total, self._sequence, profile)
+        if len(self._slowest) < PROFILER_SLOWEST_COUNT:
+            heapq.heappush(self._slowest, item)
+        elif profile.total > self._slowest[0][0]:
+            heapq.heapreplace(self._slowest, item)
+        else:
+            return
+
+        # Files are written by dump thread, so event loop isn't blocked by disk
+        slowest = [p.to_dict() for p in self.slowest]
+        stacks = profile.get_folded_stacks() if profile.stacks else None
+        kept_files = {self._get_stacks_file(p.time_kline) for p in self.slowest}
+        future = asyncio.get_running_loop().run_in_executor(self._executor, self._dump, profile.time_kline,
+                                                            slowest, stacks, kept_files)
+        future.add_done_callback(self._dump_done)
+
+    @staticmethod
+    def _get_stacks_file(time_kline: datetime) -> str:
+        return f'{time_kline.strftime("%Y%m%d-%H%M")}.folded'
+
+    @classmethod
+    def _dump(cls, time_kline: datetime, slowest: list, stacks: Optional[str], kept_files: set) -> None:
+        """
+        Write the list of the slowest iterations and folded stacks of profile (if stacks were sampled)
+        Stacks of iterations which aren't among the slowest anymore are deleted, so there are at most
+        PROFILER_SLOWEST_COUNT stacks files
+        """
+        os.makedirs(PROFILER_DIR, exist_ok=True)
+        with open(os.path.join(PROFILER_DIR, 'slowest.json'), 'w') as file:
+            json.dump(slowest, file, indent=2)
+        if stacks:
+            with open(os.path.join(PROFILER_DIR, cls._get_stacks_file(time_kline)), 'w') as file:
+                file.write(stacks)
+        for file_name in os.listdir(PROFILER_DIR):
+            if file_name.endswith('.folded') and file_name not in kept_files:
+                os.remove(os.path.join(PROFILER_DIR, file_name))
+
+    @staticmethod
+    def _dump_done(future: asyncio.Future) -> None:
+        if not future.cancelled() and future.exception() is not None:
+            logger.error('Profile dump error', exc_info=future.exception())
@@ -0,0 +1,199 @@
+"""
+Rollup candles for longer intervals (5m, 15m, 1h, 1d, ...)
+They are maintained incrementally from 1-minute klines when each iteration is saved,
+and can be rebuilt from raw kline history by scripts/backfill_rollups.py
+"""
+
+from datetime import datetime, timedelta, timezone
+from typing import Iterable, Optional
+
+from sqlalchemy import DateTime, Integer, String, bindparam, case, delete, func, literal, select, update
+from sqlalchemy.dialects.postgresql import aggregate_order_by, insert
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.config import ROLLUP_INTERVALS
+from app.models import KlineHistory, KlineRollup
+
+
+def get_bucket_time(time_kline: datetime, interval: int) -> datetime:
+    """
+    Start time of the interval bucket (in minutes) which the kline belongs to
+    """
+    seconds = interval * 60
+    return datetime.fromtimestamp(int(time_kline.timestamp()) // seconds * seconds, tz=timezone.utc)
+
+
+def merge_rollup_rows(klines: Iterable[KlineHistory], intervals: list[int] = None) -> list[dict]:
+    """
+    Merge 1-minute klines into rollup rows, one row per (interval, bucket, symbol)
+    """
+    if intervals is None:
+        intervals = ROLLUP_INTERVALS
+
+    rows = dict()
+    for kline in klines:
+        for interval in intervals:
+            key = (interval, get_bucket_time(kline.time_kline, interval), kline.symbol_key)
+            row = rows.get(key)
+            if row is None:
+                rows[key] = {
+                    'interval': interval,
+                    'time_kline': key[1],
+                    'symbol_key': kline.symbol_key,
+                    'open_price': kline.open_price,
+                    'high_price': kline.high_price,
+                    'low_price': kline.low_price,
+                    'close_price': kline.close_price,
+                    'volume': kline.volume,
+                    'turnover': kline.turnover,
+                    'open_time': kline.time_kline,
+                    'close_time': kline.time_kline,
+                    'klines_count': 1,
+                }
+                continue
+
+            if kline.time_kline < row['open_time']:
+                row['open_price'] = kline.open_price
+                row['open_time'] = kline.time_kline
+            if kline.time_kline > row['close_time']:
+                row['close_price'] = kline.close_price
+                row['close_time'] = kline.time_kline
+            row['high_price'] = max(row['high_price'], kline.high_price)
+            row['low_price'] = min(row['low_price'], kline.low_price)
+            row['volume'] += kline.volume
+            row['turnover'] += kline.turnover
+            row['klines_count'] += 1
+
+    return list(rows.values())
+
+
+def get_rollup_refill():
+    """
+    Statement which recalculates bucket of rollup table from kline history when row of klines overlaps the time range
+    already merged into the bucket while some minutes of the range are missing, i.e. late kline fills the gap.
+    Buckets without missing minutes aren't changed, so klines saved twice aren't counted twice.
+    It is executed before rollup upsert and after klines have been saved within the same transaction
+    """
+    rollup = KlineRollup.__table__
+    in_bucket = (KlineHistory.symbol_key == bindparam('r_symbol_key', type_=String)) & \
+        (KlineHistory.time_kline >= bindparam('r_time_kline', type_=DateTime(timezone=True))) & \
+        (KlineHistory.time_kline < bindparam('r_bucket_end', type_=DateTime(timezone=True)))
+
+    def aggregate(column):
+        return select(column).where(in_bucket).scalar_subquery()
+
+    def first(column, order):
+        return select(column).where(in_bucket).order_by(order).limit(1).scalar_subquery()
+
+    return update(rollup).where(
+        (rollup.c.interval == bindparam('r_interval', type_=Integer)) &
+        (rollup.c.time_kline == bindparam('r_time_kline', type_=DateTime(timezone=True))) &
+        (rollup.c.symbol_key == bindparam('r_symbol_key', type_=String)) &
+        (rollup.c.open_time <= bindparam('r_close_time', type_=DateTime(timezone=True))) &
+        (rollup.c.close_time >= bindparam('r_open_time', type_=DateTime(timezone=True))) &
+        (rollup.c.klines_count < func.extract('epoch', rollup.c.close_time - rollup.c.open_time) / 60 + 1)
+    ).values(
+        open_price=first(KlineHistory.open_price, KlineHistory.time_kline.asc()),
+        high_price=aggregate(func.max(KlineHistory.high_price)),
+        low_price=aggregate(func.min(KlineHistory.low_price)),
+        close_price=first(KlineHistory.close_price, KlineHistory.time_kline.desc()),
+        volume=aggregate(func.sum(KlineHistory.volume)),
+        turnover=aggregate(func.sum(KlineHistory.turnover)),
+        open_time=aggregate(func.min(KlineHistory.time_kline)),
+        close_time=aggregate(func.max(KlineHistory.time_kline)),
+        klines_count=aggregate(func.count()),
+    )
+
+
+def get_rollup_upsert():
+    """
+    Statement which merges rows of klines into the current buckets of rollup table
+    Klines within the time range already merged into bucket are skipped, so saving them twice is harmless
+    (klines which fill missing minutes of the range have been merged by rollup refill)
+    Rows are passed at execution, so the statement is prepared once for any number of rows
+    """
+    statement = insert(KlineRollup.__table__)
+    excluded = statement.excluded
+    return statement.on_conflict_do_update(
+        constraint='key_interval_time',
+        set_={
+            'open_price': case((excluded.open_time < KlineRollup.open_time, excluded.open_price),
+                               else_=KlineRollup.open_price),
+            'close_price': case((excluded.close_time > KlineRollup.close_time, excluded.close_price),
+                                else_=KlineRollup.close_price),
+            'high_price': func.greatest(KlineRollup.high_price, excluded.high_price),
+            'low_price': func.least(KlineRollup.low_price, excluded.low_price),
+            'volume': KlineRollup.volume + excluded.volume,
+            'turnover': KlineRollup.turnover + excluded.turnover,
+            'open_time': func.least(KlineRollup.open_time, excluded.open_time),
+            'close_time': func.greatest(KlineRollup.close_time, excluded.close_time),
+            'klines_count': KlineRollup.klines_count + excluded.klines_count,
+        },
+        where=(excluded.open_time > KlineRollup.close_time) | (excluded.close_time < KlineRollup.open_time),
+    )
+
+
+ROLLUP_REFILL = get_rollup_refill()
+ROLLUP_UPSERT = get_rollup_upsert()
+
+
+async def save_rollups(session: AsyncSession, klines: Iterable[KlineHistory]) -> None:
+    """
+    Merge klines into rollup tables within the session transaction, klines must have been saved in it already
+    Buckets whose missing minutes are filled by klines are recalculated from kline history, new minutes are merged
+    """
+    rows = merge_rollup_rows(klines)
+    if not rows:
+        return
+
+    await session.execute(ROLLUP_REFILL, [{
+        'r_interval': row['interval'],
+        'r_time_kline': row['time_kline'],
+        'r_symbol_key': row['symbol_key'],
+        'r_open_time': row['open_time'],
+        'r_close_time': row['close_time'],
+        'r_bucket_end': row['time_kline'] + timedelta(minutes=row['interval']),
+    } for row in rows])
+    await session.execute(ROLLUP_UPSERT, rows)
+
+
+async def rebuild_rollups(session: AsyncSession, interval: int, since: Optional[datetime] = None) -> None:
+    """
+    Rebuild rollup candles of the interval from raw kline history
+    If since is set, only buckets starting from it are rebuilt
+    """
+    seconds = interval * 60
+    bucket = func.to_timestamp(
+        func.floor(func.extract('epoch', KlineHistory.time_kline) / seconds) * seconds
+    ).label('time_kline')
+
+    query = select(
+        literal(interval, Integer).label('interval'),
+        bucket,
+        KlineHistory.symbol_key,
+        func.array_agg(aggregate_order_by(KlineHistory.open_price, KlineHistory.time_kline.asc()))[1],
+        func.max(KlineHistory.high_price),
+        func.min(KlineHistory.low_price),
+        func.array_agg(aggregate_order_by(KlineHistory.close_price, KlineHistory.time_kline.desc()))[1],
+        func.sum(KlineHistory.volume),
+        func.sum(KlineHistory.turnover),
+        func.min(KlineHistory.time_kline),
+        func.max(KlineHistory.time_kline),
+        func.count(),
+    ).group_by(bucket, KlineHistory.symbol_key)
+
+    clear = delete(KlineRollup).where(KlineRollup.interval == interval)
+
+    if since is not None:
+        since = get_bucket_time(since, interval)
+        query = query.where(KlineHistory.time_kline >= since)
+        clear = clear.where(KlineRollup.time_kline >= since)
+
+    await session.execute(clear)
+    await session.execute(
+        insert(KlineRollup).from_select(
+            ['interval', 'time_kline', 'symbol_key', 'open_price', 'high_price', 'low_price', 'close_price',
+             'volume', 'turnover', 'open_time', 'close_time', 'klines_count'],
+            query
+        )
+    )
@@ -0,0 +1,242 @@
+"""
+Declarative decision rules
+Rule is an expression over indicator columns, e.g. "abs(delta_to_min_in_percent) >= 0.01 and btc_impact_rate <= 0.8".
+Expressions are parsed once at start, only comparisons, arithmetic, and/or/not, numbers, indicator columns and
+a few functions are allowed. They are compiled to numpy expressions, so each rule is evaluated for all symbols
+and tracking windows of the minute in one pass. Rules are taken from RULES_FILE (JSON list of
+{"tag": ..., "expression": ..., "flag": ...}) or default rules of price growth and decline are used.
+Flag of rule (is_<tag> by default) is set on klines and windows which satisfy it: in its boolean column if there is
+one, otherwise in the flags array column
+"""
+
+import ast
+import json
+from functools import reduce
+from typing import Optional
+
+import numpy as np
+from sqlalchemy import Boolean, Integer, Numeric
+
+from app.config import RULES_FILE, ALARM_THRESHOLD, BTC_IMPACT_THRESHOLD, TRACKING_PERIOD
+from app.models import KlineHistory, KlineWindow
+
+# Columns which can be used in expressions: numeric and boolean columns of klines and tracking period
+RULE_COLUMNS = tuple(
+    column.name for column in KlineHistory.__table__.columns if isinstance(column.type, (Numeric, Integer, Boolean))
+) + ('tracking_period',)
+BOOLEAN_COLUMNS = frozenset(
+    column.name for column in KlineHistory.__table__.columns if isinstance(column.type, Boolean)
+)
+WINDOW_COLUMNS = frozenset(column.name for column in KlineWindow.__table__.columns)
+
+# Flags stored in their own boolean columns of klines and tracking windows, the rest are stored in flags column
+FLAG_COLUMNS = {
+    model: frozenset(column.name for column in model.__table__.columns if isinstance(column.type, Boolean))
+    for model in (KlineHistory, KlineWindow)
+}
+
+RULE_FUNCTIONS = {
+    'abs': np.abs,
+    'min': lambda *values: reduce(np.minimum, values),
+    'max': lambda *values: reduce(np.maximum, values),
+    'sqrt': np.sqrt,
+    'log': np.log,
+}
+
+# Functions of several values, the others take exactly one
+_REDUCE_FUNCTIONS = ('min', 'max')
+
+DEFAULT_RULES = [
+    {
+        'tag': 'growth',
+        'expression': f'abs(delta_to_min_in_percent) >= {ALARM_THRESHOLD} and '
+                      f'btc_impact_rate <= {BTC_IMPACT_THRESHOLD}',
+        'flag': 'is_growth_over_1_percent',
+    },
+    {
+        'tag': 'decline',
+        'expression': f'abs(delta_to_max_in_percent) >= {ALARM_THRESHOLD} and '
+                      f'btc_impact_rate <= {BTC_IMPACT_THRESHOLD}',
+        'flag': 'is_decline_over_1_percent',
+    },
+]
+
+_BINARY_OPERATORS = (ast.Add, ast.Sub, ast.Mult, ast.Div)
+_COMPARE_OPERATORS = (ast.Lt, ast.LtE, ast.Gt, ast.GtE, ast.Eq, ast.NotEq)
+
+
+def set_flag(holder: KlineHistory | KlineWindow, flag: str) -> None:
+    """
+    Set flag of satisfied rule on kline or tracking window row
+    """
+    if flag in FLAG_COLUMNS[type(holder)]:
+        setattr(holder, flag, True)
+    elif flag not in (holder.flags or ()):
+        holder.flags = (holder.flags or []) + [flag]
+
+
+def _truth(values) -> np.ndarray:
+    """
+    Boolean array from values, missing values (NaN) are false
+    """
+    values = np.asarray(values)
+    if values.dtype == bool:
+        return values
+    return np.nan_to_num(values.astype(float)) != 0
+
+
+class RuleCompiler(ast.NodeTransformer):
+    """
+    Checker and translator of rule expression into numpy expression:
+    and/or/not are replaced by &/|/~, chained comparisons are split into pairs joined by &
+    """
+    def __init__(self, expression: str):
+        self._expression: str = expression
+        self.columns: set = set()
+
+    def _error(self, node: ast.AST, message: str) -> ValueError:
+        return ValueError(f'Rule "{self._expression}": {message} at column {getattr(node, "col_offset", 0) + 1}')
+
+    @staticmethod
+    def _wrap_truth(node: ast.AST) -> ast.AST:
+        return ast.Call(func=ast.Name(id='_truth', ctx=ast.Load()), args=[node], keywords=[])
+
+    def _join(self, operator: ast.operator, nodes: list) -> ast.AST:
+        result = self._wrap_truth(nodes[0])
+        for node in nodes[1:]:
+            result = ast.BinOp(left=result, op=operator, right=self._wrap_truth(node))
+        return result
+
+    def visit_Expression(self, node: ast.Expression) -> ast.AST:
+        node.body = self._wrap_truth(self.visit(node.body))
+        return node
+
+    def visit_BoolOp(self, node: ast.BoolOp) -> ast.AST:
+        return self._join(ast.BitAnd() if isinstance(node.op, ast.And) else ast.BitOr(),
+                          [self.visit(value) for value in node.values])
+
+    def visit_UnaryOp(self, node: ast.UnaryOp) -> ast.AST:
+        if isinstance(node.op, ast.Not):
+            return ast.UnaryOp(op=ast.Invert(), operand=self._wrap_truth(self.visit(node.operand)))
+        if isinstance(node.op, (ast.USub, ast.UAdd)):
+            node.operand = self.visit(node.operand)
+            return node
+        raise self._error(node, 'unsupported operator')
+
+    def visit_BinOp(self, node: ast.BinOp) -> ast.AST:
+        if not isinstance(node.op, _BINARY_OPERATORS):
+            raise self._error(node, 'unsupported operator')
+        node.left, node.right = self.visit(node.left), self.visit(node.right)
+        return node
+
+    def visit_Compare(self, node: ast.Compare) -> ast.AST:
+        operands = [self.visit(node.left)] + [self.visit(value) for value in node.comparators]
+        pairs = []
+        for idx, operator in enumerate(node.ops):
+            if not isinstance(operator, _COMPARE_OPERATORS):
+                raise self._error(node, 'unsupported comparison')
+            pairs.append(ast.Compare(left=operands[idx], ops=[operator], comparators=[operands[idx + 1]]))
+        return pairs[0] if len(pairs) == 1 else self._join(ast.BitAnd(), pairs)
+
+    def visit_Call(self, node: ast.Call) -> ast.AST:
+        if not isinstance(node.func, ast.Name) or node.func.id not in RULE_FUNCTIONS or node.keywords:
+            raise self._error(node, 'unsupported function')
+        if node.func.id in _REDUCE_FUNCTIONS and len(node.args) < 2:
+            raise self._error(node, f'{node.func.id} needs at least 2 arguments')
+        if node.func.id not in _REDUCE_FUNCTIONS and len(node.args) != 1:
+            raise self._error(node, f'{node.func.id} needs exactly 1 argument')
+        node.args = [self.visit(arg) for arg in node.args]
+        return node
+
+    def visit_Name(self, node: ast.Name) -> ast.AST:
+        if node.id not in RULE_COLUMNS:
+            raise self._error(node, f'unknown column "{node.id}"')
+        self.columns.add(node.id)
+        return node
+
+    def visit_Constant(self, node: ast.Constant) -> ast.AST:
+        if not isinstance(node.value, (int, float)):
+            raise self._error(node, 'only numbers are allowed')
+        return node
+
+    def generic_visit(self, node: ast.AST) -> ast.AST:
+        raise self._error(node, f'unsupported syntax "{type(node).__name__}"')
+
+
+class Rule:
+    """
+    Compiled rule: its tag in alerts, flag set on klines which satisfy it and numpy code
+    """
+    def __init__(self, tag: str, expression: str, flag: Optional[str] = None):
+        self.tag: str = tag
+        self.expression: str = expression
+        self.flag: str = flag or f'is_{tag}'
+
+        try:
+            tree = ast.parse(expression, mode='eval')
+        except SyntaxError as e:
+            raise ValueError(f'Rule "{expression}": {e.msg}')
+        compiler = RuleCompiler(expression)
+        tree = ast.fix_missing_locations(compiler.visit(tree))
+        self.columns: frozenset = frozenset(compiler.columns)
+        self._code = compile(tree, f'<rule {tag}>', 'eval')
+
+    def evaluate(self, columns: dict, size: int) -> np.ndarray:
+        """
+        Boolean mask of rows which satisfy the rule
+        """
+        with np.errstate(all='ignore'):
+            mask = eval(self._code, {'__builtins__': {}, '_truth': _truth, **RULE_FUNCTIONS}, columns)
+        return np.broadcast_to(mask, (size,))
+
+
+class RuleSet:
+    """
+    Rules evaluated together: columns used by any of them are gathered from klines once per evaluation
+    """
+    def __init__(self, rules: list[Rule]):
+        self.rules: list = rules
+        self.columns: frozenset = frozenset().union(*(rule.columns for rule in rules))
+
+    @classmethod
+    def from_config(cls, rules_file: Optional[str] = RULES_FILE) -> 'RuleSet':
+        """
+        Compile rules of RULES_FILE or default ones, wrong rule stops the program at start
+        """
+        entries = DEFAULT_RULES
+        if rules_file:
+            with open(rules_file) as file:
+                entries = json.load(file)
+        return cls([Rule(entry['tag'], entry['expression'], entry.get('flag')) for entry in entries])
+
+    def _get_columns(self, rows: list) -> dict:
+        """
+        Arrays of used columns, row is pair of kline and its indicators holder (kline itself or window row),
+        columns which window rows haven't are taken from kline, missing values are NaN
+        Arrays are filled in one pass over rows without intermediate lists
+        """
+        columns = dict()
+        sources = []
+        for name in sorted(self.columns):
+            columns[name] = np.zeros(len(rows), dtype=bool) if name in BOOLEAN_COLUMNS else np.full(len(rows), np.nan)
+            sources.append((columns[name], name, name in WINDOW_COLUMNS,
+                            TRACKING_PERIOD if name == 'tracking_period' else None))
+        for idx, (kline, holder) in enumerate(rows):
+            for column, name, is_window_column, default in sources:
+                value = getattr(holder if is_window_column else kline, name, default)
+                if value is not None:
+                    column[idx] = value
+        return columns
+
+    def evaluate(self, rows: list) -> list[tuple[Rule, np.ndarray]]:
+        """
+        Evaluate all rules for rows of klines, return rules with masks of rows which satisfy them
+        Column arrays are built once and shared by all rules
+        """
+        if not rows:
+            return []
+        columns = self._get_columns(rows)
+        return [(rule, rule.evaluate(columns, len(rows))) for rule in self.rules]
+
+    def __len__(self):
+        return len(self.rules)
@@ -10,6 +10,7 @@ import typing
 
 from crontab import CronTab
 
+from app.clock import get_clock
 from app.config import ADDED_DELAY
 
 
@@ -81,9 +82,11 @@ class Job:
                 self._is_active = False
                 return
 
-        delay = self._schedule_entry.next(default_utc=True)
+        # Schedule is run by the clock of the program, it may be faster than real one
+        clock = get_clock()
+        delay = self._schedule_entry.next(now=clock.now(), default_utc=True)
         if delay:
-            await asyncio.sleep(delay + self._delay + ADDED_DELAY)
+            await clock.sleep(delay + self._delay + ADDED_DELAY)
             asyncio.create_task(self.run(is_first_run=False))
 
     def stop(self):
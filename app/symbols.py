@@ -0,0 +1,201 @@
+"""
+In-memory registry of tracked symbols
+It is refreshed periodically from exchange instruments info, so the main handler never queries symbols in database
+"""
+
+import aiohttp
+from sqlalchemy import select, update
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.ext.asyncio import async_sessionmaker
+
+from app.aiohttp_handlers import request_async
+from app.bybit import Bybit
+from app.config import SYMBOLS, BASE_SYMBOLS, LIMIT_PER_HOST, LIMIT, TTL_DNS_CACHE, CATEGORIES, BTC_SYMBOL_KEYS
+from app.models import Symbol
+from app.utils import ftod, get_symbol_key
+
+# Maximum page size of instruments info (for spot category exchange ignores it and returns all instruments)
+INSTRUMENTS_PAGE_LIMIT = 1000
+
+
+def is_listed(entries: list, category: str, symbol: str) -> bool:
+    """
+    Check if symbol of category is in list of SYMBOLS/BASE_SYMBOLS entries (bare or category-qualified)
+    """
+    return symbol in entries or f'{category}:{symbol}' in entries
+
+
+def get_base_symbol_keys() -> list[str]:
+    """
+    Keys of symbols which are always tracked: BASE_SYMBOLS in each category and BTC references of categories
+    """
+    symbol_keys = [BTC_SYMBOL_KEYS[category] for category in CATEGORIES]
+    for entry in BASE_SYMBOLS:
+        if ':' in entry:
+            symbol_keys.append(get_symbol_key(*entry.split(':', 1)))
+        else:
+            symbol_keys.extend(get_symbol_key(category, entry) for category in CATEGORIES)
+    return symbol_keys
+
+
+class SymbolRegistry:
+    """
+    Active symbols with their parameters
+    """
+    __object = None
+
+    def __new__(cls, *args, **kwargs):
+        if cls.__object is None:
+            cls.__object = super().__new__(cls)
+        return cls.__object
+
+    def __init__(self):
+        if hasattr(self, '_symbols'):
+            return
+
+        self._symbols: dict = dict()
+
+        # Buffer of instruments info pages received from exchange during refresh
+        self._instruments: list = list()
+        self._next_page_cursor = None
+
+    @property
+    def symbols(self) -> list[str]:
+        return list(self._symbols.keys())
+
+    def __getitem__(self, item) -> Symbol:
+        return self._symbols.get(item)
+
+    def __contains__(self, item):
+        return item in self._symbols
+
+    def __len__(self):
+        return len(self._symbols)
+
+    async def load_from_db(self, async_db_session: async_sessionmaker) -> None:
+        """
+        Fills the registry with active symbols from database
+        """
+        async with async_db_session() as session:
+            symbols = await session.execute(
+                select(Symbol).
+                where(Symbol.is_active)
+            )
+            self._symbols = {s.symbol: s for s in symbols.scalars()}
+
+    def request_result_handler(self, status: int, result: dict) -> None:
+        """
+        Handler of instruments info request results from exchange
+        Collect instruments of page and cursor of the next page
+        """
+        self._next_page_cursor = None
+        if not (200 <= status <= 299):
+            return
+
+        try:
+            if result['retCode'] == 0:
+                category = result['result']['category']
+                for instrument in result['result']['list']:
+                    instrument['category'] = category
+                    self._instruments.append(instrument)
+                self._next_page_cursor = result['result'].get('nextPageCursor') or None
+
+        except Exception as e:
+            pass
+
+    async def _get_instruments(self) -> list:
+        """
+        Get instruments info of all pages of all categories from exchange
+        """
+        self._instruments = list()
+
+        bybit = Bybit()
+        conn = aiohttp.TCPConnector(limit_per_host=LIMIT_PER_HOST, limit=LIMIT, ttl_dns_cache=TTL_DNS_CACHE)
+        aiohttp_session = aiohttp.ClientSession(connector=conn)
+        try:
+            for category in CATEGORIES:
+                self._next_page_cursor = None
+                while True:
+                    await request_async(
+                        aiohttp_session,
+                        *bybit.get_instruments_info(category=category, limit=INSTRUMENTS_PAGE_LIMIT,
+                                                    cursor=self._next_page_cursor),
+                        self
+                    )
+                    if not self._next_page_cursor:
+                        break
+        finally:
+            await conn.close()
+
+        return self._instruments
+
+    @staticmethod
+    def _is_tracked(instrument: dict, base_symbol_keys: list) -> bool:
+        if get_symbol_key(instrument['category'], instrument['symbol']) in base_symbol_keys:
+            return True
+        if '*' in SYMBOLS:
+            return instrument.get('status', 'Trading') == 'Trading'
+        return is_listed(SYMBOLS, instrument['category'], instrument['symbol'])
+
+    @staticmethod
+    def _get_row(instrument: dict) -> dict:
+        """
+        Symbol row from instrument info, spot instruments haven't leverage and price limits
+        """
+        leverage_filter = instrument.get('leverageFilter', dict())
+        price_filter = instrument['priceFilter']
+        lot_size_filter = instrument['lotSizeFilter']
+        return {
+            'symbol': get_symbol_key(instrument['category'], instrument['symbol']),
+            'category': instrument['category'],
+            'name': instrument['symbol'],
+            'min_leverage': ftod(leverage_filter.get('minLeverage', 1), 9),
+            'max_leverage': ftod(leverage_filter.get('maxLeverage', 1), 9),
+            'leverage_step': ftod(leverage_filter.get('leverageStep', 0), 9),
+            'min_price': ftod(price_filter.get('minPrice', 0), 9),
+            'max_price': ftod(price_filter.get('maxPrice', 0), 9),
+            'tick_size': ftod(price_filter['tickSize'], 9),
+            'min_order_qty': ftod(lot_size_filter['minOrderQty'], 9),
+            'max_order_qty': ftod(lot_size_filter['maxOrderQty'], 9),
+            'qty_step': ftod(lot_size_filter.get('qtyStep', lot_size_filter.get('basePrecision')), 9),
+            'is_active': True,
+        }
+
+    async def refresh(self, async_db_session: async_sessionmaker) -> None:
+        """
+        Update/create tracked symbols in database with the newest parameters values from exchange by one statement,
+        deactivate the rest of them and reload the registry
+        If '*' is in SYMBOLS all trading symbols are tracked, so new listings appear automatically
+        Symbols of all categories of CATEGORIES are stored with category-qualified keys
+        """
+        instruments = await self._get_instruments()
+
+        base_symbol_keys = get_base_symbol_keys()
+        rows = [self._get_row(s) for s in instruments if self._is_tracked(s, base_symbol_keys)]
+
+        # Keep symbols as they are if exchange hasn't answered
+        if not rows:
+            if not self._symbols:
+                await self.load_from_db(async_db_session)
+            return
+
+        async with async_db_session() as session:
+
+            # Clear the activate flag of symbols which aren't tracked anymore
+            await session.execute(
+                update(Symbol).
+                where(Symbol.symbol.notin_([row['symbol'] for row in rows] + base_symbol_keys)).
+                values(is_active=False)
+            )
+
+            statement = insert(Symbol).values(rows)
+            await session.execute(
+                statement.on_conflict_do_update(
+                    index_elements=[Symbol.symbol],
+                    set_={key: statement.excluded[key] for key in rows[0].keys() if key != 'symbol'},
+                )
+            )
+
+            await session.commit()
+
+        await self.load_from_db(async_db_session)
@@ -0,0 +1,168 @@
+"""
+Market snapshot ingestion
+Minute klines of all symbols are built from snapshots of tickers endpoint,
+one request per snapshot for all symbols of category. Tickers give only rolling 24-hours volume and turnover,
+so minute volume is their growth since the previous minute plus volume of the minute which left the 24-hours window
+"""
+
+from datetime import datetime, timedelta, timezone
+from decimal import Decimal
+from typing import Iterable, Optional
+
+import numpy as np
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import async_sessionmaker
+
+from app.handlers import Iteration
+from app.models import KlineHistory
+from app.utils import ftod, get_symbol_key
+
+# Minutes of rolling 24-hours volume and turnover of tickers
+DAY_MINUTES = 1440
+
+
+class TickerCandle:
+    """
+    Minute candle of one symbol accumulated from ticker snapshots
+    """
+    def __init__(self, open_price: Decimal):
+        self.open_price: Decimal = open_price
+        self.high_price: Decimal = open_price
+        self.low_price: Decimal = open_price
+        self.close_price: Decimal = open_price
+        self.volume_24h = None
+        self.turnover_24h = None
+        self.start_volumes = None
+
+    def add_sample(self, price: Decimal, volume_24h: Decimal, turnover_24h: Decimal) -> None:
+        if self.start_volumes is None:
+            self.start_volumes = (volume_24h, turnover_24h)
+        self.high_price = max(self.high_price, price)
+        self.low_price = min(self.low_price, price)
+        self.close_price = price
+        self.volume_24h = volume_24h
+        self.turnover_24h = turnover_24h
+
+
+class VolumeHistory:
+    """
+    Minute volumes and turnovers of symbols over the last 24 hours, ring of minutes per symbol
+    """
+    def __init__(self, minutes: int = DAY_MINUTES):
+        self._minutes: int = minutes
+        self._rings: dict = dict()
+
+    def set(self, symbol_key: str, time_kline: datetime, volume: Decimal, turnover: Decimal) -> None:
+        ring = self._rings.get(symbol_key)
+        if ring is None:
+            ring = self._rings[symbol_key] = (np.full(self._minutes, -1, dtype=np.int64),
+                                              np.zeros((self._minutes, 2)))
+        minute = int(time_kline.timestamp()) // 60
+        ring[0][minute % self._minutes] = minute
+        ring[1][minute % self._minutes] = (float(volume), float(turnover))
+
+    def get(self, symbol_key: str, time_kline: datetime) -> Optional[tuple[Decimal, Decimal]]:
+        """
+        Volume and turnover of symbol in the minute, None if they are unknown
+        """
+        ring = self._rings.get(symbol_key)
+        minute = int(time_kline.timestamp()) // 60
+        if ring is None or ring[0][minute % self._minutes] != minute:
+            return None
+        volume, turnover = ring[1][minute % self._minutes]
+        return ftod(volume, 9), ftod(turnover, 9)
+
+
+class TickerSampler:
+    """
+    Accumulator of ticker snapshots
+    Each snapshot updates candles of the minute it was taken at (by exchange time),
+    the candle of finished minute is moved to iteration by flush
+    """
+    def __init__(self):
+        self._candles: dict = dict()
+        self._last_prices: dict = dict()
+        self._last_volumes: dict = dict()
+        self._volume_history: VolumeHistory = VolumeHistory()
+
+    def request_result_handler(self, status: int, result: dict) -> None:
+        """
+        Handler of tickers request result from exchange
+        Update candles of the current minute for each symbol in snapshot
+        """
+        if not (200 <= status <= 299):
+            return
+
+        try:
+            if result['retCode'] == 0:
+                time_sample = datetime.fromtimestamp(int(result['time']) / 1000, tz=timezone.utc)
+                time_kline = datetime(time_sample.year, time_sample.month, time_sample.day, time_sample.hour,
+                                      time_sample.minute, 0, 0, tzinfo=timezone.utc)
+                candles = self._candles.get(time_kline)
+                if candles is None:
+                    candles = self._candles[time_kline] = dict()
+
+                category = result['result']['category']
+                for ticker in result['result']['list']:
+                    symbol_key = get_symbol_key(category, ticker['symbol'])
+                    price = ftod(ticker['lastPrice'], 9)
+                    candle = candles.get(symbol_key)
+                    if candle is None:
+                        # Open price of the minute is the last known price of previous one, as exchange does
+                        candle = candles[symbol_key] = TickerCandle(self._last_prices.get(symbol_key, price))
+                    candle.add_sample(price, ftod(ticker['volume24h'], 9), ftod(ticker['turnover24h'], 9))
+                    self._last_prices[symbol_key] = price
+
+        except Exception as e:
+            pass
+
+    def flush(self, iteration: Iteration, symbols: Iterable[str]) -> None:
+        """
+        Move candles of the iteration minute for tracked symbols to iteration
+        Volume and turnover are growth of rolling 24-hours values since the previous minute plus volume and turnover
+        of the minute which left the 24-hours window. Without the previous minute or the minute which left the window
+        (e.g. during the first day of history) they are estimated by the growth only, clamped at 0
+        """
+        candles = self._candles.pop(iteration.time_kline, dict())
+
+        # Candles of older minutes can't be flushed anymore
+        for time_kline in list(self._candles.keys()):
+            if time_kline < iteration.time_kline:
+                self._candles.pop(time_kline, None)
+
+        for symbol_key in symbols:
+            candle = candles.get(symbol_key)
+            if candle is None:
+                continue
+
+            # Without previous minute the growth is counted since the first snapshot of the minute
+            last_time, last_volume_24h, last_turnover_24h = \
+                self._last_volumes.get(symbol_key, (None, *candle.start_volumes))
+            volume = candle.volume_24h - last_volume_24h
+            turnover = candle.turnover_24h - last_turnover_24h
+            left_volumes = self._volume_history.get(symbol_key, iteration.time_kline - timedelta(minutes=DAY_MINUTES))
+            if last_time == iteration.time_kline - timedelta(minutes=1) and left_volumes is not None:
+                volume += left_volumes[0]
+                turnover += left_volumes[1]
+            volume, turnover = max(volume, ftod(0.0, 9)), max(turnover, ftod(0.0, 9))
+            self._last_volumes[symbol_key] = (iteration.time_kline, candle.volume_24h, candle.turnover_24h)
+            self._volume_history.set(symbol_key, iteration.time_kline, volume, turnover)
+
+            iteration.add_kline(symbol_key, candle.open_price, candle.high_price, candle.low_price,
+                                candle.close_price, volume, turnover)
+
+    async def get_volume_history(self, async_db_session: async_sessionmaker, now: datetime) -> None:
+        """
+        Fills volume history with minute volumes and turnovers of the last 24 hours from database
+        when the program starts
+        """
+        async with async_db_session() as session:
+            volumes = await session.execute(
+                select(KlineHistory.symbol_key, KlineHistory.time_kline, KlineHistory.volume, KlineHistory.turnover).
+                where(KlineHistory.time_kline >= now - timedelta(minutes=DAY_MINUTES + 1))
+            )
+            for symbol_key, time_kline, volume, turnover in volumes:
+                self._volume_history.set(symbol_key, time_kline, volume, turnover)
+
+    def __len__(self):
+        return len(self._candles)
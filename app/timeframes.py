@@ -0,0 +1,249 @@
+"""
+Candles of longer timeframes (5m, 15m, 1h, ...) built incrementally in memory from the 1-minute klines
+of iteration stack, and the same indicators as for 1-minute klines calculated per timeframe
+"""
+
+from datetime import datetime, timedelta
+from decimal import Decimal
+from typing import Optional
+
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import async_sessionmaker
+
+from app.config import BTC_SYMBOL_KEYS, CATEGORIES
+from app.models import KlineHistory, KlineRollup
+from app.rollups import get_bucket_time
+from app.utils import ftod, split_symbol_key
+
+
+class TimeframeKline:
+    """
+    Candle of timeframe merged from 1-minute klines of the same symbol
+    """
+    def __init__(self, symbol_key: str, time_kline: datetime, interval: int):
+        self.symbol_key: str = symbol_key
+        self.time_kline: datetime = time_kline
+        self.interval: int = interval
+
+        self.open_price: Optional[Decimal] = None
+        self.high_price: Optional[Decimal] = None
+        self.low_price: Optional[Decimal] = None
+        self.close_price: Optional[Decimal] = None
+        self.volume: Decimal = ftod(0.0, 9)
+        self.turnover: Decimal = ftod(0.0, 9)
+        self.open_time: Optional[datetime] = None
+        self.close_time: Optional[datetime] = None
+
+        # Bitmap of minutes of the bucket which have been merged (bit n is the n-th minute of the bucket)
+        self._minutes: int = 0
+
+        self.max_price: Optional[Decimal] = None
+        self.delta_to_max: Optional[Decimal] = None
+        self.delta_to_max_in_percent: Optional[Decimal] = None
+        self.time_since_max: Optional[int] = None
+        self.min_price: Optional[Decimal] = None
+        self.delta_to_min: Optional[Decimal] = None
+        self.delta_to_min_in_percent: Optional[Decimal] = None
+        self.time_since_min: Optional[int] = None
+        self.btc_impact_rate: Optional[Decimal] = None
+
+    def merge(self, kline: KlineHistory) -> None:
+        """
+        Merge 1-minute kline into candle
+        Minutes already merged are skipped, so merging them twice is harmless, late minute within the merged time
+        range (missing one) is merged into high, low, volume and turnover
+        """
+        minute = 1 << int((kline.time_kline.timestamp() - self.time_kline.timestamp()) // 60)
+        if self._minutes & minute:
+            return
+        self._minutes |= minute
+
+        if self.open_time is None:
+            self.open_price, self.high_price, self.low_price, self.close_price = \
+                kline.open_price, kline.high_price, kline.low_price, kline.close_price
+            self.volume, self.turnover = kline.volume, kline.turnover
+            self.open_time = self.close_time = kline.time_kline
+            return
+
+        if kline.time_kline < self.open_time:
+            self.open_price = kline.open_price
+            self.open_time = kline.time_kline
+        elif kline.time_kline > self.close_time:
+            self.close_price = kline.close_price
+            self.close_time = kline.time_kline
+        self.high_price = max(self.high_price, kline.high_price)
+        self.low_price = min(self.low_price, kline.low_price)
+        self.volume += kline.volume
+        self.turnover += kline.turnover
+
+    def merge_rollup(self, rollup: KlineRollup) -> None:
+        """
+        Initialize candle from rollup table row when the program starts
+        Minutes of its whole time range are taken as merged: rollup doesn't tell which ones are missing
+        """
+        self.open_price, self.high_price, self.low_price, self.close_price = \
+            rollup.open_price, rollup.high_price, rollup.low_price, rollup.close_price
+        self.volume, self.turnover = rollup.volume, rollup.turnover
+        self.open_time, self.close_time = rollup.open_time, rollup.close_time
+
+        first = int((rollup.open_time.timestamp() - self.time_kline.timestamp()) // 60)
+        last = int((rollup.close_time.timestamp() - self.time_kline.timestamp()) // 60)
+        self._minutes = ((1 << (last - first + 1)) - 1) << first
+
+    def __str__(self):
+        return f'{self.time_kline} - {self.symbol_key} [{self.interval}m]: (' \
+               f'O={self.open_price}, H={self.high_price}, ' \
+               f'L={self.low_price}, C={self.close_price}, ' \
+               f'V={self.volume}, T={self.turnover}, ' \
+               f'B={self.btc_impact_rate})'
+
+
+class Timeframe:
+    """
+    Candles of one timeframe for all symbols over its tracking period
+    """
+    def __init__(self, interval: int, tracking_period: int):
+        self.interval: int = interval
+        self.tracking_period: int = tracking_period
+        self._candles: dict = dict()
+
+    def __getitem__(self, item) -> dict:
+        return self._candles.get(item)
+
+    def __len__(self):
+        return len(self._candles)
+
+    @property
+    def candles(self) -> dict:
+        return self._candles
+
+    def _get_candle(self, symbol_key: str, time_kline: datetime) -> TimeframeKline:
+        bucket_time = get_bucket_time(time_kline, self.interval)
+        candles = self._candles.get(bucket_time)
+        if candles is None:
+            candles = self._candles[bucket_time] = dict()
+        candle = candles.get(symbol_key)
+        if candle is None:
+            candle = candles[symbol_key] = TimeframeKline(symbol_key, bucket_time, self.interval)
+        return candle
+
+    def add_kline(self, kline: KlineHistory) -> None:
+        """
+        Merge 1-minute kline into the candle of its bucket
+        """
+        self._get_candle(kline.symbol_key, kline.time_kline).merge(kline)
+
+    def add_rollup(self, rollup: KlineRollup) -> None:
+        """
+        Add candle stored in rollup table
+        """
+        self._get_candle(rollup.symbol_key, rollup.time_kline).merge_rollup(rollup)
+
+    def _get_window(self, bucket_time: datetime) -> list:
+        start_time = bucket_time - timedelta(minutes=self.interval * self.tracking_period)
+        return [candles for time_kline, candles in self._candles.items() if start_time <= time_kline <= bucket_time]
+
+    def _set_max_min(self, candle: TimeframeKline, window: list) -> None:
+        """
+        Calculate max/min indicators for candle over the candles of tracking period
+        """
+
+        def minutes_diff(finish_time: datetime, start_time: datetime) -> int:
+            return int((finish_time.timestamp() - start_time.timestamp()) / 60)
+
+        current_price = candle.close_price
+        max_price, max_time = candle.high_price, candle.time_kline
+        min_price, min_time = candle.low_price, candle.time_kline
+        for candles in window:
+            window_candle = candles.get(candle.symbol_key)
+            if window_candle:
+                if window_candle.high_price > max_price:
+                    max_price, max_time = window_candle.high_price, window_candle.time_kline
+                if window_candle.low_price < min_price:
+                    min_price, min_time = window_candle.low_price, window_candle.time_kline
+
+        candle.max_price = max_price
+        candle.delta_to_max = current_price - max_price
+        candle.delta_to_max_in_percent = candle.delta_to_max / max_price
+        candle.time_since_max = minutes_diff(candle.time_kline, max_time)
+        candle.min_price = min_price
+        candle.delta_to_min = current_price - min_price
+        candle.delta_to_min_in_percent = candle.delta_to_min / min_price
+        candle.time_since_min = minutes_diff(candle.time_kline, min_time)
+
+    @staticmethod
+    def _get_btc_impact_rate(candle: TimeframeKline, btc_candle: TimeframeKline, window: list) -> Optional[Decimal]:
+        """
+        Calculate BTC impact over the candles of tracking period
+        Use the linear deviation method
+        """
+
+        def get_normal_value(value: Decimal, min_value: Decimal, max_value: Decimal) -> Decimal:
+            return ftod((value - min_value) / (max_value - min_value), 9) if max_value > min_value else ftod(0.5, 9)
+
+        linear_deviation_sum = ftod(0.0, 9)
+        linear_deviation_count = 0
+
+        for candles in window:
+            window_candle = candles.get(candle.symbol_key)
+            btc_window_candle = candles.get(btc_candle.symbol_key)
+            if window_candle and btc_window_candle:
+                linear_deviation_sum += \
+                    abs(get_normal_value(window_candle.close_price, candle.min_price, candle.max_price) -
+                        get_normal_value(btc_window_candle.close_price, btc_candle.min_price, btc_candle.max_price))
+                linear_deviation_count += 1
+
+        if linear_deviation_count:
+            return ftod(1 - linear_deviation_sum / linear_deviation_count, 9)
+        return None
+
+    def calculate_indicators(self, time_kline: datetime) -> None:
+        """
+        Calculate indicators for each candle of the bucket which the time belongs to
+        """
+        bucket_time = get_bucket_time(time_kline, self.interval)
+        candles = self._candles.get(bucket_time)
+        if not candles:
+            return
+
+        window = self._get_window(bucket_time)
+        for candle in candles.values():
+            self._set_max_min(candle, window)
+
+        # BTC impact of symbol is calculated against BTC reference of its category
+        btc_candles = {category: candles.get(BTC_SYMBOL_KEYS[category]) for category in CATEGORIES}
+        for symbol_key, candle in candles.items():
+            category, symbol = split_symbol_key(symbol_key)
+            btc_candle = btc_candles.get(category)
+            if symbol_key == BTC_SYMBOL_KEYS.get(category):
+                candle.btc_impact_rate = ftod(1.0, 9)
+            elif btc_candle:
+                candle.btc_impact_rate = self._get_btc_impact_rate(candle, btc_candle, window)
+            else:
+                candle.btc_impact_rate = ftod(0.0, 9)
+
+    def garbage_collector(self, now: datetime) -> None:
+        """
+        Delete candles older than tracking period
+        """
+        oldest_allowed_datetime = get_bucket_time(now, self.interval) - \
+            timedelta(minutes=self.interval * (self.tracking_period + 1))
+        for bucket_time in list(self._candles.keys()):
+            if bucket_time < oldest_allowed_datetime:
+                self._candles.pop(bucket_time, None)
+
+    async def get_rollup_history(self, async_db_session: async_sessionmaker, now: datetime) -> None:
+        """
+        Fills the timeframe with candles of rollup table when the program starts
+        """
+        oldest_allowed_datetime = get_bucket_time(now, self.interval) - \
+            timedelta(minutes=self.interval * self.tracking_period)
+
+        async with async_db_session() as session:
+            rollups = await session.execute(
+                select(KlineRollup).
+                where(KlineRollup.interval == self.interval).
+                where(KlineRollup.time_kline >= oldest_allowed_datetime)
+            )
+            for rollup in rollups.scalars():
+                self.add_rollup(rollup)
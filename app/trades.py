@@ -0,0 +1,193 @@
+"""
+Public trades ingestion
+Recent trades of each symbol are polled several times per minute, deduplicated by trade id and aggregated
+incrementally into per-minute buckets: VWAP, buy/sell volume and trades count. Buckets of the iteration minute
+are moved to its klines by flush. Memory is bounded: only ids of the latest trades of each symbol and buckets
+of not flushed minutes are kept
+"""
+
+from collections import deque
+from datetime import datetime, timedelta, timezone
+from decimal import Decimal
+from typing import Iterable, Optional
+
+from app.config import TRADES_DEDUP_SIZE
+from app.handlers import Iteration
+from app.logger import get_logger
+from app.utils import ftod, get_symbol_key
+
+logger = get_logger('trades')
+
+# Maximum number of recent trades in one answer of exchange by category
+TRADES_LIMITS = {'spot': 60}
+TRADES_DEFAULT_LIMIT = 1000
+
+
+def get_trades_limit(category: str) -> int:
+    return TRADES_LIMITS.get(category, TRADES_DEFAULT_LIMIT)
+
+
+class TradeBucket:
+    """
+    Trades of one symbol in one minute
+    """
+    def __init__(self):
+        self.trades_count: int = 0
+        self.volume: Decimal = ftod(0.0, 9)
+        self.turnover: Decimal = ftod(0.0, 9)
+        self.buy_volume: Decimal = ftod(0.0, 9)
+        self.sell_volume: Decimal = ftod(0.0, 9)
+
+    def add_trade(self, price: Decimal, size: Decimal, side: str) -> None:
+        self.trades_count += 1
+        self.volume += size
+        self.turnover += price * size
+        if side == 'Buy':
+            self.buy_volume += size
+        else:
+            self.sell_volume += size
+
+    @property
+    def vwap(self) -> Optional[Decimal]:
+        return ftod(self.turnover / self.volume, 9) if self.volume else None
+
+    @property
+    def imbalance(self) -> Optional[Decimal]:
+        """
+        Buy/sell volume imbalance from -1 (only sells) to 1 (only buys)
+        """
+        return ftod((self.buy_volume - self.sell_volume) / self.volume, 9) if self.volume else None
+
+
+class SeenTrades:
+    """
+    Ids of the latest trades of symbol, the oldest ids are forgotten when size is exceeded
+    """
+    def __init__(self, size: int):
+        self._ids: set = set()
+        self._order: deque = deque()
+        self._size: int = size
+        self.last_time: Optional[datetime] = None
+
+        # Exchange time of the latest answer with trades of symbol, minutes before it are covered by polls
+        self.polled_time: Optional[datetime] = None
+
+    def add(self, trade_id: str) -> bool:
+        """
+        Remember trade id, return False if it has been seen already
+        """
+        if trade_id in self._ids:
+            return False
+        self._ids.add(trade_id)
+        self._order.append(trade_id)
+        if len(self._order) > self._size:
+            self._ids.discard(self._order.popleft())
+        return True
+
+
+class TradeAggregator:
+    """
+    Accumulator of public trades of all symbols
+    """
+    def __init__(self, dedup_size: int = TRADES_DEDUP_SIZE):
+        self._dedup_size: int = dedup_size
+        self._buckets: dict = dict()
+        self._seen: dict = dict()
+        self._flushed_time: Optional[datetime] = None
+
+        # Counters of trades which came after their minute had been flushed and of polls which didn't overlap
+        # with the previous poll (some trades could be missed between them)
+        self.late_count: int = 0
+        self.gaps_count: int = 0
+
+    def request_result_handler(self, status: int, result: dict) -> None:
+        """
+        Handler of recent trades request result from exchange
+        Add new trades of symbol to buckets of their minutes
+        """
+        if not (200 <= status <= 299):
+            return
+
+        try:
+            if result['retCode'] == 0 and result['result']['list']:
+                category = result['result']['category']
+                trades = result['result']['list']
+                symbol_key = get_symbol_key(category, trades[0]['symbol'])
+                seen = self._seen.get(symbol_key)
+                if seen is None:
+                    seen = self._seen[symbol_key] = SeenTrades(self._dedup_size)
+
+                new_count = 0
+                last_time = seen.last_time
+                if result.get('time'):
+                    polled_time = datetime.fromtimestamp(int(result['time']) / 1000, tz=timezone.utc)
+                    if seen.polled_time is None or polled_time > seen.polled_time:
+                        seen.polled_time = polled_time
+                for trade in trades:
+                    if not seen.add(trade['execId']):
+                        continue
+                    new_count += 1
+
+                    time_trade = datetime.fromtimestamp(int(trade['time']) / 1000, tz=timezone.utc)
+                    time_kline = time_trade.replace(second=0, microsecond=0)
+                    if seen.last_time is None or time_trade > seen.last_time:
+                        seen.last_time = time_trade
+                    if self._flushed_time is not None and time_kline <= self._flushed_time:
+                        self.late_count += 1
+                        continue
+
+                    buckets = self._buckets.get(time_kline)
+                    if buckets is None:
+                        buckets = self._buckets[time_kline] = dict()
+                    bucket = buckets.get(symbol_key)
+                    if bucket is None:
+                        bucket = buckets[symbol_key] = TradeBucket()
+                    bucket.add_trade(ftod(trade['price'], 9), ftod(trade['size'], 9), trade['side'])
+
+                # Full answer of new trades only: trades between the previous poll and this one may be lost
+                if last_time is not None and new_count == len(trades) >= get_trades_limit(category):
+                    self.gaps_count += 1
+
+        except Exception as e:
+            logger.exception('Recent trades result error')
+
+    def flush(self, iteration: Iteration, symbols: Iterable[str]) -> None:
+        """
+        Set trade indicators of klines of the iteration minute from buckets of the minute
+        Trades count of symbol without trades is 0 only if its trades have been polled after the minute finished,
+        otherwise (e.g. poll failed) trade indicators are left unknown
+        """
+        buckets = self._buckets.pop(iteration.time_kline, dict())
+        self._flushed_time = iteration.time_kline if self._flushed_time is None \
+            else max(self._flushed_time, iteration.time_kline)
+
+        # Buckets of older minutes can't be flushed anymore
+        for time_kline in list(self._buckets.keys()):
+            if time_kline < iteration.time_kline:
+                self._buckets.pop(time_kline, None)
+
+        symbols = set(symbols)
+        for symbol_key in symbols:
+            kline = iteration[symbol_key]
+            if kline is None:
+                continue
+            bucket = buckets.get(symbol_key)
+            if bucket is None:
+                seen = self._seen.get(symbol_key)
+                if seen is not None and seen.polled_time is not None and \
+                        seen.polled_time >= iteration.time_kline + timedelta(minutes=1):
+                    kline.trades_count = 0
+                continue
+            kline.vwap = bucket.vwap
+            kline.buy_volume = bucket.buy_volume
+            kline.sell_volume = bucket.sell_volume
+            kline.trade_imbalance = bucket.imbalance
+            kline.trades_count = bucket.trades_count
+
+        # Trade ids of symbols which aren't tracked anymore are forgotten
+        for symbol_key in list(self._seen.keys()):
+            if symbol_key not in symbols:
+                self._seen.pop(symbol_key, None)
+
+    def __len__(self):
+        return len(self._buckets)
@@ -8,3 +8,29 @@ def ftod(value, precision=15):
     if value is None:
         value = 0.00
     return Decimal(value).quantize(Decimal(10) ** -precision)
+
+
+def get_percentile(sorted_values: list, percentile: float):
+    """
+    Nearest-rank percentile of sorted values
+    """
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * percentile / 100))]
+
+
+# Category of exchange whose symbols keys are not qualified (keys of linear symbols are bare symbol names)
+DEFAULT_CATEGORY = 'linear'
+
+
+def get_symbol_key(category: str, symbol: str) -> str:
+    """
+    Category-qualified symbol key: 'BTCUSDT' for linear category, 'spot:BTCUSDT' for others
+    """
+    return symbol if category == DEFAULT_CATEGORY else f'{category}:{symbol}'
+
+
+def split_symbol_key(symbol_key: str) -> tuple[str, str]:
+    """
+    Category and symbol name of symbol key
+    """
+    category, separator, symbol = symbol_key.rpartition(':')
+    return (category, symbol) if separator else (DEFAULT_CATEGORY, symbol)
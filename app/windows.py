@@ -0,0 +1,225 @@
+"""
+Incremental max/min structures over the history of one symbol: monotonic queues shared by all tracking windows
+and range index for arbitrary time ranges
+"""
+
+from bisect import bisect_left
+from datetime import datetime, timedelta, timezone
+from decimal import Decimal
+from typing import Optional
+
+from app.models import KlineHistory
+from app.utils import ftod
+
+
+class MonotonicQueue:
+    """
+    Queue of (time, price) where prices are monotonic from the oldest to the newest entry
+    It keeps only klines which are extremum of some window ending at the newest kline, so windows are nested:
+    the extremum of window started at any time is the first entry not older than that time
+    """
+    def __init__(self, is_max: bool):
+        self._is_max: bool = is_max
+        self._times: list = list()
+        self._prices: list = list()
+        self._head: int = 0
+
+    def push(self, time_kline: datetime, price: Decimal) -> None:
+        """
+        Add the newest price, dropping entries which can't be extremum anymore
+        Equal older prices are kept, so the oldest kline wins ties
+        """
+        while len(self._times) > self._head and \
+                (self._prices[-1] < price if self._is_max else self._prices[-1] > price):
+            self._times.pop()
+            self._prices.pop()
+        self._times.append(time_kline)
+        self._prices.append(price)
+
+    def trim(self, oldest_allowed_datetime: datetime) -> None:
+        """
+        Drop entries older than the longest window
+        """
+        while self._head < len(self._times) and self._times[self._head] < oldest_allowed_datetime:
+            self._head += 1
+
+        # Compact storage when the most part of it is dropped
+        if self._head > 64 and self._head * 2 > len(self._times):
+            del self._times[:self._head]
+            del self._prices[:self._head]
+            self._head = 0
+
+    def get(self, start_time: datetime) -> tuple[Optional[datetime], Optional[Decimal]]:
+        """
+        Extremum (time and price) of the window started at start_time and ended at the newest entry
+        """
+        idx = bisect_left(self._times, start_time, lo=self._head)
+        if idx < len(self._times):
+            return self._times[idx], self._prices[idx]
+        return None, None
+
+    def __len__(self):
+        return len(self._times) - self._head
+
+
+class MaxMinHistory:
+    """
+    Highs and lows of one symbol over the longest tracking window
+    Each new kline costs amortized O(1), each window query costs O(log n)
+    """
+    def __init__(self, period: int):
+        self._period: int = period
+        self._max_queue: MonotonicQueue = MonotonicQueue(is_max=True)
+        self._min_queue: MonotonicQueue = MonotonicQueue(is_max=False)
+        self.last_kline: Optional[KlineHistory] = None
+
+    def can_push(self, kline: KlineHistory) -> bool:
+        return self.last_kline is None or kline.time_kline > self.last_kline.time_kline
+
+    def push(self, kline: KlineHistory) -> None:
+        """
+        Add the newest kline, klines must be pushed in chronological order
+        """
+        self._max_queue.push(kline.time_kline, kline.high_price)
+        self._min_queue.push(kline.time_kline, kline.low_price)
+        self.last_kline = kline
+
+        oldest_allowed_datetime = kline.time_kline - timedelta(minutes=self._period)
+        self._max_queue.trim(oldest_allowed_datetime)
+        self._min_queue.trim(oldest_allowed_datetime)
+
+    def get_max(self, start_time: datetime) -> tuple[Optional[datetime], Optional[Decimal]]:
+        return self._max_queue.get(start_time)
+
+    def get_min(self, start_time: datetime) -> tuple[Optional[datetime], Optional[Decimal]]:
+        return self._min_queue.get(start_time)
+
+
+def _to_minute(time_kline: datetime) -> int:
+    return int(time_kline.timestamp()) // 60
+
+
+def _from_minute(minute: int) -> datetime:
+    return datetime.fromtimestamp(minute * 60, tz=timezone.utc)
+
+
+def _max_of(value: Optional[tuple], other: Optional[tuple]) -> Optional[tuple]:
+    return value if other is None else other if value is None else max(value, other)
+
+
+def _min_of(value: Optional[tuple], other: Optional[tuple]) -> Optional[tuple]:
+    return value if other is None else other if value is None else min(value, other)
+
+
+class RangeMaxMinIndex:
+    """
+    Segment trees of high and low prices over a ring of minutes of one symbol
+    Max/min of any range [t1, t2] within the last capacity minutes is found in O(log n),
+    klines may be set in any order (late klines too). Ties are won by the oldest kline
+    """
+    def __init__(self, capacity: int):
+        self._size: int = 1 << max(0, capacity - 1).bit_length()
+        # Leaves of max tree are (high, -minute), of min tree are (low, minute), so max/min of tuples prefers older
+        self._max: list = [None] * (2 * self._size)
+        self._min: list = [None] * (2 * self._size)
+        self._newest: Optional[int] = None
+
+    @property
+    def capacity(self) -> int:
+        return self._size
+
+    @property
+    def newest_time(self) -> Optional[datetime]:
+        return _from_minute(self._newest) if self._newest is not None else None
+
+    @property
+    def oldest_time(self) -> Optional[datetime]:
+        return _from_minute(self._newest - self._size + 1) if self._newest is not None else None
+
+    def _set(self, position: int, max_value: Optional[tuple], min_value: Optional[tuple]) -> None:
+        position += self._size
+        self._max[position], self._min[position] = max_value, min_value
+        position //= 2
+        while position:
+            self._max[position] = _max_of(self._max[2 * position], self._max[2 * position + 1])
+            self._min[position] = _min_of(self._min[2 * position], self._min[2 * position + 1])
+            position //= 2
+
+    def set(self, time_kline: datetime, high_price: Decimal, low_price: Decimal) -> None:
+        """
+        Set prices of minute, minutes skipped since the newest one are cleared as the ring moves forward
+        """
+        minute = _to_minute(time_kline)
+        if self._newest is not None:
+            if minute <= self._newest - self._size:
+                return
+            for skipped in range(max(self._newest + 1, minute - self._size + 1), minute):
+                self._set(skipped % self._size, None, None)
+        if self._newest is None or minute > self._newest:
+            self._newest = minute
+        self._set(minute % self._size, (high_price, -minute), (low_price, minute))
+
+    def _query(self, left: int, right: int) -> tuple[Optional[tuple], Optional[tuple]]:
+        max_value, min_value = None, None
+        left += self._size
+        right += self._size + 1
+        while left < right:
+            if left & 1:
+                max_value, min_value = _max_of(max_value, self._max[left]), _min_of(min_value, self._min[left])
+                left += 1
+            if right & 1:
+                right -= 1
+                max_value, min_value = _max_of(max_value, self._max[right]), _min_of(min_value, self._min[right])
+            left //= 2
+            right //= 2
+        return max_value, min_value
+
+    def get_max_min(self, start_time: datetime, end_time: datetime) \
+            -> tuple[Optional[datetime], Optional[Decimal], Optional[datetime], Optional[Decimal]]:
+        """
+        Time and price of max high and min low in range [start_time, end_time] (clamped to the ring)
+        """
+        if self._newest is None:
+            return None, None, None, None
+        first = max(_to_minute(start_time), self._newest - self._size + 1)
+        last = min(_to_minute(end_time), self._newest)
+        if first > last:
+            return None, None, None, None
+
+        left, right = first % self._size, last % self._size
+        if left <= right:
+            max_value, min_value = self._query(left, right)
+        else:
+            max_value, min_value = self._query(left, self._size - 1)
+            max_tail, min_tail = self._query(0, right)
+            max_value, min_value = _max_of(max_value, max_tail), _min_of(min_value, min_tail)
+
+        if max_value is None:
+            return None, None, None, None
+        return _from_minute(-max_value[1]), max_value[0], _from_minute(min_value[1]), min_value[0]
+
+    def get_largest_move(self, window: int, start_time: datetime, end_time: datetime) -> Optional[dict]:
+        """
+        The largest price range (max high to min low, in percent of low) over windows of window minutes
+        ending in [start_time, end_time], windows are clamped to the ring, so the loop is bounded by its capacity
+        """
+        best, best_move = None, None
+        if self._newest is None:
+            return None
+        first = max(_to_minute(start_time), self._newest - self._size + 1)
+        last = min(_to_minute(end_time), self._newest)
+        for window_end in range(first + window - 1, last + 1):
+            window_start = window_end - window + 1
+            max_time, max_price, min_time, min_price = \
+                self.get_max_min(_from_minute(window_start), _from_minute(window_end))
+            if max_price is None or not min_price:
+                continue
+            move = (max_price - min_price) / min_price
+            if best is None or move > best_move:
+                best_move = move
+                best = {
+                    'start_time': _from_minute(window_start), 'end_time': _from_minute(window_end),
+                    'max_time': max_time, 'max_price': max_price, 'min_time': min_time, 'min_price': min_price,
+                    'move': ftod(move, 9), 'direction': 'growth' if min_time <= max_time else 'decline',
+                }
+        return best
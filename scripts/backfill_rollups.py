@@ -0,0 +1,21 @@
+import asyncio
+
+from app.config import ROLLUP_INTERVALS
+from app.models import get_async_session
+from app.rollups import rebuild_rollups
+
+
+async def main():
+
+    async_db_session = get_async_session()
+
+    # Rebuild each rollup table from raw kline history, one transaction per interval
+    for interval in ROLLUP_INTERVALS:
+        async with async_db_session() as session:
+            await rebuild_rollups(session, interval)
+            await session.commit()
+        print(f'Rollup {interval}m has been rebuilt')
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
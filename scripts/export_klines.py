@@ -0,0 +1,143 @@
+"""
+Export of kline history to Parquet files for analytics
+Table is streamed by server-side cursor in chunks in primary key order (symbol, time), so only klines of one
+symbol and day are kept in memory. Files are partitioned by day, category and symbol (names have no ':'):
+    <EXPORT_DIR>/date=YYYY-MM-DD/category=XXX/symbol=XXX/<watermark>.parquet
+Export is incremental: each run exports klines newer than watermark of the previous run and older than
+EXPORT_DELAY minutes (late klines of the last minutes have to be saved), and then moves watermark.
+
+Usage: python -m scripts.export_klines [--full]
+    --full  ignore watermark and export the whole table, it is written to temporary directory which replaces
+            EXPORT_DIR at the end, so files of previous exports don't duplicate klines
+"""
+
+import asyncio
+import json
+import os
+import shutil
+import sys
+from datetime import datetime, timedelta, timezone
+from typing import Optional
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+from sqlalchemy import select, Numeric, Integer, Boolean, DateTime, ARRAY
+
+from app.config import EXPORT_DIR, EXPORT_CHUNK_SIZE, EXPORT_DELAY
+from app.models import get_async_session, KlineHistory
+from app.utils import split_symbol_key
+
+WATERMARK_FILE = 'watermark.json'
+
+
+def get_schema() -> pa.Schema:
+    """
+    Arrow schema from kline_history table columns, numeric columns are exported as exact decimals
+    """
+    fields = []
+    for column in KlineHistory.__table__.columns:
+        if isinstance(column.type, Numeric):
+            arrow_type = pa.decimal128(column.type.precision, column.type.scale)
+        elif isinstance(column.type, Boolean):
+            arrow_type = pa.bool_()
+        elif isinstance(column.type, Integer):
+            arrow_type = pa.int32()
+        elif isinstance(column.type, DateTime):
+            arrow_type = pa.timestamp('us', tz='UTC')
+        elif isinstance(column.type, ARRAY):
+            arrow_type = pa.list_(pa.string())
+        else:
+            arrow_type = pa.string()
+        fields.append(pa.field(column.name, arrow_type, nullable=column.nullable))
+    return pa.schema(fields)
+
+
+def read_watermark(export_dir: str) -> Optional[datetime]:
+    path = os.path.join(export_dir, WATERMARK_FILE)
+    if not os.path.exists(path):
+        return None
+    with open(path) as file:
+        return datetime.fromisoformat(json.load(file)['watermark'])
+
+
+def write_watermark(export_dir: str, watermark: datetime) -> None:
+    with open(os.path.join(export_dir, WATERMARK_FILE), 'w') as file:
+        json.dump({'watermark': watermark.isoformat()}, file)
+
+
+def write_partition(export_dir: str, schema: pa.Schema, symbol_key: str, day: str, rows: list,
+                    file_name: str) -> None:
+    """
+    Write klines of one symbol and day to Parquet file, file is replaced atomically
+    """
+    category, symbol = split_symbol_key(symbol_key)
+    directory = os.path.join(export_dir, f'date={day}', f'category={category}', f'symbol={symbol}')
+    os.makedirs(directory, exist_ok=True)
+    table = pa.Table.from_pylist(rows, schema=schema)
+    path = os.path.join(directory, file_name)
+    pq.write_table(table, path + '.tmp', compression='zstd')
+    os.replace(path + '.tmp', path)
+
+
+async def main():
+
+    full = '--full' in sys.argv[1:]
+    os.makedirs(EXPORT_DIR, exist_ok=True)
+
+    # Full export is written to empty temporary directory which replaces EXPORT_DIR after success
+    export_dir = os.path.normpath(EXPORT_DIR) + '.full' if full else EXPORT_DIR
+    if full:
+        shutil.rmtree(export_dir, ignore_errors=True)
+        os.makedirs(export_dir)
+
+    since = None if full else read_watermark(export_dir)
+    now = datetime.now(tz=timezone.utc).replace(second=0, microsecond=0)
+    till = now - timedelta(minutes=EXPORT_DELAY)
+    if since is not None and since >= till:
+        print('Nothing to export')
+        return
+
+    # File name is given by watermark, so export repeated after failure replaces files of failed run
+    file_name = f'{since.strftime("%Y%m%d%H%M") if since else "full"}.parquet'
+
+    schema = get_schema()
+    columns = [column.name for column in KlineHistory.__table__.columns]
+
+    query = select(KlineHistory.__table__).where(KlineHistory.time_kline < till)
+    if since is not None:
+        query = query.where(KlineHistory.time_kline >= since)
+    query = query.order_by(KlineHistory.symbol_key, KlineHistory.time_kline)
+
+    async_db_session = get_async_session()
+    partition_key, rows = None, []
+    rows_count = files_count = 0
+    async with async_db_session() as session:
+        result = await session.stream(query.execution_options(yield_per=EXPORT_CHUNK_SIZE))
+        async for chunk in result.partitions():
+            for row in chunk:
+                row = dict(zip(columns, row))
+                key = (row['symbol_key'], row['time_kline'].astimezone(timezone.utc).strftime('%Y-%m-%d'))
+                if key != partition_key:
+                    if rows:
+                        write_partition(export_dir, schema, *partition_key, rows, file_name)
+                        files_count += 1
+                    partition_key, rows = key, []
+                rows.append(row)
+                rows_count += 1
+
+    if rows:
+        write_partition(export_dir, schema, *partition_key, rows, file_name)
+        files_count += 1
+
+    write_watermark(export_dir, till)
+    if full:
+        old_dir = os.path.normpath(EXPORT_DIR) + '.old'
+        shutil.rmtree(old_dir, ignore_errors=True)
+        os.replace(EXPORT_DIR, old_dir)
+        os.replace(export_dir, EXPORT_DIR)
+        shutil.rmtree(old_dir)
+    print(f'{rows_count} klines have been exported to {files_count} files, watermark = {till.isoformat()}')
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -0,0 +1,198 @@
+"""
+Local fake exchange for soak test
+It serves market endpoints of Bybit API v.5 used by the program (instruments info, kline, tickers, recent trades)
+with deterministic synthetic prices, volumes with rare spikes and trades. Time of exchange is the clock
+of the program, so with the same CLOCK_* settings it runs as fast as the program. Order endpoints (create, cancel)
+check signature by BYBIT_API_KEY/BYBIT_API_SECRET and acknowledge orders at once. Use it with
+BYBIT_ENDPOINT=http://127.0.0.1:8090
+
+Usage: python -m scripts.fake_exchange [--port 8090] [--symbols 100] [--latency 0.05]
+    --symbols  number of symbols of each category
+    --latency  maximal response delay in real seconds (random from 0)
+"""
+
+import argparse
+import asyncio
+import hashlib
+import hmac
+import json
+import math
+import random
+import uuid
+import zlib
+from typing import Optional
+
+from aiohttp import web
+
+from app.clock import get_clock
+from app.config import BYBIT_API_KEY, BYBIT_API_SECRET
+
+# Seconds between synthetic trades of symbol
+TRADE_INTERVAL = 2
+
+
+def get_symbols(category: str, count: int) -> list[str]:
+    quote = 'USD' if category == 'inverse' else 'USDT'
+    return [f'BTC{quote}', f'ETH{quote}'] + [f'S{idx:04d}{quote}' for idx in range(max(count - 2, 0))]
+
+
+def get_price(symbol: str, timestamp: float) -> float:
+    """
+    Price of symbol at time: base price of symbol with daily and hourly waves and minute noise
+    """
+    seed = zlib.crc32(symbol.encode())
+    base = 10 ** (seed % 5) * (1 + seed % 97 / 100)
+    minute = int(timestamp // 60)
+    noise = random.Random(seed + minute).uniform(-0.002, 0.002)
+    return base * (1 + 0.03 * math.sin(timestamp / 86400 * 2 * math.pi + seed)
+                   + 0.01 * math.sin(timestamp / 3600 * 2 * math.pi + seed / 7) + noise)
+
+
+def get_kline(symbol: str, minute: int) -> list:
+    """
+    Kline of symbol in Bybit format [start, open, high, low, close, volume, turnover]
+    """
+    start = minute * 60
+    prices = [get_price(symbol, start + second) for second in range(0, 60, 5)] + [get_price(symbol, start + 59.999)]
+    rnd = random.Random(zlib.crc32(symbol.encode()) * 7 + minute)
+    volume = rnd.uniform(100, 1000) * (20 if rnd.random() < 0.002 else 1)
+    turnover = volume * sum(prices) / len(prices)
+    return [str(start * 1000), f'{prices[0]:.6f}', f'{max(prices):.6f}', f'{min(prices):.6f}', f'{prices[-1]:.6f}',
+            f'{volume:.4f}', f'{turnover:.4f}']
+
+
+class FakeExchange:
+    """
+    Handlers of fake exchange endpoints, answers are in Bybit format
+    """
+    def __init__(self, symbols_count: int, latency: float):
+        self._symbols_count: int = symbols_count
+        self._latency: float = latency
+        self.requests_count: int = 0
+        self._orders: dict = dict()
+
+    async def _answer(self, category: Optional[str], result: dict, ret_code: int = 0,
+                      ret_msg: str = 'OK') -> web.Response:
+        self.requests_count += 1
+        if self._latency:
+            await asyncio.sleep(random.uniform(0, self._latency))
+        if category is not None:
+            result['category'] = category
+        return web.json_response({
+            'retCode': ret_code,
+            'retMsg': ret_msg,
+            'result': result,
+            'time': int(get_clock().timestamp() * 1000),
+        })
+
+    @staticmethod
+    def _is_signed(request: web.Request, body: str) -> bool:
+        """
+        Check signature of private request as exchange does
+        """
+        if not BYBIT_API_KEY or not BYBIT_API_SECRET or request.headers.get('X-BAPI-API-KEY') != BYBIT_API_KEY:
+            return False
+        param_str = request.headers.get('X-BAPI-TIMESTAMP', '') + BYBIT_API_KEY + \
+            request.headers.get('X-BAPI-RECV-WINDOW', '') + body
+        signature = hmac.new(BYBIT_API_SECRET.encode(), param_str.encode(), hashlib.sha256).hexdigest()
+        return hmac.compare_digest(signature, request.headers.get('X-BAPI-SIGN', ''))
+
+    async def server_time(self, request: web.Request) -> web.Response:
+        timestamp = get_clock().timestamp()
+        return await self._answer(None, {'timeSecond': str(int(timestamp)), 'timeNano': str(int(timestamp * 10 ** 9))})
+
+    async def create_order(self, request: web.Request) -> web.Response:
+        body = await request.text()
+        if not self._is_signed(request, body):
+            return await self._answer(None, {}, 10004, 'error sign!')
+        order = json.loads(body)
+        link_id = order.get('orderLinkId') or str(uuid.uuid4())
+        if link_id in self._orders:
+            return await self._answer(None, {}, 110072, 'OrderLinkedID is duplicate')
+        self._orders[link_id] = order['orderId'] = str(uuid.uuid4())
+        return await self._answer(None, {'orderId': order['orderId'], 'orderLinkId': link_id})
+
+    async def cancel_order(self, request: web.Request) -> web.Response:
+        body = await request.text()
+        if not self._is_signed(request, body):
+            return await self._answer(None, {}, 10004, 'error sign!')
+        order = json.loads(body)
+        link_id = order.get('orderLinkId') or next((key for key, value in self._orders.items()
+                                                    if value == order.get('orderId')), None)
+        if link_id not in self._orders:
+            return await self._answer(None, {}, 110001, 'Order does not exist')
+        return await self._answer(None, {'orderId': self._orders.pop(link_id), 'orderLinkId': link_id})
+
+    async def instruments_info(self, request: web.Request) -> web.Response:
+        category = request.query.get('category', 'linear')
+        instruments = [{
+            'symbol': symbol,
+            'status': 'Trading',
+            'leverageFilter': {'minLeverage': '1', 'maxLeverage': '50', 'leverageStep': '0.01'},
+            'priceFilter': {'minPrice': '0.0001', 'maxPrice': '1000000', 'tickSize': '0.0001'},
+            'lotSizeFilter': {'minOrderQty': '0.001', 'maxOrderQty': '1000000', 'qtyStep': '0.001'},
+        } for symbol in get_symbols(category, self._symbols_count)]
+        return await self._answer(category, {'list': instruments, 'nextPageCursor': ''})
+
+    async def kline(self, request: web.Request) -> web.Response:
+        category, symbol = request.query.get('category', 'linear'), request.query['symbol']
+        limit = int(request.query.get('limit', 200))
+        minute = int(get_clock().timestamp() // 60)
+        klines = [get_kline(symbol, minute - idx) for idx in range(limit)]
+        return await self._answer(category, {'symbol': symbol, 'list': klines})
+
+    async def tickers(self, request: web.Request) -> web.Response:
+        category = request.query.get('category', 'linear')
+        timestamp = get_clock().timestamp()
+        tickers = []
+        for symbol in get_symbols(category, self._symbols_count):
+            # Rolling 24-hours volume just grows in time, so the program gets positive minute volumes
+            volume = (100 + zlib.crc32(symbol.encode()) % 900) * (timestamp % 10 ** 7) / 60
+            tickers.append({
+                'symbol': symbol,
+                'lastPrice': f'{get_price(symbol, timestamp):.6f}',
+                'volume24h': f'{volume:.4f}',
+                'turnover24h': f'{volume * get_price(symbol, timestamp):.4f}',
+            })
+        return await self._answer(category, {'list': tickers})
+
+    async def recent_trade(self, request: web.Request) -> web.Response:
+        category, symbol = request.query.get('category', 'linear'), request.query['symbol']
+        limit = int(request.query.get('limit', 60))
+        last = int(get_clock().timestamp() // TRADE_INTERVAL) * TRADE_INTERVAL
+        trades = []
+        for idx in range(limit):
+            timestamp = last - idx * TRADE_INTERVAL
+            rnd = random.Random(zlib.crc32(symbol.encode()) + timestamp)
+            trades.append({
+                'execId': f'{symbol}-{timestamp}',
+                'symbol': symbol,
+                'price': f'{get_price(symbol, timestamp):.6f}',
+                'size': f'{rnd.uniform(0.001, 10):.3f}',
+                'side': 'Buy' if rnd.random() < 0.5 else 'Sell',
+                'time': str(timestamp * 1000),
+            })
+        return await self._answer(category, {'list': trades})
+
+    def get_application(self) -> web.Application:
+        application = web.Application()
+        application.router.add_get('/v5/market/instruments-info', self.instruments_info)
+        application.router.add_get('/v5/market/kline', self.kline)
+        application.router.add_get('/v5/market/tickers', self.tickers)
+        application.router.add_get('/v5/market/recent-trade', self.recent_trade)
+        application.router.add_get('/v5/market/time', self.server_time)
+        application.router.add_post('/v5/order/create', self.create_order)
+        application.router.add_post('/v5/order/cancel', self.cancel_order)
+        return application
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='Local fake exchange')
+    parser.add_argument('--port', type=int, default=8090)
+    parser.add_argument('--symbols', type=int, default=100)
+    parser.add_argument('--latency', type=float, default=0.00)
+    args = parser.parse_args()
+
+    web.run_app(FakeExchange(args.symbols, args.latency).get_application(), host='127.0.0.1', port=args.port,
+                access_log=None)
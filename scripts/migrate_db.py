@@ -0,0 +1,69 @@
+"""
+Migration of existing database to current models, unlike create_db it keeps the data
+It is idempotent, so it can be run on each deploy: missing tables are created, missing columns are added
+(filled with their defaults, symbol name with symbol), string columns are widened to their model length
+
+Usage: python -m scripts.migrate_db
+"""
+
+import asyncio
+
+from sqlalchemy import String, inspect, text
+
+from app.models import get_engine, Base
+
+# Values of new required columns without default for existing rows (SQL expressions over the row)
+BACKFILL_EXPRESSIONS = {
+    ('symbol', 'name'): 'symbol',
+}
+
+
+def get_migration(conn) -> list[str]:
+    """
+    Statements which bring existing tables to models, tables which don't exist are created by create_all
+    """
+    inspector = inspect(conn)
+    dialect = conn.dialect
+    statements = []
+    for table in Base.metadata.sorted_tables:
+        if not inspector.has_table(table.name):
+            continue
+        existing_columns = {column['name']: column for column in inspector.get_columns(table.name)}
+        for column in table.columns:
+            column_type = column.type.compile(dialect=dialect)
+            existing_column = existing_columns.get(column.name)
+
+            if existing_column is None:
+                # Column is added nullable, it is filled and made required after that
+                statements.append(f'ALTER TABLE {table.name} ADD COLUMN IF NOT EXISTS {column.name} {column_type}')
+                if column.default is not None and column.default.is_scalar:
+                    value = column.default.arg
+                    literal = str(value).upper() if isinstance(value, bool) else repr(value)
+                    statements.append(f'UPDATE {table.name} SET {column.name} = {literal} '
+                                      f'WHERE {column.name} IS NULL')
+                elif (table.name, column.name) in BACKFILL_EXPRESSIONS:
+                    statements.append(f'UPDATE {table.name} '
+                                      f'SET {column.name} = {BACKFILL_EXPRESSIONS[(table.name, column.name)]} '
+                                      f'WHERE {column.name} IS NULL')
+                if not column.nullable:
+                    statements.append(f'ALTER TABLE {table.name} ALTER COLUMN {column.name} SET NOT NULL')
+
+            elif isinstance(column.type, String) and column.type.length and \
+                    (getattr(existing_column['type'], 'length', None) or 0) < column.type.length:
+                statements.append(f'ALTER TABLE {table.name} ALTER COLUMN {column.name} TYPE {column_type}')
+
+    return statements
+
+
+async def main():
+    engine = get_engine()
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+        for statement in await conn.run_sync(get_migration):
+            print(statement)
+            await conn.execute(text(statement))
+    await engine.dispose()
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
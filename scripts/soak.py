@@ -0,0 +1,137 @@
+"""
+Accelerated soak test
+It runs fake exchange and the real program with the same accelerated clock for given number of simulated days
+and reports memory of the program, event loop lag, the slowest iterations and overlapping iterations, so memory
+growth and throughput limits are seen within minutes. Output of the program is written to <SOAK_DIR>/main.log
+Simulated klines run ahead of real time, so the program works with separate throwaway database (other settings
+of .env are used): its tables are recreated at start, the database of .env is refused. Read API of the program
+is switched on, loop lag and iterations are taken from it
+
+Usage: python -m scripts.soak --database NAME [--speed 100] [--days 1] [--symbols 100] [--port 8090]
+                              [--api-port 8091] [--report 60]
+    --database  name of throwaway database on the server of .env, it must exist
+    --report    interval of reports in simulated minutes
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+import urllib.request
+from datetime import datetime, timezone
+from typing import Optional
+
+from app.config import BASE_DIR, DATABASE_NAME
+
+SOAK_DIR = os.path.join(BASE_DIR, 'soak')
+
+
+def get_rss(pid: int) -> float:
+    """
+    Resident memory of process (MB)
+    """
+    try:
+        with open(f'/proc/{pid}/status') as file:
+            for line in file:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return 0.0
+
+
+def get_api(port: int, path: str) -> Optional[dict]:
+    """
+    Answer of read API of the program, None if API isn't started yet or doesn't answer
+    """
+    try:
+        with urllib.request.urlopen(f'http://127.0.0.1:{port}{path}', timeout=5) as response:
+            return json.load(response)
+    except (OSError, ValueError):
+        return None
+
+
+def format_seconds(value: Optional[float]) -> str:
+    return 'n/a' if value is None else f'{value:.3f} s'
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description='Accelerated soak test')
+    parser.add_argument('--database', required=True)
+    parser.add_argument('--speed', type=float, default=100.00)
+    parser.add_argument('--days', type=float, default=1.00)
+    parser.add_argument('--symbols', type=int, default=100)
+    parser.add_argument('--port', type=int, default=8090)
+    parser.add_argument('--api-port', type=int, default=8091)
+    parser.add_argument('--report', type=float, default=60.00)
+    args = parser.parse_args()
+
+    if args.database == DATABASE_NAME:
+        parser.error(f'soak test can\'t use database of .env ({DATABASE_NAME}), give a throwaway one')
+
+    os.makedirs(SOAK_DIR, exist_ok=True)
+
+    # Tables of throwaway database are recreated, so each run starts with empty history
+    env = dict(os.environ, DATABASE_NAME=args.database)
+    subprocess.run([sys.executable, '-m', 'scripts.create_db'], env=env, cwd=BASE_DIR, check=True)
+
+    # Both processes get the same simulated time: it starts from now at the same real moment
+    anchor = time.time()
+    env.update({
+        'CLOCK_SPEED': str(args.speed),
+        'CLOCK_START': datetime.fromtimestamp(anchor, tz=timezone.utc).isoformat(),
+        'CLOCK_ANCHOR': str(anchor),
+        'BYBIT_ENDPOINT': f'http://127.0.0.1:{args.port}',
+        'SYMBOLS': '*',
+        'API_HOST': '127.0.0.1',
+        'API_PORT': str(args.api_port),
+    })
+
+    exchange = subprocess.Popen([sys.executable, '-m', 'scripts.fake_exchange', '--port', str(args.port),
+                                 '--symbols', str(args.symbols)], env=env, cwd=BASE_DIR)
+    log_file = open(os.path.join(SOAK_DIR, 'main.log'), 'w')
+    program = subprocess.Popen([sys.executable, '-m', 'app.main'], env=env, cwd=BASE_DIR,
+                               stdout=log_file, stderr=subprocess.STDOUT)
+
+    duration = args.days * 86400 / args.speed
+    report_interval = args.report * 60 / args.speed
+    rss_values = []
+    print(f'Soak test: {args.days} days at speed {args.speed} takes {duration:.0f} s')
+    try:
+        while time.time() - anchor < duration and program.poll() is None:
+            time.sleep(report_interval)
+            rss = get_rss(program.pid)
+            rss_values.append(rss)
+            loop_lag = get_api(args.api_port, '/loop_lag')
+            profiler = get_api(args.api_port, '/profiler')
+            simulated_minutes = (time.time() - anchor) * args.speed / 60
+            if loop_lag is None or profiler is None:
+                print(f'{simulated_minutes:8.0f} min  rss = {rss:7.1f} MB  read API doesn\'t answer')
+                continue
+            slowest = max((p['total'] for p in profiler.get('slowest', [])), default=None)
+            print(f'{simulated_minutes:8.0f} min  rss = {rss:7.1f} MB  '
+                  f'loop lag p99 = {format_seconds(loop_lag.get("p99"))}  '
+                  f'slowest iteration = {format_seconds(slowest)}')
+    finally:
+        program.terminate()
+        exchange.terminate()
+        program.wait()
+        exchange.wait()
+        log_file.close()
+
+    with open(os.path.join(SOAK_DIR, 'main.log')) as file:
+        overlaps_count = sum('overlaps' in line for line in file)
+
+    # Iteration slower than simulated minute can't keep up with the clock
+    minute_budget = 60 / args.speed
+    print(f'Exit code of the program = {program.returncode}')
+    if rss_values:
+        print(f'Memory: start = {rss_values[0]:.1f} MB, end = {rss_values[-1]:.1f} MB, max = {max(rss_values):.1f} MB')
+    print(f'Overlapping iterations: {overlaps_count}, minute budget = {minute_budget:.3f} s')
+
+
+if __name__ == '__main__':
+    main()
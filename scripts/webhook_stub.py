@@ -0,0 +1,25 @@
+"""
+Local stand-in of alert webhook
+It prints received alerts batches, use it with ALERT_SINKS=webhook and ALERT_WEBHOOK_URL=http://127.0.0.1:8081/alerts
+"""
+
+import json
+import sys
+
+from aiohttp import web
+
+
+async def alerts_handler(request: web.Request) -> web.Response:
+    batch = await request.json()
+    for alert in batch.get('alerts', []):
+        print(json.dumps(alert, ensure_ascii=False))
+    return web.json_response({'received': len(batch.get('alerts', []))})
+
+
+if __name__ == '__main__':
+
+    port = int(sys.argv[1]) if len(sys.argv) > 1 else 8081
+
+    app = web.Application()
+    app.router.add_post('/alerts', alerts_handler)
+    web.run_app(app, host='127.0.0.1', port=port)